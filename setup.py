@@ -49,12 +49,15 @@ DEPENDENCIES = [
     'requests==2.13.0',
     'beautifulsoup4==4.5.3',
     'html5lib==0.999999999',
+    'lxml==3.8.0',
     'PyYAML==3.12',
     'Pillow==4.1.0'
 ]
 SRC_FILES = [os.path.join('src/', name) for name in os.listdir('src/') if os.path.splitext(name)[1] == '.py']
 REPAIRS = [
     (r'^DB_PATH.*#', "DB_PATH = '{:s}'  #".format(os.path.join(DATA_DIR, 'cache.db'))),
+    (r'^SOCKET_PATH.*#', "SOCKET_PATH = '{:s}'  #".format(os.path.join(DATA_DIR, 'cache.sock'))),
+    (r'^PLAN_DIR.*#', "PLAN_DIR = '{:s}'  #".format(os.path.join(DATA_DIR, 'plans'))),
     (r'^#!.*$', '#! {:s}'.format(WHICH_PYTHON)),
     (r'^(\s*SNAPSHOT_DIR).*', r"\1 = '{:s}'".format(os.path.join(DATA_DIR, 'snapshots')))
 ]
@@ -1,43 +1,126 @@
 """Classes and constants for managing the cache."""
 import os
+import io
+import hashlib
 import sqlite3
 import datetime
-import requests
+import threading
+import contextlib
+import atexit
+import time
+import json
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, wait
 import exceptions
+import transport
+import imageheader
 
 
 # Global variables to configure used by the class to allow for easy configuration
 DB_PATH = '/Users/aisamji09/Projects/iitech3/data/cache.db'  # Set by setup.py according to the OS in use.
 MAX_AGE = 14  # The age in days of a value before the cache considers it too old.
+IMAGE_MAX_AGE = 90  # The age in days of the dimensions of an image before the cache measures it again.
+MEMO_SIZE = 1024  # The number of webpages and of emails that the cache keeps in memory.
+MEMO_TTL = 300  # The number of seconds that an entry is kept in memory before it is read again.
+LOOKUP_CONCURRENCY = 16  # The number of online lookups that a bulk lookup keeps in flight at once.
+STALE_WHILE_REVALIDATE = False  # Whether the default cache returns old values at once and refreshes them later.
+STATS_PATH = os.environ.get('IITECH3_CACHE_STATS')  # The JSON file the default cache, even a remote one, dumps to.
 
 # TODO: Convert cache into Singletonish class that has a get_default method
 # Private variables
 _cache = None
+_local_cache = None
 
 
 # Custom adapters and converters to translate between python and sqlite data
-def _convert_datetime(sql_value):
-    return datetime.datetime.strptime(sql_value.decode('utf-8'), '%Y%m%d%H%M%S')
+sqlite3.register_converter('BOOL', lambda x: bool(int(x)))
+# Using sqlite3's builtin bool adapter
+# Lookup times are stored as whole seconds since the epoch so that they can be compared in SQL.
 
 
-def _adapt_datetime(py_value):
-    return py_value.strftime('%Y%m%d%H%M%S')
+def _now():
+    """Get the current time in seconds since the epoch."""
+    return int(datetime.datetime.today().timestamp())
 
 
-sqlite3.register_converter('DATETIME', _convert_datetime)
-sqlite3.register_converter('BOOL', lambda x: bool(int(x)))
-sqlite3.register_adapter(datetime.datetime, _adapt_datetime)
-# Using sqlite3's builtin bool adapter
+def _days_ago(days):
+    """Get the time, in seconds since the epoch, that was the given number of days ago."""
+    return _now() - int(datetime.timedelta(days=days).total_seconds())
+
+
+def _max_age(table):
+    """Get the age in days of an entry of the table before it is too old."""
+    return IMAGE_MAX_AGE if table == 'images' else MAX_AGE
+
+
+def _stale_before(table=None):
+    """Get the time, in seconds since the epoch, before which a lookup for the table is too old."""
+    return _days_ago(_max_age(table))
+
+
+def _run_limited(func, items, concurrency):
+    """Call func with every item on an event loop, keeping at most concurrency calls in flight.
+
+    func is blocking, so each call runs in a thread of the loop's executor. Return a list with the
+    result of each call, or the exception it raised, in the order of items.
+    """
+    import asyncio  # only needed by bulk lookups, so it is kept out of the startup of every command
+    concurrency = max(1, int(concurrency))
+
+    async def run_all(loop):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(item):
+            async with semaphore:
+                return await loop.run_in_executor(None, func, item)
+
+        return await asyncio.gather(*(run_one(i) for i in items), return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    loop.set_default_executor(executor)
+    try:
+        return loop.run_until_complete(run_all(loop))
+    finally:
+        loop.close()
+        executor.shutdown()
+
+
+def get_local():
+    """Get a cache object created with the default values that uses the database directly."""
+    global _local_cache
+    if _local_cache is None:
+        _local_cache = Cache(DB_PATH, stale_while_revalidate=STALE_WHILE_REVALIDATE)
+        atexit.register(_local_cache.close)
+        if STATS_PATH:
+            atexit.register(_local_cache.dump_stats, STATS_PATH)  # runs before the cache is closed
+    return _local_cache
 
 
 def get_default():
-    """Get a cache object created with the default values."""
+    """Get a cache object created with the default values.
+
+    If the cache service is running, a RemoteCache that uses it is returned instead so that every
+    process shares its memory and its connections. Either one dumps its statistics to STATS_PATH at exit.
+    """
     global _cache
     if _cache is None:
-        _cache = Cache(DB_PATH)
+        import service  # imported here because the service module depends on this one
+        _cache = service.connect()
+        if _cache is None:
+            _cache = get_local()
+        else:
+            atexit.register(_cache.close)
+            if STATS_PATH:
+                atexit.register(_cache.dump_stats, STATS_PATH)  # runs before the connection is closed
     return _cache
 
 
+def _status_class(status_code):
+    """Get the class of an HTTP status code, such as 2xx."""
+    return '{:d}xx'.format(int(status_code) // 100)
+
+
 class InfoHolder:
     """A class that holds grouped information."""
 
@@ -47,14 +130,137 @@ class InfoHolder:
             setattr(self, k, v)
 
 
+class LRUCache:
+    """A bounded in-memory mapping that forgets its least recently used and expired entries."""
+
+    def __init__(self, size, ttl):
+        """Create an empty mapping that holds up to size entries for ttl seconds each."""
+        self._size = int(size)
+        self._ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get the value of the key, or None if it is not held or has expired."""
+        with self._lock:
+            try:
+                value, expiry = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expiry <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Hold the value of the key, forgetting the least recently used entries if there are too many."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Forget the value of the key, if it is held."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Forget every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        """Get the number of entries held, including the ones that expired but are not yet forgotten."""
+        return len(self._entries)
+
+
+class CacheStats:
+    """A set of counters that describe how the reads of a cache were answered and how long its lookups took.
+
+    Each counter is identified by a category, a name and a bucket. The reads are counted under the name
+    of their table, each event being a bucket: a 'fresh' or a 'stale' hit, a 'miss' or a 'forced' lookup.
+    The lookups are counted under 'hosts' and 'statuses', by host and by status class, in buckets of latency,
+    along with the total 'seconds' they took.
+    """
+
+    LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # The upper bounds, in seconds, of the latency buckets.
+
+    def __init__(self, values=None):
+        """Create the counters from a mapping of (category, name, bucket) tuples to values, or empty ones."""
+        self._values = Counter(values or {})
+        self._lock = threading.Lock()
+
+    def count(self, table, event):
+        """Count a read of the table answered by the event."""
+        with self._lock:
+            self._values[(table, event, '')] += 1
+
+    def time_lookup(self, host, status_class, seconds):
+        """Count a lookup from the host that ended with the status class after the given seconds."""
+        bucket = next(('<={:g}s'.format(b) for b in self.LATENCY_BUCKETS if seconds <= b),
+                      '>{:g}s'.format(self.LATENCY_BUCKETS[-1]))
+        with self._lock:
+            for category, name in (('hosts', host), ('statuses', status_class)):
+                self._values[(category, name, bucket)] += 1
+                self._values[(category, name, 'seconds')] += seconds
+
+    def copy(self):
+        """Get a copy of the counters as a Counter of (category, name, bucket) tuples."""
+        with self._lock:
+            return Counter(self._values)
+
+    def to_dict(self):
+        """Get the counters as nested dicts that can be dumped to JSON.
+
+        Return a dict with the 'reads' of each table, mapping each event to its count, and the 'hosts' and
+        'statuses', mapping each host or status class to its 'count', total 'seconds' and 'buckets'.
+        """
+        result = {
+            'reads': {},
+            'hosts': {},
+            'statuses': {}
+        }
+        for (category, name, bucket), value in sorted(self.copy().items()):
+            if category not in ('hosts', 'statuses'):
+                result['reads'].setdefault(category, {})[name] = int(value)
+                continue
+            entry = result[category].setdefault(name, {'count': 0, 'seconds': 0.0, 'buckets': {}})
+            if bucket == 'seconds':
+                entry['seconds'] += value
+            else:
+                entry['buckets'][bucket] = int(value)
+                entry['count'] += int(value)
+        return result
+
+
 class Cache:
     """An object that provides methods to manage the information in the cache."""
 
     # Class constants
-    WEBPAGE_GET_STATEMENT = 'SELECT * FROM webpages WHERE url=?'
-    WEBPAGE_SET_STATEMENT = 'INSERT OR REPLACE INTO webpages VALUES (?, ?, ?)'
-    EMAIL_GET_STATEMENT = 'SELECT * FROM emails WHERE address=?'
-    EMAIL_SET_STATEMENT = 'INSERT OR REPLACE INTO emails VALUES (?, ?, ?, ?)'
+    WEBPAGE_GET_STATEMENT = 'SELECT url, status, last_lookup FROM webpages WHERE url=?'
+    WEBPAGE_SET_STATEMENT = 'INSERT OR REPLACE INTO webpages VALUES (?1, ?2, ?3, host_of(?1), ?3)'
+    WEBPAGE_TOUCH_STATEMENT = 'UPDATE webpages SET last_access=MAX(last_access, ?2) WHERE url=?1'
+    WEBPAGE_GET_MANY_STATEMENT = 'SELECT url, status, last_lookup FROM webpages WHERE url IN ({:s})'
+    WEBPAGE_FIND_STATEMENT = 'SELECT url, status, last_lookup FROM webpages WHERE {:s}'
+    EMAIL_GET_STATEMENT = 'SELECT address, is_valid, reason, last_lookup FROM emails WHERE address=?'
+    EMAIL_SET_STATEMENT = 'INSERT OR REPLACE INTO emails VALUES (?1, ?2, ?3, ?4, domain_of(?1), ?4)'
+    EMAIL_TOUCH_STATEMENT = 'UPDATE emails SET last_access=MAX(last_access, ?2) WHERE address=?1'
+    EMAIL_GET_MANY_STATEMENT = 'SELECT address, is_valid, reason, last_lookup FROM emails WHERE address IN ({:s})'
+    EMAIL_FIND_STATEMENT = 'SELECT address, is_valid, reason, last_lookup FROM emails WHERE {:s}'
+    IMAGE_GET_STATEMENT = 'SELECT url, width, height, size, hash, last_lookup FROM images WHERE url=?'
+    IMAGE_SET_STATEMENT = 'INSERT OR REPLACE INTO images VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?6)'
+    IMAGE_TOUCH_STATEMENT = 'UPDATE images SET last_access=MAX(last_access, ?2) WHERE url=?1'
+    IMAGE_GET_MANY_STATEMENT = 'SELECT url, width, height, size, hash, last_lookup FROM images WHERE url IN ({:s})'
+    MAX_VARIABLES = 999  # The number of parameters SQLite accepts in a single statement.
+    MAX_ACCESSES = 1000  # The number of access times buffered before they are written without waiting for a commit.
+    HEAD_REJECTED_STATUSES = (405, 501)  # The statuses of hosts that do not support HEAD requests.
     EMAIL_API_ENDPOINT = 'http://api.quickemailverification.com/v1/verify?email={:s}&apikey=e7c512323e3d0025bc7a94e59801abc1dc2f4a2d12ed295fef3b400b9e55' # noqa
     DB_MANAGEMENT_SCRIPTS = ["""
                              CREATE TABLE webpages (
@@ -69,69 +275,669 @@ class Cache:
                                 reason TEXT NOT NULL,
                                 last_lookup DATETIME NOT NULL
                              );
+                             """, """
+                             CREATE TABLE webpages_v2 (
+                                url TEXT PRIMARY KEY NOT NULL,
+                                status INTEGER NOT NULL,
+                                last_lookup INTEGER NOT NULL,
+                                host TEXT NOT NULL
+                             );
+                             INSERT INTO webpages_v2
+                                SELECT url, status, epoch_of(last_lookup), host_of(url) FROM webpages;
+                             DROP TABLE webpages;
+                             ALTER TABLE webpages_v2 RENAME TO webpages;
+                             CREATE INDEX webpages_last_lookup ON webpages (last_lookup);
+                             CREATE INDEX webpages_host ON webpages (host);
+
+                             CREATE TABLE emails_v2 (
+                                address TEXT PRIMARY KEY NOT NULL,
+                                is_valid BOOL NOT NULL,
+                                reason TEXT NOT NULL,
+                                last_lookup INTEGER NOT NULL,
+                                domain TEXT NOT NULL
+                             );
+                             INSERT INTO emails_v2
+                                SELECT address, is_valid, reason, epoch_of(last_lookup), domain_of(address) FROM emails;
+                             DROP TABLE emails;
+                             ALTER TABLE emails_v2 RENAME TO emails;
+                             CREATE INDEX emails_last_lookup ON emails (last_lookup);
+                             CREATE INDEX emails_domain ON emails (domain);
+                             """, """
+                             ALTER TABLE webpages ADD COLUMN last_access INTEGER NOT NULL DEFAULT 0;
+                             UPDATE webpages SET last_access = last_lookup;
+                             CREATE INDEX webpages_last_access ON webpages (last_access);
+
+                             ALTER TABLE emails ADD COLUMN last_access INTEGER NOT NULL DEFAULT 0;
+                             UPDATE emails SET last_access = last_lookup;
+                             CREATE INDEX emails_last_access ON emails (last_access);
+                             """, """
+                             CREATE TABLE stats (
+                                category TEXT NOT NULL,
+                                name TEXT NOT NULL,
+                                bucket TEXT NOT NULL,
+                                value REAL NOT NULL,
+                                PRIMARY KEY (category, name, bucket)
+                             );
+                             """, """
+                             CREATE TABLE images (
+                                url TEXT PRIMARY KEY NOT NULL,
+                                width INTEGER NOT NULL,
+                                height INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                hash TEXT NOT NULL,
+                                last_lookup INTEGER NOT NULL,
+                                last_access INTEGER NOT NULL
+                             );
+                             CREATE INDEX images_last_lookup ON images (last_lookup);
+                             CREATE INDEX images_last_access ON images (last_access);
+                             """, """
+                             CREATE TABLE images_v6 (
+                                url TEXT PRIMARY KEY NOT NULL,
+                                width INTEGER NOT NULL,
+                                height INTEGER NOT NULL,
+                                size INTEGER,
+                                hash TEXT,
+                                last_lookup INTEGER NOT NULL,
+                                last_access INTEGER NOT NULL
+                             );
+                             INSERT INTO images_v6
+                                SELECT url, width, height, size, NULLIF(hash, ''), last_lookup, last_access FROM images;
+                             DROP TABLE images;
+                             ALTER TABLE images_v6 RENAME TO images;
+                             CREATE INDEX images_last_lookup ON images (last_lookup);
+                             CREATE INDEX images_last_access ON images (last_access);
                              """]
+    DB_TABLES = ('webpages', 'emails', 'images')
+    DB_COLUMNS = {  # The columns of each table that are exported, the first one being the key.
+        'webpages': ('url', 'status', 'last_lookup'),
+        'emails': ('address', 'is_valid', 'reason', 'last_lookup'),
+        'images': ('url', 'width', 'height', 'size', 'hash', 'last_lookup')
+    }
+    MERGE_STATEMENTS = {  # Like the set statements but only replace the entries that were looked up earlier.
+        'webpages': 'INSERT OR REPLACE INTO webpages SELECT ?1, ?2, ?3, host_of(?1), ?3 '
+                    'WHERE NOT EXISTS (SELECT 1 FROM webpages WHERE url=?1 AND last_lookup >= ?3)',
+        'emails': 'INSERT OR REPLACE INTO emails SELECT ?1, ?2, ?3, ?4, domain_of(?1), ?4 '
+                  'WHERE NOT EXISTS (SELECT 1 FROM emails WHERE address=?1 AND last_lookup >= ?4)',
+        'images': 'INSERT OR REPLACE INTO images SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?6 '
+                  'WHERE NOT EXISTS (SELECT 1 FROM images WHERE url=?1 AND last_lookup >= ?6)'
+    }
+    IMPORT_CHUNK_SIZE = 1000  # The number of rows of a table that an import sends with each executemany.
+    STATS_CREATE_STATEMENT = 'INSERT OR IGNORE INTO stats VALUES (?, ?, ?, 0)'
+    STATS_ADD_STATEMENT = 'UPDATE stats SET value=value + ? WHERE category=? AND name=? AND bucket=?'
+    STATS_GET_STATEMENT = 'SELECT category, name, bucket, value FROM stats'
+    AGE_BUCKETS = (1, 7, MAX_AGE, 30, 90, 365)  # The ages in days by which the entries are counted in the stats.
+    EXPIRE_STATEMENT = 'DELETE FROM {:s} WHERE last_lookup <= ?'
+    EVICT_STATEMENT = ('DELETE FROM {0:s} WHERE rowid IN '
+                       '(SELECT rowid FROM {0:s} ORDER BY last_access DESC LIMIT -1 OFFSET ?)')
     DB_VERSION = len(DB_MANAGEMENT_SCRIPTS)
+    DB_PRAGMAS = [  # Let readers work while a write is in progress and only sync the WAL at checkpoints.
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL'
+    ]
+    BUSY_TIMEOUT = 10.0  # The number of seconds to wait for another connection to finish writing.
 
     # Methods
-    def __init__(self, db_path):
+    def __init__(self, db_path, *, stale_while_revalidate=False):
         """Connect to a caching database.
 
         Create, upgrade, or open a caching databse at the specified path.
+        The connection may be shared between threads; all access to it is serialized by a lock.
+        If stale_while_revalidate is true, values that are too old are returned right away
+        and looked up online in the background.
         """
+        self.stale_while_revalidate = bool(stale_while_revalidate)
         db_path = str(db_path)
         if db_path != ':memory:':
             os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self._database = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._lock = threading.RLock()
+        self._probe_methods = {}  # The request method that works for each host, 'HEAD' or 'GET'
+        self._transport = transport.get_default()
+        self._pending = {}  # The rows waiting to be written, grouped by the statement that writes them
+        self._accesses = {}  # The last access time of each key read, grouped by the statement that records it
+        self.stats = CacheStats()  # The reads and lookups of this cache object
+        self._saved_stats = Counter()  # The part of the stats that is already added to the stats table
+        self._local = threading.local()  # Whether the lookups of the current thread are made by a get, its batches
+        self._webpage_memo = LRUCache(MEMO_SIZE, MEMO_TTL)
+        self._email_memo = LRUCache(MEMO_SIZE, MEMO_TTL)
+        self._image_memo = LRUCache(MEMO_SIZE, MEMO_TTL)
+        self._refresher = None  # The thread that refreshes stale values in the background, once needed
+        self._refreshes = []
+        self._refreshing = set()
+        self._database = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES,
+                                         check_same_thread=False, timeout=self.BUSY_TIMEOUT)
+        for pragma in self.DB_PRAGMAS:
+            self._database.execute(pragma)
+        for name, function in self._sql_functions().items():
+            self._database.create_function(name, 1, function)
         version = self._database.execute('PRAGMA user_version').fetchone()[0]
-        if version < self.DB_VERSION:
-            self._database.executescript(self.DB_MANAGEMENT_SCRIPTS[version])
-        self._database.execute('PRAGMA user_version={:d}'.format(self.DB_VERSION))
-        self._database.commit()
+        for number, script in enumerate(self.DB_MANAGEMENT_SCRIPTS[version:], version + 1):
+            try:  # each migration is committed along with its version, so a failed one is simply run again
+                self._database.executescript('BEGIN;\n{:s}\nPRAGMA user_version={:d};\nCOMMIT;'.format(script, number))
+            except sqlite3.Error:
+                self._database.rollback()
+                raise
+
+    @staticmethod
+    def _sql_functions():
+        """Get the python functions that the statements and the migrations call, mapped by their SQL name."""
+        def epoch_of(value):  # Convert a version 1 lookup time, YYYYmmddHHMMSS in local time.
+            return int(datetime.datetime.strptime(str(value), '%Y%m%d%H%M%S').timestamp())
+
+        def domain_of(address):
+            return str(address).rpartition('@')[2].lower()
+
+        return {
+            'epoch_of': epoch_of,
+            'host_of': transport.host_of,
+            'domain_of': domain_of
+        }
 
     def __del__(self):
         """Clean up the database connection used by the cache object."""
         self._database.close()
 
+    def close(self):
+        """Finish the background refreshes, commit any pending writes and close the database connection."""
+        self.wait_for_refreshes()
+        with self._lock:
+            self._flush()
+            self._flush_accesses()
+            self._flush_stats()
+            self._database.commit()
+            self._database.close()
+
+    # Methods for writing to the database
+    def _flush(self):
+        """Write all of the pending rows using one executemany per statement."""
+        with self._lock:
+            for statement, rows in self._pending.items():
+                self._database.executemany(statement, rows)
+            self._pending.clear()
+
+    def _flush_accesses(self):
+        """Record the buffered access times using one executemany per statement.
+
+        Access times are recorded along with the next commit, when a batch ends or the cache is closed, so that
+        reads do not have to write to the database. They are also written once MAX_ACCESSES of them are buffered
+        so that a long run of reads without any writes does not keep them all in memory.
+        """
+        with self._lock:
+            for statement, times in self._accesses.items():
+                self._database.executemany(statement, times.items())
+            self._accesses.clear()
+
+    def _touch(self, statement, keys):
+        """Buffer the current time as the access time of the keys."""
+        now = _now()
+        with self._lock:
+            times = self._accesses.setdefault(statement, {})
+            for key in keys:
+                times[key] = now
+            if sum(len(t) for t in self._accesses.values()) >= self.MAX_ACCESSES:
+                self._flush_accesses()
+
+    def _write(self, statement, rows, memo):
+        """Write the rows using the statement and forget their keys (first column) from the memo.
+
+        Outside of a batch of the current thread the rows are written and committed right away. Inside of one,
+        they wait until a read or another commit needs them or the batch ends and they are committed along with
+        the rest of the batch.
+        """
+        with self._lock:
+            for row in rows:
+                memo.discard(row[0])
+            self._pending.setdefault(statement, []).extend(rows)
+            if getattr(self._local, 'batch_depth', 0) == 0:
+                self._flush()
+                self._flush_accesses()
+                self._database.commit()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group the writes that the current thread makes inside of the with block into a single transaction.
+
+        Batches can be nested; the transaction is committed when the outermost batch of the thread ends. The
+        other threads keep committing their own writes right away, along with whatever is pending then, so a
+        batch saves commits but does not isolate its writes.
+
+        The writes are committed even if the block raises, on purpose: every row is the result of a lookup
+        that succeeded and is valid on its own, such as the images measured before another one failed, so
+        rolling them back would only make the next run look them up again.
+        """
+        depth = getattr(self._local, 'batch_depth', 0)
+        self._local.batch_depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._local.batch_depth = depth
+            if depth == 0:
+                with self._lock:
+                    self._flush()
+                    self._flush_accesses()
+                    self._database.commit()
+
+    # Methods for sharing entries between databases
+    def export_entries(self, stream):
+        """Write every entry to the text stream as JSON lines, one entry per line.
+
+        Each line is an object with the 'table' of the entry and its exported columns (DB_COLUMNS),
+        its last_lookup being in seconds since the epoch. The rows are streamed from the database
+        rather than read all at once. Return the number of entries written.
+        """
+        count = 0
+        with self._lock:
+            self._flush()
+            for table in self.DB_TABLES:
+                columns = self.DB_COLUMNS[table]
+                cursor = self._database.execute('SELECT {:s} FROM {:s}'.format(', '.join(columns), table))
+                for row in cursor:
+                    entry = OrderedDict(table=table)
+                    entry.update(zip(columns, row))
+                    stream.write(json.dumps(entry) + '\n')
+                    count += 1
+        return count
+
+    def _parse_entry(self, line_number, line):
+        """Convert a line written by export_entries into its table and row."""
+        try:
+            entry = json.loads(line)
+            table = entry['table']
+            if table not in self.DB_COLUMNS:
+                raise exceptions.MalformedEntryException(line_number, 'unknown table {!r:}'.format(table))
+            row = tuple(entry[c] for c in self.DB_COLUMNS[table])
+        except ValueError as error:
+            raise exceptions.MalformedEntryException(line_number, str(error))
+        except (KeyError, TypeError) as error:
+            raise exceptions.MalformedEntryException(line_number, 'missing {!s:}'.format(error))
+        if not isinstance(row[-1], int):
+            raise exceptions.MalformedEntryException(line_number, 'last_lookup is not in seconds')
+        return table, row
+
+    def import_entries(self, lines, *, merge=False):
+        """Add the entries of the JSON lines written by export_entries to the cache.
+
+        The lines are read lazily and written with an executemany for every IMPORT_CHUNK_SIZE rows of a table,
+        all in a single transaction that is rolled back if any line is malformed. Imported entries replace
+        the existing ones unless merge is true, in which case the entry that was looked up last is kept.
+        Everything pending is committed first, so this must not be called inside of a batch.
+        Return a dict with the number of entries 'read' and the number 'stored'.
+        """
+        statements = self.MERGE_STATEMENTS if merge else {
+            'webpages': self.WEBPAGE_SET_STATEMENT,
+            'emails': self.EMAIL_SET_STATEMENT,
+            'images': self.IMAGE_SET_STATEMENT
+        }
+        result = {
+            'read': 0,
+            'stored': 0
+        }
+        chunks = {t: [] for t in self.DB_TABLES}
+
+        def write(table):
+            cursor = self._database.executemany(statements[table], chunks[table])
+            result['stored'] += cursor.rowcount
+            chunks[table] = []
+
+        with self._lock:
+            self._flush()
+            self._database.commit()
+            try:
+                for line_number, line in enumerate(lines, 1):
+                    if line.strip() == '':
+                        continue
+                    table, row = self._parse_entry(line_number, line)
+                    chunks[table].append(row)
+                    result['read'] += 1
+                    if len(chunks[table]) >= self.IMPORT_CHUNK_SIZE:
+                        write(table)
+                for table in self.DB_TABLES:
+                    write(table)
+            except BaseException:
+                self._database.rollback()
+                raise
+            self._database.commit()
+            self.clear_memos()
+        return result
+
+    # Methods for collecting statistics
+    def _flush_stats(self):
+        """Add the stats counted since the last flush to the stats table."""
+        with self._lock:
+            values = self.stats.copy()
+            unsaved = values - self._saved_stats
+            self._database.executemany(self.STATS_CREATE_STATEMENT, unsaved.keys())
+            self._database.executemany(self.STATS_ADD_STATEMENT, ((v,) + k for k, v in unsaved.items()))
+            self._saved_stats = values
+
+    @contextlib.contextmanager
+    def _implicit_lookups(self):
+        """Keep the single lookups made inside of the with block from being counted as forced."""
+        self._local.implicit = True
+        try:
+            yield
+        finally:
+            self._local.implicit = False
+
+    def _count_forced(self, table):
+        """Count a single lookup as forced unless a get made it."""
+        if not getattr(self._local, 'implicit', False):
+            self.stats.count(table, 'forced')
+
+    def _count_reads(self, table, entries):
+        """Count the reads of a bulk get from its fresh, stale and missing entries."""
+        for event, keys in (('fresh', entries['fresh']), ('stale', entries['stale']), ('miss', entries['missing'])):
+            for _ in keys:
+                self.stats.count(table, event)
+
+    def _time_lookup(self, host, start, status_code):
+        """Count a lookup from the host that started at start, by its status code, or None if it failed."""
+        self.stats.time_lookup(host, 'error' if status_code is None else _status_class(status_code),
+                               time.monotonic() - start)
+
+    def get_stats(self):
+        """Get the statistics kept in the database.
+
+        Return a dict with the 'size' of the database in bytes, the 'tables' that map each table to its number
+        of 'rows', of 'stale' rows and of rows looked up within each of the AGE_BUCKETS days ('ages'), and the
+        counters of every run added together in the same format as CacheStats.to_dict.
+        """
+        with self._lock:
+            self._flush()
+            self._flush_stats()
+            self._database.commit()
+            result = CacheStats({tuple(r[:3]): r[3] for r in self._database.execute(self.STATS_GET_STATEMENT)})
+            result = result.to_dict()
+            result['size'] = self._get_size()
+            result['tables'] = {}
+            for table in self.DB_TABLES:
+                count_statement = 'SELECT COUNT(*) FROM {:s} WHERE last_lookup > ?'.format(table)
+                ages = OrderedDict((days, self._database.execute(count_statement, (_days_ago(days),)).fetchone()[0])
+                                   for days in self.AGE_BUCKETS)
+                result['tables'][table] = {
+                    'rows': self._database.execute('SELECT COUNT(*) FROM {:s}'.format(table)).fetchone()[0],
+                    'stale': self._database.execute(
+                        'SELECT COUNT(*) FROM {:s} WHERE last_lookup <= ?'.format(table), (_stale_before(table),)
+                    ).fetchone()[0],
+                    'ages': ages
+                }
+        return result
+
+    def reset_stats(self):
+        """Forget the counters of every run, keeping the entries."""
+        with self._lock:
+            self._saved_stats = self.stats.copy()
+            self._database.execute('DELETE FROM stats')
+            self._database.commit()
+
+    def open_circuits(self):
+        """Get a dict that maps every host whose lookups are being skipped to the reason why."""
+        return self._transport.open_circuits()
+
+    def get_run_stats(self):
+        """Get the counters of this run in the format of CacheStats.to_dict."""
+        return self.stats.to_dict()
+
+    def dump_stats(self, path):
+        """Write the counters of this run and the statistics kept in the database to a JSON file at path."""
+        with open(path, 'w', encoding='UTF-8') as stats_file:
+            json.dump({'run': self.get_run_stats(), 'database': self.get_stats()}, stats_file, indent=2)
+
+    # Methods for maintaining the database
+    def _get_size(self):
+        """Get the number of bytes taken by the pages of the database."""
+        page_count = self._database.execute('PRAGMA page_count').fetchone()[0]
+        page_size = self._database.execute('PRAGMA page_size').fetchone()[0]
+        return page_count * page_size
+
+    def collect_garbage(self, *, older_than=None, max_rows=None):
+        """Delete the entries that are too old or too rarely used and compact the database.
+
+        First delete the entries that were looked up at least older_than days ago, then the least recently
+        accessed entries of each table beyond its first max_rows. Either step is skipped when it is None.
+        Afterwards, rebuild the file with VACUUM and refresh the statistics of the query planner with
+        ANALYZE. Everything pending is committed first, so this must not be called inside of a batch.
+        Return a dict with the number of 'expired' and 'evicted' entries and the number of bytes 'reclaimed'.
+        """
+        result = {
+            'expired': 0,
+            'evicted': 0,
+            'reclaimed': 0
+        }
+        self.wait_for_refreshes()
+        with self._lock:
+            self._flush()
+            self._flush_accesses()
+            self._database.commit()
+            size = self._get_size()
+            for table in self.DB_TABLES:
+                if older_than is not None:
+                    cursor = self._database.execute(self.EXPIRE_STATEMENT.format(table), (_days_ago(older_than),))
+                    result['expired'] += cursor.rowcount
+                if max_rows is not None:
+                    cursor = self._database.execute(self.EVICT_STATEMENT.format(table), (max(0, int(max_rows)),))
+                    result['evicted'] += cursor.rowcount
+            self._database.commit()
+            self.clear_memos()
+            self._database.execute('VACUUM')
+            self._database.execute('ANALYZE')
+            self._database.commit()
+            result['reclaimed'] = size - self._get_size()
+        return result
+
+    def clear_memos(self):
+        """Forget every entry held in memory so that the next reads come from the database."""
+        self._webpage_memo.clear()
+        self._email_memo.clear()
+        self._image_memo.clear()
+
+    # Methods for refreshing stale values in the background
+    def _refresh(self, lookup, keys):
+        """Lookup the keys online with the given bulk lookup method and mark them as no longer refreshing."""
+        try:
+            lookup(keys)
+        finally:
+            with self._lock:
+                self._refreshing.difference_update((lookup.__name__, k) for k in keys)
+
+    def _refresh_later(self, lookup, keys):
+        """Queue the keys to be looked up online with the given bulk lookup method in the background.
+
+        Keys that are already queued are skipped.
+        """
+        with self._lock:
+            keys = [k for k in dict.fromkeys(keys) if (lookup.__name__, k) not in self._refreshing]
+            if len(keys) == 0:
+                return
+            self._refreshing.update((lookup.__name__, k) for k in keys)
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(max_workers=1)
+            self._refreshes.append(self._refresher.submit(self._refresh, lookup, keys))
+
+    def refresh_webpages(self, urls):
+        """Queue the urls to be looked up online in the background."""
+        self._refresh_later(self.lookup_webpages, [str(u) for u in urls])
+
+    def refresh_emails(self, addresses):
+        """Queue the addresses to be looked up online in the background."""
+        self._refresh_later(self.lookup_emails, [str(a) for a in addresses])
+
+    def wait_for_refreshes(self):
+        """Wait for all of the queued background refreshes to finish.
+
+        A refresh that fails leaves its values stale so that a later run looks them up again.
+        """
+        with self._lock:
+            refreshes = self._refreshes
+            self._refreshes = []
+        wait(refreshes)
+
+    # Helpers for reading entries
+    @staticmethod
+    def _is_stale(row, table=None):
+        """Determine whether the row of the table was looked up too long ago, its last column being the lookup time."""
+        return row[-1] <= _stale_before(table)
+
+    @classmethod
+    def _make_webpage_info(cls, row):
+        """Convert a row of the webpages table into an InfoHolder."""
+        return InfoHolder(url=row[0], status=row[1], last_lookup=datetime.datetime.fromtimestamp(row[2]),
+                          stale=cls._is_stale(row))
+
+    @classmethod
+    def _make_email_info(cls, row):
+        """Convert a row of the emails table into an InfoHolder."""
+        return InfoHolder(address=row[0], is_valid=row[1], reason=row[2],
+                          last_lookup=datetime.datetime.fromtimestamp(row[3]), stale=cls._is_stale(row))
+
+    @classmethod
+    def _make_image_info(cls, row):
+        """Convert a row of the images table into an InfoHolder."""
+        return InfoHolder(url=row[0], width=row[1], height=row[2], size=row[3], hash=row[4],
+                          last_lookup=datetime.datetime.fromtimestamp(row[5]), stale=cls._is_stale(row, 'images'))
+
+    def _get_one(self, statement, key, memo, touch):
+        """Read the row for the key from the memo or, failing that, from the database.
+
+        The access is recorded with the touch statement. Return None if the key is in neither.
+        """
+        with self._lock:
+            row = memo.get(key)
+            if row is None:
+                self._flush()
+                row = self._database.execute(statement, (key,)).fetchone()
+                if row is not None:
+                    memo.put(key, row)
+            if row is not None:
+                self._touch(touch, [key])
+        return row
+
+    def _get_many(self, statement, keys, make_info, memo, touch):
+        """Read the entries for all of the keys using the memo and as few statements as possible.
+
+        The keys that are not in the memo are sent in chunks of at most MAX_VARIABLES parameters.
+        Return a dict with the fresh entries, the stale entries (older than MAX_AGE days), each mapped
+        by key, and a list of the missing keys.
+        """
+        keys = list(dict.fromkeys(str(k) for k in keys))  # remove duplicates but keep the order
+        rows = {}
+        with self._lock:
+            for key in keys:
+                row = memo.get(key)
+                if row is not None:
+                    rows[key] = row
+            unknown = [k for k in keys if k not in rows]
+            self._flush()
+            for i in range(0, len(unknown), self.MAX_VARIABLES):
+                chunk = unknown[i:i + self.MAX_VARIABLES]
+                cursor = self._database.execute(statement.format(', '.join('?' * len(chunk))), chunk)
+                for row in cursor.fetchall():
+                    rows[row[0]] = row
+                    memo.put(row[0], row)
+            self._touch(touch, rows)
+
+        result = {
+            'fresh': {},
+            'stale': {},
+            'missing': []
+        }
+        for key in keys:
+            try:
+                info = make_info(rows[key])
+            except KeyError:
+                result['missing'].append(key)
+                continue
+            result['stale' if info.stale else 'fresh'][key] = info
+        return result
+
+    def _find(self, statement, column, value, stale, make_info):
+        """Read the entries whose column equals value and whose staleness is stale, filtering in SQL.
+
+        Either filter is skipped when it is None. Both columns are indexed so that neither filter
+        reads the whole table. Return a list of the entries in no particular order.
+        """
+        clauses = []
+        params = []
+        if value is not None:
+            clauses.append('{:s}=?'.format(column))
+            params.append(str(value).lower())
+        if stale is not None:
+            clauses.append('last_lookup {:s} ?'.format('<=' if stale else '>'))
+            params.append(_stale_before())
+        with self._lock:
+            self._flush()
+            rows = self._database.execute(statement.format(' AND '.join(clauses) or '1'), params).fetchall()
+        return [make_info(r) for r in rows]
+
     # Methods for managing webpage information
+    def _probe_webpage(self, url):
+        """Get the status of the url online without storing it or downloading its content.
+
+        Send a HEAD request first and fall back to a streamed GET, closed as soon as the headers arrive,
+        when the host rejects HEAD requests. The method that works is remembered for each host so that
+        later lookups skip the attempt that is bound to fail. A url whose host cannot be reached, or is
+        being skipped after failing too often, is gone (410).
+        """
+        host = transport.host_of(url)
+        start = time.monotonic()
+        status_code = None
+        try:
+            if self._probe_methods.get(host) != 'GET':
+                response = self._transport.head(url, allow_redirects=True)
+                response.close()
+                if response.status_code not in self.HEAD_REJECTED_STATUSES:
+                    self._probe_methods[host] = 'HEAD'
+                    status_code = response.status_code
+                    return status_code
+                self._probe_methods[host] = 'GET'
+            response = self._transport.get(url, stream=True)
+            status_code = response.status_code
+            response.close()
+        except (transport.get_requests().exceptions.ConnectionError, exceptions.HostUnavailableException):
+            return 410
+        finally:
+            self._time_lookup(host, start, status_code)
+        return status_code
+
+    def _read_webpage(self, url):
+        """Read the row of the url from the cache, or None if it is not there."""
+        return self._get_one(self.WEBPAGE_GET_STATEMENT, url, self._webpage_memo, self.WEBPAGE_TOUCH_STATEMENT)
+
     def lookup_webpage(self, url):
         """Lookup the status of the url online.
 
         Find the url online an get the status and store it in the cache.
         """
         url = str(url)
-        try:
-            response = requests.get(url)
-            status_code = response.status_code
-            response.close()
-        except requests.exceptions.ConnectionError:
-            status_code = 410
-        self._database.execute(self.WEBPAGE_SET_STATEMENT,
-                               (url, status_code, datetime.datetime.today()))
-        self._database.commit()
+        self._count_forced('webpages')
+        status_code = self._probe_webpage(url)
+        self._write(self.WEBPAGE_SET_STATEMENT, [(url, status_code, _now())], self._webpage_memo)
 
     def get_webpage(self, url, *, nolookup=False):
         """Get the status of the given url.
 
         Check for the status of the url in the cache. Unless nolookup is true,
         use lookup_webpage to lookup the status online if it is not in the cache or
-        if the data in the cache is too old.
+        if the data in the cache is too old. In stale-while-revalidate mode, data that is
+        too old is returned right away, marked as stale, and looked up in the background.
         """
         url = str(url)
         nolookup = bool(nolookup)
-        response = self._database.execute(self.WEBPAGE_GET_STATEMENT, (url,)).fetchone()
-        try:
-            if (datetime.datetime.today() - response[-1]) >= datetime.timedelta(days=MAX_AGE):
-                if not nolookup:
-                    self.lookup_webpage(url)
-        except TypeError:
+        response = self._read_webpage(url)
+        self.stats.count('webpages', 'miss' if response is None else 'stale' if self._is_stale(response) else 'fresh')
+        if response is None:
             if nolookup:
-                raise exceptions.CacheMissException(url) from None
-            else:
+                raise exceptions.CacheMissException(url)
+            with self._implicit_lookups():
                 self.lookup_webpage(url)
-                response = self._database.execute(self.WEBPAGE_GET_STATEMENT, (url,)).fetchone()
-        info = InfoHolder(url=response[0], status=response[1],
-                          last_lookup=response[2])
-        return info
+            response = self._read_webpage(url)
+        elif self._is_stale(response) and not nolookup:
+            if self.stale_while_revalidate:
+                self.refresh_webpages([url])
+            else:
+                with self._implicit_lookups():
+                    self.lookup_webpage(url)
+                response = self._read_webpage(url)
+        return self._make_webpage_info(response)
 
     def set_webpage(self, url, status):
         """Manually set the status of the given url.
@@ -142,48 +948,80 @@ class Cache:
         """
         url = str(url)
         status = int(status)
-        self._database.execute(self.WEBPAGE_SET_STATEMENT,
-                               (url, status, datetime.datetime.today()))
-        self._database.commit()
+        self._write(self.WEBPAGE_SET_STATEMENT, [(url, status, _now())], self._webpage_memo)
+
+    def get_webpages(self, urls):
+        """Get the status of all of the urls from the cache without looking any of them up online.
+
+        Return a dict with the 'fresh' and the 'stale' entries, each mapping a url to its information,
+        and a list of the 'missing' urls. Only the stale and missing urls need to be looked up online.
+        """
+        entries = self._get_many(self.WEBPAGE_GET_MANY_STATEMENT, urls, self._make_webpage_info, self._webpage_memo,
+                                 self.WEBPAGE_TOUCH_STATEMENT)
+        self._count_reads('webpages', entries)
+        return entries
+
+    def find_webpages(self, *, host=None, stale=None):
+        """Get the status of every url in the cache on the given host, that is or is not stale.
+
+        Either filter is skipped when it is None. Return a list of the information of each url.
+        """
+        return self._find(self.WEBPAGE_FIND_STATEMENT, 'host', host, stale, self._make_webpage_info)
 
     # Methods for managing email information
+    def _probe_email(self, address):
+        """Get the validity of the address and the reason for it online without storing them."""
+        start = time.monotonic()
+        response = None
+        try:
+            response = self._transport.get(self.EMAIL_API_ENDPOINT.format(address))
+            results = response.json()
+            response.close()
+        finally:
+            self._time_lookup(transport.host_of(self.EMAIL_API_ENDPOINT), start,
+                              None if response is None else response.status_code)
+        return (False if results['safe_to_send'] == 'false' else True), results['reason']
+
+    def _read_email(self, address):
+        """Read the row of the address from the cache, or None if it is not there."""
+        return self._get_one(self.EMAIL_GET_STATEMENT, address, self._email_memo, self.EMAIL_TOUCH_STATEMENT)
+
     def lookup_email(self, address):
         """Lookup the validity of the address online.
 
         Verify the validity of address by sending it a test email.
         """
         address = str(address)
-        response = requests.get(self.EMAIL_API_ENDPOINT.format(address))
-        results = response.json()
-        self._database.execute(self.EMAIL_SET_STATEMENT,
-                               (address, False if results['safe_to_send'] == 'false' else True,
-                                results['reason'], datetime.datetime.today()))
-        self._database.commit()
-        response.close()
+        self._count_forced('emails')
+        is_valid, reason = self._probe_email(address)
+        self._write(self.EMAIL_SET_STATEMENT, [(address, is_valid, reason, _now())], self._email_memo)
 
     def get_email(self, address, *, nolookup=False):
         """Get the validity of the address.
 
         Check for the validity of the address in the cache. Unless nolookup is true,
         use lookup_email to lookup the validity online if it is not in the cache or
-        if the data in the cache is too old.
+        if the data in the cache is too old. In stale-while-revalidate mode, data that is
+        too old is returned right away, marked as stale, and looked up in the background.
         """
         address = str(address)
         nolookup = bool(nolookup)
-        response = self._database.execute(self.EMAIL_GET_STATEMENT, (address,)).fetchone()
-        try:
-            if (datetime.datetime.today() - response[-1]) >= datetime.timedelta(days=MAX_AGE):
-                if not nolookup:
-                    self.lookup_email(address)
-        except TypeError:
+        response = self._read_email(address)
+        self.stats.count('emails', 'miss' if response is None else 'stale' if self._is_stale(response) else 'fresh')
+        if response is None:
             if nolookup:
-                raise exceptions.CacheMissException(address) from None
-            else:
+                raise exceptions.CacheMissException(address)
+            with self._implicit_lookups():
                 self.lookup_email(address)
-                response = self._database.execute(self.EMAIL_GET_STATEMENT, (address,)).fetchone()
-        info = InfoHolder(address=response[0], is_valid=response[1],
-                          reason=response[2], last_lookup=response[3])
-        return info
+            response = self._read_email(address)
+        elif self._is_stale(response) and not nolookup:
+            if self.stale_while_revalidate:
+                self.refresh_emails([address])
+            else:
+                with self._implicit_lookups():
+                    self.lookup_email(address)
+                response = self._read_email(address)
+        return self._make_email_info(response)
 
     def set_email(self, address, is_valid):
         """Manually set the validity of the address.
@@ -194,7 +1032,172 @@ class Cache:
         address = str(address)
         is_valid = bool(is_valid)
         reason = 'user_verified' if is_valid else 'user_refuted'
-        self._database.execute(self.EMAIL_SET_STATEMENT,
-                               (address, is_valid, reason,
-                                datetime.datetime.today()))
-        self._database.commit()
+        self._write(self.EMAIL_SET_STATEMENT, [(address, is_valid, reason, _now())], self._email_memo)
+
+    def get_emails(self, addresses):
+        """Get the validity of all of the addresses from the cache without looking any of them up online.
+
+        Return a dict with the 'fresh' and the 'stale' entries, each mapping an address to its information,
+        and a list of the 'missing' addresses. Only the stale and missing addresses need to be looked up online.
+        """
+        entries = self._get_many(self.EMAIL_GET_MANY_STATEMENT, addresses, self._make_email_info, self._email_memo,
+                                 self.EMAIL_TOUCH_STATEMENT)
+        self._count_reads('emails', entries)
+        return entries
+
+    def find_emails(self, *, domain=None, stale=None):
+        """Get the validity of every address in the cache at the given domain, that is or is not stale.
+
+        Either filter is skipped when it is None. Return a list of the information of each address.
+        """
+        return self._find(self.EMAIL_FIND_STATEMENT, 'domain', domain, stale, self._make_email_info)
+
+    # Methods for managing image information
+    def _probe_image(self, url):
+        """Get the width, height, size in bytes and SHA-256 hash of the image at the url online without storing them.
+
+        Only the first imageheader.SNIFF_SIZE bytes are requested, with a Range header, and if their JPEG, PNG
+        or GIF header does not give the dimensions, the rest is requested and streamed until it does. Either
+        way, the rest is never transferred once the dimensions are known. The size is then read from the
+        Content-Range or Content-Length header, or is None if neither gives it, and the hash is None as the bytes
+        to compute it from were not downloaded. When the format is not supported, the whole image is downloaded,
+        measured by Pillow and hashed.
+        """
+        start = time.monotonic()
+        response = None
+        content = bytearray()
+        dimensions = None
+        headers = {'Range': 'bytes=0-{:d}'.format(imageheader.SNIFF_SIZE - 1)}
+        try:
+            while True:
+                response = self._transport.get(url, stream=True, headers=headers)
+                try:
+                    partial = response.status_code == 206
+                    if not partial:
+                        content = bytearray()  # the range was ignored, so the body is the whole file
+                    read = len(content)
+                    size = transport.get_total_size(response)
+                    for chunk in response.iter_content(imageheader.SNIFF_SIZE):
+                        content += chunk
+                        if dimensions is None and imageheader.is_supported(content):
+                            dimensions = imageheader.get_dimensions(content)
+                            if dimensions is not None and (size is None or len(content) < size):
+                                return dimensions + (size, None)
+                finally:
+                    response.close()
+                if not partial or len(content) == read or (size is not None and len(content) >= size):
+                    break  # the whole file was read
+                headers = {'Range': 'bytes={:d}-'.format(len(content))}
+        finally:
+            self._time_lookup(transport.host_of(url), start, None if response is None else response.status_code)
+        content = bytes(content)
+        if dimensions is None:
+            from PIL import Image  # only needed for the images whose header is not understood
+            image = Image.open(io.BytesIO(content))
+            dimensions = image.width, image.height
+        return dimensions + (len(content), hashlib.sha256(content).hexdigest())
+
+    def _read_image(self, url):
+        """Read the row of the image from the cache, or None if it is not there."""
+        return self._get_one(self.IMAGE_GET_STATEMENT, url, self._image_memo, self.IMAGE_TOUCH_STATEMENT)
+
+    def lookup_image(self, url):
+        """Lookup the dimensions of the image online.
+
+        Download the image at the url, or only enough of it, measure it and store its dimensions, size (None if
+        it is not known) and hash (None unless all of it was downloaded) in the cache.
+        """
+        url = str(url)
+        self._count_forced('images')
+        self._write(self.IMAGE_SET_STATEMENT, [(url,) + self._probe_image(url) + (_now(),)], self._image_memo)
+
+    def get_image(self, url, *, nolookup=False):
+        """Get the dimensions of the image at the url.
+
+        Check for the image in the cache. Unless nolookup is true, use lookup_image to measure it online
+        if it is not in the cache or if it was measured more than IMAGE_MAX_AGE days ago. Images that are
+        too old are always measured again, even in stale-while-revalidate mode, as the file may have been
+        replaced by one of a different size.
+        """
+        url = str(url)
+        nolookup = bool(nolookup)
+        response = self._read_image(url)
+        self.stats.count('images', 'miss' if response is None else
+                         'stale' if self._is_stale(response, 'images') else 'fresh')
+        if response is None:
+            if nolookup:
+                raise exceptions.CacheMissException(url)
+            with self._implicit_lookups():
+                self.lookup_image(url)
+            response = self._read_image(url)
+        elif self._is_stale(response, 'images') and not nolookup:
+            with self._implicit_lookups():
+                self.lookup_image(url)
+            response = self._read_image(url)
+        return self._make_image_info(response)
+
+    def get_images(self, urls):
+        """Get the dimensions of all of the images from the cache without measuring any of them online.
+
+        Return a dict with the 'fresh' and the 'stale' entries, each mapping a url to its information,
+        and a list of the 'missing' urls. Only the stale and missing images need to be measured online.
+        """
+        entries = self._get_many(self.IMAGE_GET_MANY_STATEMENT, urls, self._make_image_info, self._image_memo,
+                                 self.IMAGE_TOUCH_STATEMENT)
+        self._count_reads('images', entries)
+        return entries
+
+    # Methods for bulk lookups
+    def _lookup_all(self, probe, keys, statement, memo, concurrency, strict):
+        """Probe every key on an event loop and store all of the results with a single statement.
+
+        The keys are probed grouped by host so that consecutive probes reuse the kept-alive connections.
+        The results of the probes that succeeded are stored even if others failed, after which the first
+        failure is raised if strict. Otherwise, return a dict that maps each key that failed to its error.
+        """
+        keys = transport.order_by_host(dict.fromkeys(str(k) for k in keys))  # remove duplicates too
+        if len(keys) == 0:
+            return {}
+        results = _run_limited(probe, keys, concurrency)
+        now = _now()
+        rows = []
+        errors = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                errors[key] = result
+            else:
+                rows.append((key,) + (result if isinstance(result, tuple) else (result,)) + (now,))
+        self._write(statement, rows, memo)
+        if errors and strict:
+            raise next(iter(errors.values()))
+        return errors
+
+    def lookup_webpages(self, urls, *, concurrency=None, strict=True):
+        """Lookup the status of every url online.
+
+        Run the lookups on an event loop, keeping at most concurrency of them (LOOKUP_CONCURRENCY by default)
+        in flight at once, and store all of the statuses in the cache together. Unless strict, the lookups
+        that failed are returned in a dict of errors instead of being raised.
+        """
+        return self._lookup_all(self._probe_webpage, urls, self.WEBPAGE_SET_STATEMENT, self._webpage_memo,
+                                LOOKUP_CONCURRENCY if concurrency is None else concurrency, strict)
+
+    def lookup_emails(self, addresses, *, concurrency=None, strict=True):
+        """Lookup the validity of every address online.
+
+        Run the lookups on an event loop, keeping at most concurrency of them (LOOKUP_CONCURRENCY by default)
+        in flight at once, and store all of the results in the cache together. Unless strict, the lookups
+        that failed are returned in a dict of errors instead of being raised.
+        """
+        return self._lookup_all(self._probe_email, addresses, self.EMAIL_SET_STATEMENT, self._email_memo,
+                                LOOKUP_CONCURRENCY if concurrency is None else concurrency, strict)
+
+    def lookup_images(self, urls, *, concurrency=None, strict=True):
+        """Lookup the dimensions of every image online.
+
+        Run the lookups on an event loop, keeping at most concurrency of them (LOOKUP_CONCURRENCY by default)
+        in flight at once, and store all of the results in the cache together. Unless strict, the lookups
+        that failed are returned in a dict of errors instead of being raised.
+        """
+        return self._lookup_all(self._probe_image, urls, self.IMAGE_SET_STATEMENT, self._image_memo,
+                                LOOKUP_CONCURRENCY if concurrency is None else concurrency, strict)
@@ -1,14 +1,15 @@
 """Classes and constants that represent an Ismaili Insight HTML newsletter."""
 import re
 import os
+import copy
 import hashlib
 from collections import Counter
 from datetime import datetime
 import bs4
 import requests
-from PIL import Image
 import cache
 import exceptions
+import transform
 
 
 # The review method should eventually . . .
@@ -20,9 +21,41 @@ class Document:
     # Class constants
     BASE_URL = 'https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/'
     SNAPSHOT_DIR = 'data/snapshots'
-
-    def __init__(self, code):
-        """Initialize a document from the given code."""
+    REVIEW_JOBS = 8  # The number of urls and addresses verified at the same time during a review.
+    IMAGE_JOBS = 8  # The number of images measured at the same time before a transform is applied.
+    PARSERS = ('html5lib', 'lxml', 'html.parser')  # The BeautifulSoup builders that can parse the code.
+    DEFAULT_PARSER = os.environ.get('IITECH3_PARSER', 'html5lib')  # The builder used when none is given.
+    EXTERNAL_HREF_PATTERN = re.compile(
+        r'^(?:##TrackClick##)?https?://(?:[a-z0-9]+\.)?[a-z0-9]+\.[a-z0-9]+|^##.+##$|^$', re.I)
+    INTERNAL_HREF_PATTERN = re.compile(r'^#(?!#)')
+    EMAIL_HREF_PATTERN = re.compile(r'^mailto:', re.I)
+    TYPO_PATTERN = re.compile(r'ismailinsight\.org', re.I)  # The misspelt domain corrected by a repair.
+    REVIEW_RULES = (  # The href patterns of the 'a' tags and the methods that check them during a review.
+        (EXTERNAL_HREF_PATTERN, '_check_external_link'),
+        (INTERNAL_HREF_PATTERN, '_check_internal_link'),
+        (EMAIL_HREF_PATTERN, '_check_email')
+    )
+    CONTENT_BUILDERS = {  # The kinds of compiled content descriptor and the methods that add them to a tag.
+        'hyperlink': '_add_hyperlink',
+        'image': '_add_image',
+        'formatted': '_add_formatted',
+        'navigation': '_add_navigation',
+        'list': '_add_list'
+    }
+
+    def __init__(self, code, *, parser=None):
+        """Initialize a document from the given code, parsed with the parser (DEFAULT_PARSER if None).
+
+        html5lib is the slowest of the PARSERS but parses the code the way a browser does. lxml is the fastest
+        and, like html.parser, gives the same elements, attributes and text for the newsletters; only the line
+        breaks around the html and head tags differ. Around a fragment, html5lib adds an html tag with an empty
+        head, lxml adds an html tag only and html.parser adds nothing.
+        """
+        parser = self.DEFAULT_PARSER if parser is None else parser
+        if parser not in self.PARSERS:
+            raise exceptions.UnknownParser(parser, self.PARSERS)
+        self._parser = parser
+        self._images = {}  # The information of the images prefetched by apply, by source
         code = str(code)
         if os.path.isfile(code):
             with open(code, 'r') as markup:
@@ -34,7 +67,7 @@ class Document:
             r'<!DOCTYPE HTML PUBLIC “-//W3C//DTD HTML 4\.01 Transitional//EN” “http://www\.w3\.org/TR/html4/loose\.dtd”>', # noqa
             '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">',
             code, flags=re.I)
-        self._data = bs4.BeautifulSoup(code, 'html5lib')
+        self._data = bs4.BeautifulSoup(code, self._parser)
 
     # BeautifulSoup Search helpers
     @staticmethod
@@ -85,41 +118,61 @@ class Document:
         Confirm that the 'a' tag is not useless.
         Confirm that the 'a' tag is set to open in a new window.
         Confirm that the 'a' tag does not have an existing tracking link.
-        Confirm that the 'a' tag has a valid link.
+        Return the url that still needs to be verified, or None if there is none.
         """
         result = {
             'removed': 0,
             'retargetted': 0,
-            'decoded': 0,
-            'broken': 0,
-            'unchecked': 0
+            'decoded': 0
         }
-        if link['href'] in ('##TrackClick##', '') or re.search(r'^\s*$', link.text) is not None:
+        if self._is_useless_link(link):
             result['removed'] = 1
             link.decompose()
-            return result
+            return result, None
 
         if link.get('target') is None or link['target'].lower() != '_blank':
             result['retargetted'] = 1
             link['target'] = '_blank'
 
-        match = re.match(r'http://www\.ismailiinsight\.org/enewsletterpro/(?:v|t)\.aspx\?.*url=(.+?)(?:&|$)',
-                         link['href'], re.I)
-        if match is not None:
+        decoded = self._decode_href(link['href'])
+        if decoded is not None:
             result['decoded'] = 1
-            link['href'] = requests.compat.unquote_plus(match.group(1))
+            link['href'] = decoded
 
-        if re.match(r'^##.+##$', link['href']) is None:
-            url = re.sub(r'^##.+##', '', link['href'])  # strip off the ##TRACKCLICK## if applicable
-            info = cache.get_default().get_webpage(url)
+        return result, self._get_link_url(link['href'])
 
-            if info.status == 403:
-                result['unchecked'] = 1
-                link.insert(0, '*UNCHECKED*')
-            elif 400 <= info.status < 600:
-                result['broken'] = 1
-                link.insert(0, '*BROKEN {:d}*'.format(info.status))
+    @staticmethod
+    def _is_useless_link(link):
+        """Determine whether an 'a' tag that references an external resource leads nowhere or shows nothing."""
+        return link['href'] in ('##TrackClick##', '') or re.search(r'^\s*$', link.text) is not None
+
+    @staticmethod
+    def _decode_href(href):
+        """Get the href that a doubly-tracked href wraps, or None if it is not doubly-tracked."""
+        match = re.match(r'http://www\.ismailiinsight\.org/enewsletterpro/(?:v|t)\.aspx\?.*url=(.+?)(?:&|$)',
+                         href, re.I)
+        return None if match is None else requests.compat.unquote_plus(match.group(1))
 
+    @staticmethod
+    def _get_link_url(href):
+        """Get the url that an href leads to, or None if it is only a tracking tag."""
+        if re.match(r'^##.+##$', href) is not None:
+            return None
+        return re.sub(r'^##.+##', '', href)  # strip off the ##TRACKCLICK## if applicable
+
+    @staticmethod
+    def _mark_external_link(link, info):
+        """Mark an 'a' tag that references an external resource according to the status of its url."""
+        result = {
+            'broken': 0,
+            'unchecked': 0
+        }
+        if info.status == 403:
+            result['unchecked'] = 1
+            link.insert(0, '*UNCHECKED*')
+        elif 400 <= info.status < 600:
+            result['broken'] = 1
+            link.insert(0, '*BROKEN {:d}*'.format(info.status))
         return result
 
     def _fix_internal_link(self, link, anchors):
@@ -148,27 +201,36 @@ class Document:
         """Fix an 'a' tag that composes an email.
 
         Confirm that the 'a' tag is not useless.
-        Confirm that the 'a' tag has a valid email.
         Confirm that the 'a' tag does not have extra spaces (ie %20).
+        Return the address that still needs to be verified, or None if there is none.
         """
         result = {
-            'invalid': 0,
             'cleaned': 0,
-            'unchecked': 0,
             'removed': 0
         }
         if re.search(r'^\s*$', email.text) is not None:
             result['removed'] = 1
             email.decompose()
-            return result
+            return result, None
 
         if re.search(r'%20', email['href']) is not None:
             result['cleaned'] = 1
             email['href'] = re.sub(r'%20', '', email['href'])
 
-        address = email['href'][7:]  # strip off the leading mailto:
-        info = cache.get_default().get_email(address)
+        return result, self._get_address(email['href'])
+
+    @staticmethod
+    def _get_address(href):
+        """Get the address that a mailto href composes to."""
+        return re.sub(r'%20', '', href)[7:]  # strip off the leading mailto:
 
+    @staticmethod
+    def _mark_email(email, info):
+        """Mark an 'a' tag that composes an email according to the validity of its address."""
+        result = {
+            'invalid': 0,
+            'unchecked': 0
+        }
         if not info.is_valid:
             if info.reason == 'accepted_email':
                 result['unchecked'] = 1
@@ -178,12 +240,95 @@ class Document:
                 email.insert(0, '*INVALID {:s}*'.format(info.reason))
         return result
 
-    def review(self):
+    def _check_external_link(self, link, result, found):
+        """Fix an 'a' tag that references an external resource and keep its url to be verified.
+
+        The url is not kept if the href was decoded into one that is not external, such as an email or a jump,
+        which the next REVIEW_RULES check instead.
+        """
+        fixes, url = self._fix_external_link(link)
+        result['links'] += Counter(fixes)
+        if url is not None and self.EXTERNAL_HREF_PATTERN.search(link['href']) is not None:
+            found['external_links'].append((link, url))
+
+    @staticmethod
+    def _check_internal_link(link, result, found):
+        """Keep an 'a' tag that references an anchor to be fixed once every anchor is known."""
+        found['internal_links'].append(link)
+
+    def _check_email(self, email, result, found):
+        """Fix an 'a' tag that composes an email and keep its address to be verified."""
+        fixes, address = self._fix_email(email)
+        result['emails'] += Counter(fixes)
+        if address is not None:
+            found['emails'].append((email, address))
+
+    def _check_links(self, result):
+        """Check every 'a' tag in a single pass over the document.
+
+        Each tag with an href is checked by the method of the first of the REVIEW_RULES whose pattern matches
+        it. If the check changes the href, the rules after that one are tried with the new href, so that a
+        doubly-tracked link that wraps an email or a jump is checked as one too, as it is when every rule gets
+        a pass of its own. The names of the anchors that remain are collected along the way. Return a dict of
+        what was found: the set of 'anchors' and the lists of 'external_links', 'internal_links' and 'emails'
+        left.
+        """
+        found = {
+            'anchors': set(),
+            'external_links': [],
+            'internal_links': [],
+            'emails': []
+        }
+        rules = [(pattern, getattr(self, name)) for pattern, name in self.REVIEW_RULES]
+        for link in self._data.find_all('a'):
+            href = link.get('href')
+            for pattern, check in rules:
+                if href is not None and pattern.search(href) is not None:
+                    check(link, result, found)
+                    if link.parent is None:  # removed by its check
+                        break
+                    href = link.get('href')
+            if link.parent is not None and self._is_anchor(link):  # not removed by its check
+                found['anchors'].add(link['name'])
+        return found
+
+    @staticmethod
+    def _verify(urls, addresses, jobs):
+        """Get the status of every url and the validity of every address.
+
+        Read them all from the cache at once and look up the missing or outdated ones online,
+        keeping up to jobs lookups in flight. In stale-while-revalidate mode, the outdated ones are
+        used as they are and refreshed in the background instead. Return a tuple of dicts that map
+        each url and each address to its information.
+        """
+        db = cache.get_default()
+        with db.batch():
+            webpages = db.get_webpages(urls)
+            emails = db.get_emails(addresses)
+            if db.stale_while_revalidate:
+                db.refresh_webpages(webpages['stale'])
+                db.refresh_emails(emails['stale'])
+                db.lookup_webpages(webpages['missing'], concurrency=jobs)
+                db.lookup_emails(emails['missing'], concurrency=jobs)
+            else:
+                db.lookup_webpages(list(webpages['stale']) + webpages['missing'], concurrency=jobs)
+                db.lookup_emails(list(emails['stale']) + emails['missing'], concurrency=jobs)
+
+            webpages = db.get_webpages(urls)
+            emails = db.get_emails(addresses)
+        return dict(webpages['stale'], **webpages['fresh']), dict(emails['stale'], **emails['fresh'])
+
+    def review(self, *, jobs=REVIEW_JOBS):
         """Review the document for accuracy before sending it out.
 
         Ensure accuracy of all hyperlinks.
         Ensure accuracy of all anchors.
         Ensure accuracy of all mailto links.
+        Report the hosts that were skipped after failing to connect too often.
+
+        The review is done in 3 passes. The first walks the document once to collect every url, address
+        and anchor while fixing what can be fixed locally, the second verifies them with up to jobs online
+        lookups at a time and the last marks the 'a' tags according to the results.
         """
         result = {
             'links': Counter(),
@@ -191,30 +336,54 @@ class Document:
             'emails': Counter()
         }
 
-        external_links = self._data.find_all(
-            'a',
-            href=re.compile(r'^(?:##TrackClick##)?https?://(?:[a-z0-9]+\.)?[a-z0-9]+\.[a-z0-9]+|^##.+##$|^$', re.I)
-        )
-        for link in external_links:
-            result['links'] += Counter(self._fix_external_link(link))
+        # Collect
+        found = self._check_links(result)
+        external_links = found['external_links']
+        emails = found['emails']
+        for link in found['internal_links']:
+            result['anchors'] += Counter(self._fix_internal_link(link, found['anchors']))
 
-        anchors = [a['name'] for a in self._data.find_all(self._is_anchor)]
-        internal_links = self._data.find_all(
-            'a',
-            href=re.compile(r'^#(?!#)')
-        )
-        for link in internal_links:
-            result['anchors'] += Counter(self._fix_internal_link(link, anchors))
+        # Verify
+        webpages, addresses = self._verify([u for _, u in external_links], [a for _, a in emails], jobs)
 
-        emails = self._data.find_all(
-            'a',
-            href=re.compile(r'^mailto:', re.I)
-        )
-        for email in emails:
-            result['emails'] += Counter(self._fix_email(email))
+        # Annotate
+        for link, url in external_links:
+            result['links'] += Counter(self._mark_external_link(link, webpages[url]))
+        for email, address in emails:
+            result['emails'] += Counter(self._mark_email(email, addresses[address]))
 
+        result['hosts'] = cache.get_default().open_circuits()
         return result
 
+    def references(self):
+        """Get every url, address and image source that the document references without changing it.
+
+        The links and emails that a review would remove are left out, the doubly-tracked links are decoded
+        and the image sources are resolved and quoted as apply does. Return a dict of lists under the
+        keys 'urls', 'addresses' and 'images', in the order in which they first appear in the document.
+        """
+        urls = []
+        for link in self._data.find_all('a', href=self.EXTERNAL_HREF_PATTERN):
+            if self._is_useless_link(link):
+                continue
+            href = self._decode_href(link['href']) or link['href']
+            url = self._get_link_url(href)
+            if url is not None:
+                urls.append(url)
+
+        addresses = [self._get_address(email['href'])
+                     for email in self._data.find_all('a', href=self.EMAIL_HREF_PATTERN)
+                     if re.search(r'^\s*$', email.text) is None]
+
+        images = [self._get_image_source(image['src'])
+                  for image in self._data.find_all('img', src=re.compile(r'^(?!data:)\S', re.I))]
+
+        return {
+            'urls': list(dict.fromkeys(urls)),
+            'addresses': list(dict.fromkeys(addresses)),
+            'images': list(dict.fromkeys(images))
+        }
+
     # Repair method
     def repair(self):
         """Repair the document for any errors/bugs/typos/etc that are preventing it from loading correctly.
@@ -229,16 +398,14 @@ class Document:
             'background': 0
         }
 
-        code = str(self._data)
-        code, result['typos'] = re.subn(r'ismailinsight\.org', 'ismailiinsight.org', code, flags=re.I)
-        self._data = bs4.BeautifulSoup(code, 'html5lib')
+        result['typos'] = self._fix_typos()
 
         for tag in self._data.find_all('style'):
             result['styles'] += 1
             tag.decompose()
 
         div_child = self._data.body.find('div', recursive=False)
-        if div_child is None or div_child['style'] != 'background-color: #595959;':
+        if div_child is None or div_child.get('style') != 'background-color: #595959;':
             result['background'] = 1
             div = self._data.new_tag('div', style='background-color: #595959;')
             for i in range(len(self._data.body.contents)):
@@ -247,27 +414,61 @@ class Document:
 
         return result
 
+    def _fix_typos(self):
+        """Correct the typo in ismailinsight.org in every string and attribute value of the document.
+
+        The tree is changed in place in a single walk. Return the number of corrections.
+        """
+        count = 0
+        for node in list(self._data.descendants):
+            if isinstance(node, bs4.Tag):
+                for name, value in node.attrs.items():
+                    if isinstance(value, list):  # multi-valued attributes like class
+                        fixed = [self.TYPO_PATTERN.subn('ismailiinsight.org', v) for v in value]
+                        if any(n > 0 for _, n in fixed):
+                            value[:] = [v for v, _ in fixed]
+                            count += sum(n for _, n in fixed)
+                    else:
+                        fixed, n = self.TYPO_PATTERN.subn('ismailiinsight.org', value)
+                        if n > 0:
+                            node[name] = fixed
+                            count += n
+            else:
+                fixed, n = self.TYPO_PATTERN.subn('ismailiinsight.org', node)
+                if n > 0:
+                    node.replace_with(type(node)(fixed))
+                    count += n
+        return count
+
     # Transform method and helpers
     @staticmethod
     def _ensure_quoted(url):
         """Ensure that the given url is quoted."""
         return requests.compat.quote(requests.compat.unquote(url))
 
-    def _get_image_details(self, image_url):
-        """Get the proper source, height and width of the image specified by the given partial url."""
-        class RequestReader:
-            def __init__(self, request_object):
-                self._object = request_object
+    @classmethod
+    def _get_image_source(cls, image_url):
+        """Get the proper source of the image specified by the given partial or absolute url.
 
-            def read(self):
-                return self._object.content
+        Only the path is quoted, so that the source of an image is the same whether it is given by a transform
+        or read back from a document it was added to.
+        """
+        source = requests.compat.urlparse(requests.compat.urljoin(cls.BASE_URL, image_url))
+        return source._replace(path=cls._ensure_quoted(source.path)).geturl()
+
+    def _get_image_details(self, image_url):
+        """Get the proper source, height and width of the image specified by the given partial url.
 
-        source = requests.compat.urljoin(self.BASE_URL, self._ensure_quoted(image_url))
-        data = Image.open(RequestReader(requests.get(source)))
+        The image is read from the ones prefetched by apply, or from the cache if it was not prefetched.
+        """
+        source = self._get_image_source(image_url)
+        info = self._images.get(source)
+        if info is None:
+            info = cache.get_default().get_image(source)
         return {
             'source': source,
-            'width': data.width,
-            'height': data.height
+            'width': info.width,
+            'height': info.height
         }
 
     def _add_hyperlink(self, parent_tag, descriptor):
@@ -381,35 +582,18 @@ class Document:
         parent_tag.append(list_tag)
 
     def _set_content(self, parent_tag, content_list):
-        """Convert the content_list to proper HTML and enclose with the given parent_tag."""
-        if not isinstance(content_list, list):
-            content_list = [content_list]
+        """Convert the compiled content_list to proper HTML and enclose with the given parent_tag.
+
+        The content was checked when its plan was compiled, so each descriptor is simply added by the method
+        for its kind.
+        """
         parent_tag.clear()
         for item in content_list:
-            if isinstance(item, dict):
-                hyperlinks = {'link', 'file', 'email'}
-                formats = {'bold', 'italics', 'underline'}
-                navigation = {'jump', 'anchor'}
-                lists = {'numbers', 'bullets'}
-                # Using set intersection ((keys_to_search_for) & item.keys()),
-                # The set will be empty when the keys are not found.
-                # This takes advantage of the fact that empty == False and non-empty == True.
-                if hyperlinks & item.keys():
-                    self._add_hyperlink(parent_tag, item)
-                elif 'image' in item:
-                    self._add_image(parent_tag, item)
-                elif formats & item.keys():
-                    self._add_formatted(parent_tag, item)
-                elif navigation & item.keys():
-                    self._add_navigation(parent_tag, item)
-                elif lists & item.keys():
-                    self._add_list(parent_tag, item)
-                else:
-                    raise exceptions.UnknownTransform(item,
-                                                      hyperlinks + formats + navigation +
-                                                      lists + {'image'})
+            if isinstance(item, tuple):
+                kind, descriptor = item
+                getattr(self, self.CONTENT_BUILDERS[kind])(parent_tag, descriptor)
             else:
-                parent_tag.append(str(item))
+                parent_tag.append(item)
 
     def _clear_body(self, before_body, after_body):
         """Clear the body of all pre-existing content."""
@@ -475,53 +659,109 @@ class Document:
         table_tag.append(tbody_tag)
         before_body.insert_after(table_tag)
 
-    def apply(self, transforms):
-        """Apply a transformation to the document (eg make all national changes to the document)."""
-        if 'top' in transforms:
+    @classmethod
+    def prefetch_images(cls, images, *, jobs=IMAGE_JOBS):
+        """Get the information of every image of a plan, given by their partial urls, before it is applied.
+
+        The images that are not fresh in the cache are measured online together, with up to jobs
+        lookups in flight, so that applying the transforms takes the time of the slowest image rather
+        than the sum of them all. Return a dict that maps the source of each image to its information.
+        Raise the error of the first image that cannot be measured.
+        """
+        sources = list(dict.fromkeys(cls._get_image_source(i) for i in images))
+        db = cache.get_default()
+        with db.batch():
+            images = db.get_images(sources)
+            db.lookup_images(list(images['stale']) + images['missing'], concurrency=jobs)
+            images = db.get_images(sources)
+        return dict(images['stale'], **images['fresh'])
+
+    @classmethod
+    def _blank(cls, images, parser=None):
+        """Create an empty document, without an issue, in which tags are built with the information of images."""
+        blank = cls.__new__(cls)
+        blank._parser = cls.DEFAULT_PARSER if parser is None else parser
+        if blank._parser not in cls.PARSERS:
+            raise exceptions.UnknownParser(blank._parser, cls.PARSERS)
+        blank._images = images
+        blank._data = bs4.BeautifulSoup('', blank._parser)
+        return blank
+
+    @staticmethod
+    def _insert_copies(reference_tag, nodes):
+        """Insert a copy of each of the nodes after the reference_tag, in order."""
+        for node in nodes:
+            node = copy.copy(node)
+            reference_tag.insert_after(node)
+            reference_tag = node
+
+    @staticmethod
+    def _set_copies(parent_tag, nodes):
+        """Replace the content of the parent_tag with a copy of each of the nodes."""
+        parent_tag.clear()
+        for node in nodes:
+            parent_tag.append(copy.copy(node))
+
+    def apply(self, transforms, *, jobs=IMAGE_JOBS):
+        """Apply a transformation to the document (eg make all national changes to the document).
+
+        The transforms are either the Fragments built from a transform.Plan, a plan or the dict loaded from a
+        transform file. A dict is compiled into a plan first so that invalid transforms are refused before
+        anything is done. The images of a plan are then measured, with up to jobs lookups at a time, and its
+        fragments are built, so that the document is not changed at all if one of the images cannot be.
+        Since neither a plan nor its fragments are changed, they can be applied to any number of documents.
+        Return the part of the transforms that could not be applied.
+        """
+        if isinstance(transforms, Fragments):
+            fragments = transforms
+        else:
+            plan = transforms if isinstance(transforms, transform.Plan) else transform.Plan(transforms)
+            fragments = Fragments(plan, self.prefetch_images(plan.images, jobs=jobs), parser=self._parser)
+        plan = fragments.plan
+        not_applied = copy.deepcopy(plan.source)
+        if fragments.top is not None:
             front_image = self._data.find('img', src=re.compile(r'^https://ismailiinsight\.org/eNewsletterPro/uploadedimages/000001/National/default\.jpg$|National')) # noqa
             front_caption = front_image.parent.parent.find_next_sibling('tr').td
 
-            image_data = self._get_image_details(transforms['top']['image'])
+            image_data = fragments.top['image']
             front_image['src'] = image_data['source']
             front_image['width'] = image_data['width']
             front_image['height'] = image_data['height']
-            self._set_content(front_caption, transforms['top']['caption'])
-            del transforms['top']
+            self._set_copies(front_caption, fragments.top['caption'])
+            del not_applied['top']
 
         articles = self._data.find_all(self._is_article_title)
+        applied = set()
         for art in articles:
             if art.parent.name == 'a':
                 art = art.parent
             title = art.text.strip()
-            if title not in transforms:
+            if title not in plan.articles or title in applied:
                 continue
+            applied.add(title)
+            fragment = fragments.articles[title]
+            remaining = not_applied[title]
 
             # Transform body
             # left/right specifiers override a body specifier
             before_body = art.find_next_sibling(self._is_before_body)
             after_body = art.find_next_sibling(self._is_before_return)
 
-            if len({'body', 'left', 'right'} & transforms[title].keys()) != 0:
+            if 'body' in fragment:
                 self._clear_body(before_body, after_body)
-                try:
-                    self._add_left_right(before_body, transforms[title])
-                    del transforms[title]['left']
-                    del transforms[title]['right']
-                except KeyError:
-                    self._add_paragraphs(before_body, transforms[title], 'body')
-                    del transforms[title]['body']
+                self._insert_copies(before_body, fragment['body'])
+                for specifier in fragment['specifiers']:
+                    del remaining[specifier]
 
             # Transform title
-            try:
-                self._set_content(art, transforms[title]['title'])
-                del transforms[title]['title']
-            except KeyError:
-                pass
+            if 'title' in fragment:
+                self._set_copies(art, fragment['title'])
+                del remaining['title']
 
-            if len(transforms[title]) == 0:
-                del transforms[title]
+            if len(remaining) == 0:
+                del not_applied[title]
 
-        return transforms
+        return not_applied
 
     # snapshot methods and helpers
     def _get_issue_info(self, code):
@@ -609,7 +849,7 @@ class Document:
         index = int(index)
         d, r, snapshots = self.list(date=date, region=region)
         old_snapshot = snapshots[index]
-        self.__init__(old_snapshot[2])
+        self.__init__(old_snapshot[2], parser=self._parser)
         return old_snapshot
 
     # magic methods
@@ -620,3 +860,52 @@ class Document:
                       '<!DOCTYPE HTML PUBLIC “-//W3C//DTD HTML 4.01 Transitional//EN” “http://www.w3.org/TR/html4/loose.dtd”>', # noqa
                       str(self._data), flags=re.I)
         return code
+
+
+class Fragments:
+    """The tags that a plan adds to a document, built once so that they can be copied into any number of them."""
+
+    def __init__(self, plan, images, *, parser=None):
+        """Build the tags of every part of the plan, with images being the information given by prefetch_images.
+
+        The tags are built in an empty document parsed by the parser (Document.DEFAULT_PARSER if None), which
+        should be the one of the documents they are copied into so that they are output the same way.
+        """
+        builder = Document._blank(images, parser)
+        self.plan = plan
+        self.top = None
+        if plan.top is not None:
+            self.top = {
+                'image': builder._get_image_details(plan.top['image']),
+                'caption': self._build_content(builder, plan.top['caption'])
+            }
+
+        self.articles = {}
+        for title, group in plan.articles.items():
+            fragment = {}
+            if 'left' in group:
+                fragment['body'] = self._build_body(builder, lambda tag: builder._add_left_right(tag, group))
+                fragment['specifiers'] = ('left', 'right')
+            elif 'body' in group:
+                fragment['body'] = self._build_body(builder, lambda tag: builder._add_paragraphs(tag, group, 'body'))
+                fragment['specifiers'] = ('body',)
+            if 'title' in group:
+                fragment['title'] = self._build_content(builder, group['title'])
+            self.articles[title] = fragment
+
+    @staticmethod
+    def _build_content(builder, content):
+        """Get the nodes of the compiled content."""
+        holder = builder._data.new_tag('div')
+        builder._set_content(holder, content)
+        return tuple(holder.contents)
+
+    @staticmethod
+    def _build_body(builder, add):
+        """Get the nodes that the add function puts after the tag it is given, which are the body of an article."""
+        holder = builder._data.new_tag('div')
+        before_body = builder._data.new_tag('div')
+        holder.append(before_body)
+        add(before_body)
+        before_body.extract()
+        return tuple(holder.contents)
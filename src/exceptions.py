@@ -14,6 +14,27 @@ class CacheMissException(IITech3Exception):
         """Create an exception stating that the value is not found in the cache."""
         super().__init__('{!r:} is not in the cache.'.format(value))
 
+class MalformedEntryException(IITech3Exception):
+    """Raised by the Cache when an imported entry cannot be read."""
+
+    def __init__(self, line_number, problem):
+        """Create an exception stating which line of the import is malformed and why."""
+        super().__init__('Line {:d} is not a valid cache entry: {:s}.'.format(line_number, problem))
+
+# Network exceptions
+class HostUnavailableException(IITech3Exception):
+    """Raised by the SessionPool instead of sending a request to a host that keeps failing."""
+
+    def __init__(self, host, reason):
+        """Create an exception stating that the host is skipped and why."""
+        super().__init__('{!r:} is skipped: {:s}.'.format(host, reason))
+        self.host = host
+        self.reason = reason
+
+class ServiceException(IITech3Exception):
+    """Raised by the cache service and its clients when a call cannot be made through it."""
+    pass
+
 # Document Manipulation exceptions
 class UnknownTransform(IITech3Exception):
     """Raised by the Document during transformation when a content descriptor is invalid.."""
@@ -22,3 +43,18 @@ class UnknownTransform(IITech3Exception):
         """Create an exception listing the valid content descriptor."""
         super().__init__('{!s:} is not a valid content descriptor. '.format(bad_descriptor) +
                          'Please choose from {!s:}.'.format(allowed_descriptors))
+
+class InvalidTransform(IITech3Exception):
+    """Raised while compiling a transform when part of it is not shaped as expected."""
+
+    def __init__(self, location, problem):
+        """Create an exception stating where the transform is invalid and why."""
+        super().__init__('{:s} is not a valid transform: {:s}.'.format(location, problem))
+
+class UnknownParser(IITech3Exception):
+    """Raised by the Document when the code is to be parsed by an unsupported parser."""
+
+    def __init__(self, bad_parser, allowed_parsers):
+        """Create an exception listing the supported parsers."""
+        super().__init__('{!s:} is not a supported parser. '.format(bad_parser) +
+                         'Please choose from {!s:}.'.format(allowed_parsers))
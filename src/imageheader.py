@@ -0,0 +1,77 @@
+"""Functions for reading the dimensions of an image from the first bytes of its file."""
+import struct
+
+
+# Global variables to configure used by the functions to allow for easy configuration
+SNIFF_SIZE = 8192  # The number of bytes at the start of a file that are read to find its dimensions.
+
+# Private variables
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+_JPEG_SIGNATURE = b'\xff\xd8'
+_JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}  # DHT, JPG and DAC share the range.
+_JPEG_STANDALONE_MARKERS = frozenset(range(0xd0, 0xd9)) | {0x01}  # RSTn, SOI and TEM have no length.
+
+
+def _get_png_dimensions(header):
+    """Get the dimensions of a PNG image from its IHDR chunk, which always comes first."""
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+
+def _get_gif_dimensions(header):
+    """Get the dimensions of a GIF image from its logical screen descriptor."""
+    if len(header) < 10:
+        return None
+    return struct.unpack('<HH', header[6:10])
+
+
+def _get_jpeg_dimensions(header):
+    """Get the dimensions of a JPEG image from its first start of frame segment.
+
+    The segments before it, such as the EXIF data and the quantization tables, are skipped by their length.
+    """
+    i = len(_JPEG_SIGNATURE)
+    while i + 4 <= len(header):
+        if header[i] != 0xff:
+            return None  # not at a marker, so the file is corrupt
+        marker = header[i + 1]
+        if marker == 0xff:  # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > len(header):
+                return None
+            height, width = struct.unpack('>HH', header[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', header[i + 2:i + 4])[0]
+    return None
+
+
+def is_supported(header):
+    """Determine whether the file that starts with the bytes of header is a JPEG, PNG or GIF image."""
+    return bytes(header[:len(_PNG_SIGNATURE)]).startswith((_PNG_SIGNATURE, _JPEG_SIGNATURE) + _GIF_SIGNATURES)
+
+
+def get_dimensions(header):
+    """Get the width and height of the image whose file starts with the bytes of header.
+
+    JPEG, PNG and GIF files are recognized. Return None if the format is unknown or if the dimensions are
+    not within header, in which case the whole file has to be decoded.
+    """
+    header = bytes(header)
+    if header.startswith(_PNG_SIGNATURE):
+        dimensions = _get_png_dimensions(header)
+    elif header.startswith(_GIF_SIGNATURES):
+        dimensions = _get_gif_dimensions(header)
+    elif header.startswith(_JPEG_SIGNATURE):
+        dimensions = _get_jpeg_dimensions(header)
+    else:
+        return None
+    if dimensions is None or 0 in dimensions:
+        return None
+    return tuple(dimensions)
@@ -2,15 +2,20 @@
 """The main script that serves as the program entry point."""
 
 # Imports
+import os
+import sys
 import argparse
+import time
+import json
+import signal
+from collections import OrderedDict
 from datetime import datetime
-from requests.status_codes import _codes as url_statuses
-import yaml
-import document
-import pasteboard
 import cache
+import service
 import exceptions
 import version
+# document, pasteboard, yaml and requests take longer to import than most actions take to run,
+# so they are only imported by the functions that use them.
 
 # String Constants
 PROG_NAME = version.__title__
@@ -21,7 +26,7 @@ REVIEW_DESC = 'Review the HTML template for correctness before sending it out.'
 REPAIR_ACT = 'repair'
 REPAIR_DESC = "Repair the HTML template if it isn't loading correctly."
 APPLY_ACT = 'apply'
-APPLY_DESC = 'Apply a transform to the HTML template. This does not review or repair it.'
+APPLY_DESC = 'Apply a transform to one or more HTML templates. This does not review or repair them.'
 
 EMAIL_TYPE = 'email'
 WEBPAGE_TYPE = 'webpage'
@@ -36,6 +41,21 @@ MARK_DESC = 'Manually mark the status of an email or a url.'
 MARK_EMAIL_DESC = 'Manually mark the status of an email.'
 MARK_WEBPAGE_DESC = 'Manually mark the status of a webpage.'
 
+CACHE_ACT = 'cache'
+CACHE_DESC = 'Manage the cache of statuses.'
+WARM_CMD = 'warm'
+WARM_DESC = 'Look up every link, email and image of the HTML templates that is not fresh in the cache.'
+GC_CMD = 'gc'
+GC_DESC = 'Delete old or rarely used entries from the cache and compact it.'
+EXPORT_CMD = 'export'
+EXPORT_DESC = 'Write every entry of the cache to a JSON lines file.'
+IMPORT_CMD = 'import'
+IMPORT_DESC = 'Add the entries of JSON lines files written by export to the cache.'
+SERVE_CMD = 'serve'
+SERVE_DESC = 'Run the cache as a service that every other invocation of the program uses while it runs.'
+STATS_CMD = 'stats'
+STATS_DESC = 'Print the size and age of the cache and how its reads and lookups went.'
+
 SNAPSHOT_ACT = 'snapshot'
 SAVE_CMD = 'save'
 LOAD_CMD = 'load'
@@ -55,6 +75,7 @@ def mkdate(date_string):
 def get_code(path):
     """Read in the code from the specified file or the pasteboard."""
     if path is None:
+        import pasteboard
         return pasteboard.get()
     else:
         with open(path, 'r', encoding='UTF-8') as html_file:
@@ -65,6 +86,7 @@ def get_code(path):
 def set_code(path, doc):
     """Write the Document to the specified file or the pasteboard."""
     if path is None:
+        import pasteboard
         pasteboard.set(doc)
     else:
         with open(path, 'w', encoding='UTF-8') as html_file:
@@ -73,8 +95,11 @@ def set_code(path, doc):
 
 def review(args):
     """Perform a review operation specified by the given arguments."""
-    html_doc = document.Document(get_code(args.file))
-    summary = html_doc.review()
+    import document
+    html_doc = document.Document(get_code(args.file), parser=args.parser)
+    if args.stale:
+        cache.get_default().stale_while_revalidate = True
+    summary = html_doc.review() if args.jobs is None else html_doc.review(jobs=args.jobs)
 
     print(
         '{:d} blank links removed.'.format(summary['links']['removed']),
@@ -88,14 +113,18 @@ def review(args):
         '{:d} emails cleaned.'.format(summary['emails']['cleaned']),
         '{:d} invalid emails marked.'.format(summary['emails']['invalid']),
         '{:d} unchecked emails marked.'.format(summary['emails']['unchecked']),
+        '{:d} hosts skipped after repeated connection failures.'.format(len(summary['hosts'])),
         sep='\n'
     )
+    for host, reason in sorted(summary['hosts'].items()):
+        print('    {:s}: {:s}.'.format(host, reason))
     set_code(args.file, html_doc)
 
 
 def repair(args):
     """Perform a repair operation specified by the given arguments."""
-    html_doc = document.Document(get_code(args.file))
+    import document
+    html_doc = document.Document(get_code(args.file), parser=args.parser)
     summary = html_doc.repair()
 
     print(
@@ -107,19 +136,70 @@ def repair(args):
     set_code(args.file, html_doc)
 
 
-def apply(args):
-    """Apply a transform to an HTML template."""
-    html_doc = document.Document(get_code(args.file))
-    with open(args.transform_file, 'r', encoding='UTF-8') as tfr_file:
-        tfr_json = yaml.load(tfr_file)
-    not_applied = html_doc.apply(tfr_json)
+_apply_fragments = None  # The fragments that apply copies into each document of the process.
+
 
+def _init_apply_worker(plan, images, parser):
+    """Build the fragments of the plan, whose images are already measured, once for the process."""
+    global _apply_fragments
+    import document
+    _apply_fragments = document.Fragments(plan, images, parser=parser)
+
+
+def _apply_file(path, parser):
+    """Copy the fragments of the process into the HTML template at path and get what could not be applied."""
+    import document
+    html_doc = document.Document(get_code(path), parser=parser)
+    not_applied = html_doc.apply(_apply_fragments)
+    set_code(path, html_doc)
+    return not_applied
+
+
+def _print_not_applied(prefix, not_applied):
+    """Print the part of the transforms that could not be applied to a template."""
+    import yaml
     if len(not_applied) == 0:
-        print('All transforms applied.')
+        print(prefix + 'All transforms applied.')
     else:
-        print('The following transforms could not be applied:')
+        print(prefix + 'The following transforms could not be applied:')
         print(yaml.dump(not_applied))
-    set_code(args.file, html_doc)
+
+
+def apply(args):
+    """Apply a transform to one or more HTML templates.
+
+    The transform file is compiled and its images are measured once for all of the templates. Several
+    templates are transformed at the same time by a pool of up to args.workers processes (one per core by
+    default), each of which builds the fragments of the transform once and copies them into its templates.
+    The result of each template is printed as soon as it is done. If some of them fail, the others are still
+    transformed and the error of the first one to fail is raised once they are all done.
+    """
+    import document
+    import transform
+    plan = transform.load(args.transform_file)  # invalid transforms fail before any template is read
+    jobs = document.Document.IMAGE_JOBS if args.jobs is None else args.jobs  # document is not imported by the parser
+    images = document.Document.prefetch_images(plan.images, jobs=jobs)
+
+    if len(args.files) == 1:
+        _init_apply_worker(plan, images, args.parser)
+        _print_not_applied('', _apply_file(args.files[0], args.parser))
+        return
+
+    import concurrent.futures
+    workers = min(len(args.files), args.workers or os.cpu_count() or 1)
+    first_error = None
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_apply_worker,
+                                                initargs=(plan, images, args.parser)) as pool:
+        paths = {pool.submit(_apply_file, path, args.parser): path for path in args.files}
+        for future in concurrent.futures.as_completed(paths):
+            prefix = '{:s}: '.format(paths[future])
+            try:
+                _print_not_applied(prefix, future.result())
+            except Exception as error:
+                print(prefix + 'The transform could not be applied. {!s:}'.format(error))
+                first_error = first_error or error
+    if first_error is not None:
+        raise first_error
 
 
 def lookup_email(args):
@@ -137,6 +217,7 @@ def lookup_email(args):
 
 def lookup_url(args):
     """Perform a Cache.get_url as specified by the given arguments."""
+    from requests.status_codes import _codes as url_statuses
     db = cache.get_default()
     if args.forced:
         db.lookup_webpage(args.url)
@@ -155,12 +236,123 @@ def mark_email(args):
 
 def mark_url(args):
     """Perform a Cache.set_url as specified by the given arguments."""
+    from requests.status_codes import _codes as url_statuses
     cache.get_default().set_webpage(args.url, args.status)
     print('{!r:} marked with {:s}.'.format(args.url, url_statuses[args.status][0]))
 
 
+def _warm(db_get, db_lookup, keys, jobs):
+    """Look up the keys that are not fresh in the cache and count the fresh, refreshed and failed ones."""
+    entries = db_get(keys)
+    pending = list(entries['stale']) + entries['missing']
+    failures = db_lookup(pending, concurrency=jobs, strict=False)
+    return len(entries['fresh']), len(pending) - len(failures), len(failures)
+
+
+def warm_cache(args):
+    """Refresh the cache with every url, address and image referenced by the given files."""
+    import document
+    start = time.monotonic()
+    urls = []
+    addresses = []
+    images = []
+    for path in args.files:
+        references = document.Document(get_code(path), parser=args.parser).references()
+        urls += references['urls']
+        addresses += references['addresses']
+        images += references['images']
+
+    db = cache.get_default()
+    with db.batch():
+        webpages = _warm(db.get_webpages, db.lookup_webpages, urls, args.jobs)
+        emails = _warm(db.get_emails, db.lookup_emails, addresses, args.jobs)
+        images = _warm(db.get_images, db.lookup_images, images, args.jobs)
+
+    print(
+        'Webpages: {:d} fresh, {:d} refreshed, {:d} failed.'.format(*webpages),
+        'Emails: {:d} fresh, {:d} refreshed, {:d} failed.'.format(*emails),
+        'Images: {:d} fresh, {:d} refreshed, {:d} failed.'.format(*images),
+        'Cache warmed in {:.1f} seconds.'.format(time.monotonic() - start),
+        sep='\n'
+    )
+
+
+def collect_garbage(args):
+    """Perform a Cache.collect_garbage as specified by the given arguments."""
+    summary = cache.get_default().collect_garbage(older_than=args.older_than, max_rows=args.max_rows)
+    print(
+        '{:d} expired entries deleted.'.format(summary['expired']),
+        '{:d} least recently used entries evicted.'.format(summary['evicted']),
+        '{:d} bytes reclaimed.'.format(summary['reclaimed']),
+        sep='\n'
+    )
+
+
+def export_cache(args):
+    """Perform a Cache.export_entries as specified by the given arguments."""
+    with open(args.file, 'w', encoding='UTF-8') as export_file:
+        count = cache.get_default().export_entries(export_file)
+    print('{:d} entries exported to {!r:}.'.format(count, args.file))
+
+
+def import_cache(args):
+    """Perform a Cache.import_entries for each of the files specified by the given arguments."""
+    db = cache.get_default()
+    for path in args.files:
+        try:
+            with open(path, 'r', encoding='UTF-8') as import_file:
+                summary = db.import_entries(import_file, merge=args.merge)
+        except exceptions.MalformedEntryException as error:
+            exit('{!r:} was not imported. {!s:}'.format(path, error))
+        print('{:d} of {:d} entries imported from {!r:}.'.format(summary['stored'], summary['read'], path))
+
+
+def serve_cache(args):
+    """Serve the cache on a socket until interrupted."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+    print('Serving the cache on {!r:}. Press Ctrl-C to stop.'.format(service.SOCKET_PATH))
+    try:
+        service.serve()
+    except exceptions.ServiceException as error:
+        exit(str(error))
+    except KeyboardInterrupt:
+        print('Stopped serving the cache.')
+
+
+def _print_latency(title, latencies):
+    """Print the number, total time and latency buckets of the lookups made for each host or status class."""
+    print(title)
+    for name, latency in sorted(latencies.items()):
+        buckets = ', '.join('{:s}: {:d}'.format(b, latency['buckets'][b])
+                            for b in sorted(latency['buckets'], key=lambda x: (x[0] == '>', float(x.strip('<=>s')))))
+        print('    {:s}: {:d} in {:.2f} seconds ({:s})'.format(name, latency['count'], latency['seconds'], buckets))
+
+
+def print_stats(args):
+    """Perform a Cache.get_stats as specified by the given arguments."""
+    db = cache.get_default()
+    if args.reset:
+        db.reset_stats()
+    stats = db.get_stats()
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return
+
+    print('Database: {:d} bytes.'.format(stats['size']))
+    for table, info in stats['tables'].items():
+        print('{:s}: {:d} entries, {:d} stale.'.format(table.capitalize(), info['rows'], info['stale']))
+        for days, count in info['ages'].items():
+            print('    {:d} looked up within {!s:} days.'.format(count, days))
+    for table, reads in sorted(stats['reads'].items()):
+        print('Reads of {:s}: {:d} fresh hits, {:d} stale hits, {:d} misses, {:d} forced lookups.'.format(
+            table, reads.get('fresh', 0), reads.get('stale', 0), reads.get('miss', 0), reads.get('forced', 0)))
+    _print_latency('Lookups by host:', stats['hosts'])
+    _print_latency('Lookups by status:', stats['statuses'])
+
+
 def save_snapshot(args):
     """Save a snapshot of the current document state."""
+    import document
     html_doc = document.Document(get_code(args.file))
     info = html_doc.save(args.message, date=args.edition, region=args.region)
     if info is None:
@@ -172,6 +364,7 @@ def save_snapshot(args):
 
 def load_snapshot(args):
     """Revert the document code to the state described by the selected snapshot."""
+    import document
     html_doc = document.Document(get_code(args.file))
     snapshot = html_doc.load(args.index, date=args.edition, region=args.region)
     set_code(args.file, html_doc)
@@ -180,6 +373,7 @@ def load_snapshot(args):
 
 def list_snapshots(args):
     """Print a list of all available snapshots along with their indexes."""
+    import document
     html_doc = document.Document(get_code(args.file))
     edition, region, snapshots = html_doc.list(date=args.edition, region=args.region)
     print('Snapshots for {:s} {:%B %d, %Y}'.format(region.capitalize(), edition))
@@ -187,30 +381,36 @@ def list_snapshots(args):
         print('({:2d}) {!r:} -'.format(i, snapshots[i][1]) +
               ' {0:%B} {0.day:2}, {0:%Y %l:%M:%S.%f %p}'.format(snapshots[i][0]))
 
-def main(args=None):
-    """Run the program with the given args or from the cmd args."""
-    # Define base parser
-    base = argparse.ArgumentParser(prog=PROG_NAME,
-                                   description=version.__description__,
-                                   formatter_class=argparse.RawTextHelpFormatter,
-                                   usage='%(prog)s <action>', add_help=False)
-    base.set_defaults(func=lambda x: base.print_help())
-    base_childs = base.add_subparsers(title='actions',
-                                      help='{:6s}\t{:s}\n'.format(REVIEW_ACT, REVIEW_DESC) +
-                                           '{:6s}\t{:s}\n'.format(REPAIR_ACT, REPAIR_DESC) +
-                                           '{:6s}\t{:s}\n'.format(LOOKUP_ACT, LOOKUP_DESC) +
-                                           '{:6s}\t{:s}\n'.format(MARK_ACT, MARK_DESC) +
-                                           '{:6s}\t{:s}\n'.format(APPLY_ACT, APPLY_DESC) +
-                                           '{:6s}\t{:s}\n'.format(SNAPSHOT_ACT, 'Manage Snapshots') +
-                                           '{:6s}\t{:s}\n'.format(HELP_ACT, HELP_DESC) +
-                                           '{:6s}\t{:s}'.format(VERSION_ACT, VERSION_DESC))
 
-    # Define review parser
-    review_cmd = base_childs.add_parser(REVIEW_ACT, prog='{:s} {:s}'.format(PROG_NAME, REVIEW_ACT),
-                                        description=REVIEW_DESC, add_help=False,
-                                        usage='%(prog)s <file>\n       '
-                                              '%(prog)s -p|--pasteboard')
+def _add_parser_flag(group):
+    """Add the option that selects the backend used to parse the HTML code to the group."""
+    group.add_argument('--parser', action='store', type=str, metavar='NAME',
+                       help='The parser to read the HTML code with: html5lib, lxml or html.parser. '
+                            'Defaults to $IITECH3_PARSER or html5lib.')
+
+
+def _add_region_flags(parser):
+    """Add the mutually exclusive flags that select the region of a snapshot to the parser."""
+    region_mex = parser.add_mutually_exclusive_group()
+    for flag, region in (('-ne', 'northeastern'), ('-se', 'southeastern'), ('-fl', 'florida'),
+                         ('-mw', 'midwestern'), ('-c', 'central'), ('-sw', 'southwestern'), ('-w', 'western')):
+        region_mex.add_argument(flag, '--' + region, dest='region', action='store_const', const=region)
+
+
+def _add_review_parser(childs):
+    """Add the parser of the review action to the childs and return it."""
+    review_cmd = childs.add_parser(REVIEW_ACT, prog='{:s} {:s}'.format(PROG_NAME, REVIEW_ACT),
+                                   description=REVIEW_DESC, add_help=False,
+                                   usage='%(prog)s [-j|--jobs N] [-s|--stale] [--parser NAME] <file>\n       '
+                                         '%(prog)s [-j|--jobs N] [-s|--stale] [--parser NAME] -p|--pasteboard')
     review_cmd.set_defaults(func=review)
+    review_mode_grp = review_cmd.add_argument_group(title='modifiers')
+    review_mode_grp.add_argument('-j', '--jobs', action='store', type=int, metavar='N',
+                                 help='The number of links and emails to verify at the same time.')
+    review_mode_grp.add_argument('-s', '--stale', action='store_true',
+                                 help='Use outdated statuses from the cache right away '
+                                      'and refresh them in the background.')
+    _add_parser_flag(review_mode_grp)
     review_target_grp = review_cmd.add_argument_group(title='targets')
     review_target_mex = review_target_grp.add_mutually_exclusive_group(required=True)
     review_target_mex.add_argument('file', action='store', type=str, nargs='?',
@@ -218,13 +418,18 @@ def main(args=None):
     review_target_mex.add_argument('-p', '--pasteboard', action='store_const',
                                    dest='file', const=None,
                                    help='Specifies that the HTML code to review is on the pasteboard.')
+    return review_cmd
+
 
-    # Define repair parser
-    repair_cmd = base_childs.add_parser(REPAIR_ACT, prog=' '.join([PROG_NAME, REPAIR_ACT]),
-                                        description=REPAIR_DESC, add_help=False,
-                                        usage='%(prog)s <file>\n       '
-                                              '%(prog)s -p|--pasteboard')
+def _add_repair_parser(childs):
+    """Add the parser of the repair action to the childs and return it."""
+    repair_cmd = childs.add_parser(REPAIR_ACT, prog=' '.join([PROG_NAME, REPAIR_ACT]),
+                                   description=REPAIR_DESC, add_help=False,
+                                   usage='%(prog)s [--parser NAME] <file>\n       '
+                                         '%(prog)s [--parser NAME] -p|--pasteboard')
     repair_cmd.set_defaults(func=repair)
+    repair_mode_grp = repair_cmd.add_argument_group(title='modifiers')
+    _add_parser_flag(repair_mode_grp)
     repair_target_grp = repair_cmd.add_argument_group(title='targets')
     repair_target_mex = repair_target_grp.add_mutually_exclusive_group(required=True)
     repair_target_mex.add_argument('file', action='store', type=str, nargs='?',
@@ -232,13 +437,16 @@ def main(args=None):
     repair_target_mex.add_argument('-p', '--pasteboard', action='store_const',
                                    dest='file', const=None,
                                    help='Specifies that the HTML code to repair is on the pasteboard.')
+    return repair_cmd
 
-    # Define lookup parser
-    lookup_cmd = base_childs.add_parser(LOOKUP_ACT, prog='{:s} {:s}'.format(PROG_NAME, LOOKUP_ACT),
-                                        description=LOOKUP_DESC, add_help=False,
-                                        formatter_class=argparse.RawTextHelpFormatter,
-                                        usage='%(prog)s {:s} [OPTIONS]\n       '.format(EMAIL_TYPE) +
-                                              '%(prog)s {:s} [OPTIONS]'.format(WEBPAGE_TYPE))
+
+def _add_lookup_parser(childs):
+    """Add the parser of the lookup action to the childs and return it."""
+    lookup_cmd = childs.add_parser(LOOKUP_ACT, prog='{:s} {:s}'.format(PROG_NAME, LOOKUP_ACT),
+                                   description=LOOKUP_DESC, add_help=False,
+                                   formatter_class=argparse.RawTextHelpFormatter,
+                                   usage='%(prog)s {:s} [OPTIONS]\n       '.format(EMAIL_TYPE) +
+                                         '%(prog)s {:s} [OPTIONS]'.format(WEBPAGE_TYPE))
     lookup_cmd.set_defaults(func=lambda x: lookup_cmd.print_help())
     lookup_childs = lookup_cmd.add_subparsers(title='types',
                                               help='{:7s}\t{:s}\n'.format(EMAIL_TYPE, LOOKUP_EMAIL_DESC) +
@@ -277,13 +485,16 @@ def main(args=None):
     lookup_url_gen_grp = lookup_url_cmd.add_argument_group(title='arguments')
     lookup_url_gen_grp.add_argument('url', action='store', type=str,
                                     help='The url to lookup.')
+    return lookup_cmd
+
 
-    # Define mark parser
-    mark_cmd = base_childs.add_parser(MARK_ACT, prog='{:s} {:s}'.format(PROG_NAME, MARK_ACT),
-                                      formatter_class=argparse.RawTextHelpFormatter,
-                                      description=MARK_DESC, add_help=False,
-                                      usage='%(prog)s {:s} [OPTIONS]\n       '.format(EMAIL_TYPE) +
-                                            '%(prog)s {:s} [OPTIONS]'.format(WEBPAGE_TYPE))
+def _add_mark_parser(childs):
+    """Add the parser of the mark action to the childs and return it."""
+    mark_cmd = childs.add_parser(MARK_ACT, prog='{:s} {:s}'.format(PROG_NAME, MARK_ACT),
+                                 formatter_class=argparse.RawTextHelpFormatter,
+                                 description=MARK_DESC, add_help=False,
+                                 usage='%(prog)s {:s} [OPTIONS]\n       '.format(EMAIL_TYPE) +
+                                       '%(prog)s {:s} [OPTIONS]'.format(WEBPAGE_TYPE))
     mark_cmd.set_defaults(func=lambda x: mark_cmd.print_help())
     mark_childs = mark_cmd.add_subparsers(title='types',
                                           help='{:7s}\t{:s}\n'.format(EMAIL_TYPE, MARK_EMAIL_DESC) +
@@ -329,27 +540,119 @@ def main(args=None):
                                      dest='status', help='Mark the url as a teapot (status: 418).')
     mark_url_gen_grp = mark_url_cmd.add_argument_group(title='arguments')
     mark_url_gen_grp.add_argument('url', action='store', type=str, help='The url to mark.')
+    return mark_cmd
 
-    # Define apply parser
-    apply_cmd = base_childs.add_parser(APPLY_ACT, prog='{:s} {:s}'.format(PROG_NAME, APPLY_ACT),
-                                       description=APPLY_DESC,
-                                       usage='%(prog)s <transform_file> <target>', add_help=False)
+
+def _add_apply_parser(childs):
+    """Add the parser of the apply action to the childs and return it."""
+    apply_cmd = childs.add_parser(APPLY_ACT, prog='{:s} {:s}'.format(PROG_NAME, APPLY_ACT),
+                                  description=APPLY_DESC,
+                                  usage='%(prog)s [--parser NAME] [-j N] [-w N] <transform_file> '
+                                        '<target> [<target> ...]',
+                                  add_help=False)
     apply_cmd._optionals.title = 'options'
     apply_cmd.set_defaults(func=apply)
+    _add_parser_flag(apply_cmd)
+    apply_cmd.add_argument('-j', '--jobs', action='store', type=int, metavar='N',
+                           help='The number of images to measure at the same time, Document.IMAGE_JOBS by default.')
+    apply_cmd.add_argument('-w', '--workers', action='store', type=int, metavar='N',
+                           help='The number of templates to transform at the same time, one per core by default.')
     apply_cmd.add_argument('transform_file', action='store', type=str,
                            help='The yaml file that describes the transform to apply.')
     apply_target_grp = apply_cmd.add_argument_group(title='targets')
     apply_target_mex = apply_target_grp.add_mutually_exclusive_group(required=True)
-    apply_target_mex.add_argument('file', action='store', type=str, nargs='?',
-                                  help='The file that contains the HTML code to transform.')
+    apply_target_mex.add_argument('files', action='store', type=str, nargs='*', metavar='file', default=[],
+                                  help='The files that contain the HTML code to transform.')
     apply_target_mex.add_argument('-p', '--pasteboard', action='store_const',
-                                  dest='file', const=None,
+                                  dest='files', const=[None],
                                   help='Specifies that the HTML code to transform is on the pasteboard.')
-
-    # Define snapshot parser
-    snapshot_cmd = base_childs.add_parser(SNAPSHOT_ACT, prog=' '.join((PROG_NAME, SNAPSHOT_ACT)),
-                                          usage='%(prog)s {:s} [OPTIONS]\n       '.format(SAVE_CMD) +
-                                                '%(prog)s {:s} [OPTIONS]'.format(LOAD_CMD), add_help=False)
+    return apply_cmd
+
+
+def _add_cache_parser(childs):
+    """Add the parser of the cache action to the childs and return it."""
+    cache_cmd = childs.add_parser(CACHE_ACT, prog=' '.join((PROG_NAME, CACHE_ACT)),
+                                  formatter_class=argparse.RawTextHelpFormatter,
+                                  description=CACHE_DESC, add_help=False,
+                                  usage='%(prog)s {:s} [OPTIONS]\n       '.format(WARM_CMD) +
+                                        '%(prog)s {:s} [OPTIONS]\n       '.format(GC_CMD) +
+                                        '%(prog)s {:s} <file>\n       '.format(EXPORT_CMD) +
+                                        '%(prog)s {:s} [OPTIONS]\n       '.format(IMPORT_CMD) +
+                                        '%(prog)s {:s}\n       '.format(SERVE_CMD) +
+                                        '%(prog)s {:s} [OPTIONS]'.format(STATS_CMD))
+    cache_cmd.set_defaults(func=lambda x: cache_cmd.print_help())
+    cache_childs = cache_cmd.add_subparsers(title='subcommands',
+                                            help='{:6s}\t{:s}\n'.format(WARM_CMD, WARM_DESC) +
+                                                 '{:6s}\t{:s}\n'.format(GC_CMD, GC_DESC) +
+                                                 '{:6s}\t{:s}\n'.format(EXPORT_CMD, EXPORT_DESC) +
+                                                 '{:6s}\t{:s}\n'.format(IMPORT_CMD, IMPORT_DESC) +
+                                                 '{:6s}\t{:s}\n'.format(SERVE_CMD, SERVE_DESC) +
+                                                 '{:6s}\t{:s}'.format(STATS_CMD, STATS_DESC))
+
+    cache_warm_cmd = cache_childs.add_parser(WARM_CMD, prog=' '.join((PROG_NAME, CACHE_ACT, WARM_CMD)),
+                                             description=WARM_DESC, add_help=False,
+                                             usage='%(prog)s [-j|--jobs N] [--parser NAME] <file> [<file> ...]')
+    cache_warm_cmd.set_defaults(func=warm_cache)
+    cache_warm_mode_grp = cache_warm_cmd.add_argument_group(title='modifiers')
+    cache_warm_mode_grp.add_argument('-j', '--jobs', action='store', type=int, metavar='N',
+                                     default=cache.LOOKUP_CONCURRENCY,
+                                     help='The number of links, emails and images to look up at the same time.')
+    _add_parser_flag(cache_warm_mode_grp)
+    cache_warm_target_grp = cache_warm_cmd.add_argument_group(title='targets')
+    cache_warm_target_grp.add_argument('files', action='store', type=str, nargs='+', metavar='file',
+                                       help='A file that contains the HTML code to read the references from.')
+
+    cache_gc_cmd = cache_childs.add_parser(GC_CMD, prog=' '.join((PROG_NAME, CACHE_ACT, GC_CMD)),
+                                           description=GC_DESC, add_help=False,
+                                           usage='%(prog)s [-o|--older-than DAYS] [-n|--max-rows N]')
+    cache_gc_cmd.set_defaults(func=collect_garbage)
+    cache_gc_mode_grp = cache_gc_cmd.add_argument_group(title='modifiers')
+    cache_gc_mode_grp.add_argument('-o', '--older-than', action='store', type=int, metavar='DAYS',
+                                   help='Delete the entries that were looked up at least DAYS days ago.')
+    cache_gc_mode_grp.add_argument('-n', '--max-rows', action='store', type=int, metavar='N',
+                                   help='Keep only the N most recently used webpages, emails and images (N of each).')
+
+    cache_export_cmd = cache_childs.add_parser(EXPORT_CMD, prog=' '.join((PROG_NAME, CACHE_ACT, EXPORT_CMD)),
+                                               description=EXPORT_DESC, add_help=False,
+                                               usage='%(prog)s <file>')
+    cache_export_cmd.set_defaults(func=export_cache)
+    cache_export_target_grp = cache_export_cmd.add_argument_group(title='targets')
+    cache_export_target_grp.add_argument('file', action='store', type=str,
+                                         help='The file to write the entries to.')
+
+    cache_import_cmd = cache_childs.add_parser(IMPORT_CMD, prog=' '.join((PROG_NAME, CACHE_ACT, IMPORT_CMD)),
+                                               description=IMPORT_DESC, add_help=False,
+                                               usage='%(prog)s [-m|--merge] <file> [<file> ...]')
+    cache_import_cmd.set_defaults(func=import_cache)
+    cache_import_mode_grp = cache_import_cmd.add_argument_group(title='modifiers')
+    cache_import_mode_grp.add_argument('-m', '--merge', action='store_true',
+                                       help='Keep the entry that was looked up last instead of the imported one.')
+    cache_import_target_grp = cache_import_cmd.add_argument_group(title='targets')
+    cache_import_target_grp.add_argument('files', action='store', type=str, nargs='+', metavar='file',
+                                         help='A file written by export to read the entries from.')
+
+    cache_serve_cmd = cache_childs.add_parser(SERVE_CMD, prog=' '.join((PROG_NAME, CACHE_ACT, SERVE_CMD)),
+                                              description=SERVE_DESC, add_help=False,
+                                              usage='%(prog)s')
+    cache_serve_cmd.set_defaults(func=serve_cache)
+
+    cache_stats_cmd = cache_childs.add_parser(STATS_CMD, prog=' '.join((PROG_NAME, CACHE_ACT, STATS_CMD)),
+                                              description=STATS_DESC, add_help=False,
+                                              usage='%(prog)s [-r|--reset] [--json]')
+    cache_stats_cmd.set_defaults(func=print_stats)
+    cache_stats_mode_grp = cache_stats_cmd.add_argument_group(title='modifiers')
+    cache_stats_mode_grp.add_argument('-r', '--reset', action='store_true',
+                                      help='Forget the counters of the previous runs before printing.')
+    cache_stats_mode_grp.add_argument('--json', action='store_true',
+                                      help='Print the statistics as JSON.')
+    return cache_cmd
+
+
+def _add_snapshot_parser(childs):
+    """Add the parser of the snapshot action to the childs and return it."""
+    snapshot_cmd = childs.add_parser(SNAPSHOT_ACT, prog=' '.join((PROG_NAME, SNAPSHOT_ACT)),
+                                     usage='%(prog)s {:s} [OPTIONS]\n       '.format(SAVE_CMD) +
+                                           '%(prog)s {:s} [OPTIONS]'.format(LOAD_CMD), add_help=False)
     snapshot_cmd.set_defaults(func=lambda x: snapshot_cmd.print_help())
     snapshot_childs = snapshot_cmd.add_subparsers(title='subcommands')
 
@@ -358,21 +661,7 @@ def main(args=None):
     snapshot_save_cmd.set_defaults(func=save_snapshot)
     snapshot_save_cmd.add_argument('message')
     snapshot_save_cmd.add_argument('-e', '--edition', type=mkdate, metavar='DATE')
-    snapshot_save_region_mex = snapshot_save_cmd.add_mutually_exclusive_group()
-    snapshot_save_region_mex.add_argument('-ne', '--northeastern', dest='region', action='store_const',
-                                          const='northeastern')
-    snapshot_save_region_mex.add_argument('-se', '--southeastern', dest='region', action='store_const',
-                                          const='southeastern')
-    snapshot_save_region_mex.add_argument('-fl', '--florida', dest='region', action='store_const',
-                                          const='florida')
-    snapshot_save_region_mex.add_argument('-mw', '--midwestern', dest='region', action='store_const',
-                                          const='midwestern')
-    snapshot_save_region_mex.add_argument('-c', '--central', dest='region', action='store_const',
-                                          const='central')
-    snapshot_save_region_mex.add_argument('-sw', '--southwestern', dest='region', action='store_const',
-                                          const='southwestern')
-    snapshot_save_region_mex.add_argument('-w', '--western', dest='region', action='store_const',
-                                          const='western')
+    _add_region_flags(snapshot_save_cmd)
     snapshot_save_target_grp = snapshot_save_cmd.add_argument_group(title='targets')
     snapshot_save_target_mex = snapshot_save_target_grp.add_mutually_exclusive_group(required=True)
     snapshot_save_target_mex.add_argument('file', nargs='?')
@@ -384,21 +673,7 @@ def main(args=None):
     snapshot_load_cmd.set_defaults(func=load_snapshot)
     snapshot_load_cmd.add_argument('index', type=int)
     snapshot_load_cmd.add_argument('-e', '--edition', type=mkdate, metavar='DATE')
-    snapshot_load_region_mex = snapshot_load_cmd.add_mutually_exclusive_group()
-    snapshot_load_region_mex.add_argument('-ne', '--northeastern', dest='region', action='store_const',
-                                          const='northeastern')
-    snapshot_load_region_mex.add_argument('-se', '--southeastern', dest='region', action='store_const',
-                                          const='southeastern')
-    snapshot_load_region_mex.add_argument('-fl', '--florida', dest='region', action='store_const',
-                                          const='florida')
-    snapshot_load_region_mex.add_argument('-mw', '--midwestern', dest='region', action='store_const',
-                                          const='midwestern')
-    snapshot_load_region_mex.add_argument('-c', '--central', dest='region', action='store_const',
-                                          const='central')
-    snapshot_load_region_mex.add_argument('-sw', '--southwestern', dest='region', action='store_const',
-                                          const='southwestern')
-    snapshot_load_region_mex.add_argument('-w', '--western', dest='region', action='store_const',
-                                          const='western')
+    _add_region_flags(snapshot_load_cmd)
     snapshot_load_target_grp = snapshot_load_cmd.add_argument_group(title='targets')
     snapshot_load_target_mex = snapshot_load_target_grp.add_mutually_exclusive_group(required=True)
     snapshot_load_target_mex.add_argument('file', nargs='?')
@@ -409,52 +684,84 @@ def main(args=None):
                                                                             LIST_CMD)))
     snapshot_list_cmd.set_defaults(func=list_snapshots)
     snapshot_list_cmd.add_argument('-e', '--edition', type=mkdate, metavar='DATE')
-    snapshot_list_region_mex = snapshot_list_cmd.add_mutually_exclusive_group()
-    snapshot_list_region_mex.add_argument('-ne', '--northeastern', dest='region', action='store_const',
-                                          const='northeastern')
-    snapshot_list_region_mex.add_argument('-se', '--southeastern', dest='region', action='store_const',
-                                          const='southeastern')
-    snapshot_list_region_mex.add_argument('-fl', '--florida', dest='region', action='store_const',
-                                          const='florida')
-    snapshot_list_region_mex.add_argument('-mw', '--midwestern', dest='region', action='store_const',
-                                          const='midwestern')
-    snapshot_list_region_mex.add_argument('-c', '--central', dest='region', action='store_const',
-                                          const='central')
-    snapshot_list_region_mex.add_argument('-sw', '--southwestern', dest='region', action='store_const',
-                                          const='southwestern')
-    snapshot_list_region_mex.add_argument('-w', '--western', dest='region', action='store_const',
-                                          const='western')
+    _add_region_flags(snapshot_list_cmd)
     snapshot_list_target_grp = snapshot_list_cmd.add_argument_group(title='targets')
     snapshot_list_target_mex = snapshot_list_target_grp.add_mutually_exclusive_group(required=True)
     snapshot_list_target_mex.add_argument('file', nargs='?')
     snapshot_list_target_mex.add_argument('-p', '--pasteboard', action='store_const',
                                           dest='file', const=None,)
+    return snapshot_cmd
+
 
-    # Define version command
-    version_cmd = base_childs.add_parser(VERSION_ACT, prog=' '.join((PROG_NAME, VERSION_ACT)),
-                                         description=VERSION_DESC,
-                                         usage='%(prog)s', add_help=False)
+def _add_version_parser(childs):
+    """Add the parser of the version action to the childs and return it."""
+    version_cmd = childs.add_parser(VERSION_ACT, prog=' '.join((PROG_NAME, VERSION_ACT)),
+                                    description=VERSION_DESC,
+                                    usage='%(prog)s', add_help=False)
     version_cmd.set_defaults(func=lambda x: print(' '.join((PROG_NAME, version.__version__))))
+    return version_cmd
 
-    # Define help command
-    help_cmd = base_childs.add_parser(HELP_ACT, prog=' '.join((PROG_NAME, HELP_ACT)),
-                                      description=HELP_DESC, usage='%(prog)s <action>',  add_help=False)
+
+def _add_help_parser(childs):
+    """Add the parser of the help action to the childs and return it."""
+    help_cmd = childs.add_parser(HELP_ACT, prog=' '.join((PROG_NAME, HELP_ACT)),
+                                 description=HELP_DESC, usage='%(prog)s <action>',  add_help=False)
     help_childs = help_cmd.add_subparsers(title='actions')
-    help_review = help_childs.add_parser(REVIEW_ACT, prog=' '.join((PROG_NAME, HELP_ACT, REVIEW_ACT)),
-                                         usage='%(prog)s', add_help=False)
-    help_review.set_defaults(func=lambda x: review_cmd.print_help())
-    help_repair = help_childs.add_parser(REPAIR_ACT, prog=' '.join((PROG_NAME, HELP_ACT, REPAIR_ACT)),
-                                         usage='%(prog)s', add_help=False)
-    help_repair.set_defaults(func=lambda x: repair_cmd.print_help())
-    help_lookup = help_childs.add_parser(LOOKUP_ACT, prog=' '.join((PROG_NAME, HELP_ACT, LOOKUP_ACT)),
-                                         usage='%(prog)s', add_help=False)
-    help_lookup.set_defaults(func=lambda x: lookup_cmd.print_help())
-    help_mark = help_childs.add_parser(MARK_ACT, prog=' '.join((PROG_NAME, HELP_ACT, MARK_ACT)),
-                                       usage='%(prog)s', add_help=False)
-    help_mark.set_defaults(func=lambda x: mark_cmd.print_help())
-    help_apply = help_childs.add_parser(APPLY_ACT, prog=' '.join((PROG_NAME, HELP_ACT, APPLY_ACT)),
-                                        usage='%(prog)s', add_help=False)
-    help_apply.set_defaults(func=lambda x: apply_cmd.print_help())
+    for action in (REVIEW_ACT, REPAIR_ACT, LOOKUP_ACT, MARK_ACT, APPLY_ACT, CACHE_ACT):
+        help_action = help_childs.add_parser(action, prog=' '.join((PROG_NAME, HELP_ACT, action)),
+                                             usage='%(prog)s', add_help=False)
+        help_action.set_defaults(func=lambda x, action=action: print_help(action))
+    return help_cmd
+
+
+# The parser of each action, in the order they are listed in the help. Only the parser of the action
+# being run is built, as building them all takes longer than most of the actions themselves.
+ACTION_PARSERS = OrderedDict((
+    (REVIEW_ACT, _add_review_parser),
+    (REPAIR_ACT, _add_repair_parser),
+    (LOOKUP_ACT, _add_lookup_parser),
+    (MARK_ACT, _add_mark_parser),
+    (APPLY_ACT, _add_apply_parser),
+    (CACHE_ACT, _add_cache_parser),
+    (SNAPSHOT_ACT, _add_snapshot_parser),
+    (HELP_ACT, _add_help_parser),
+    (VERSION_ACT, _add_version_parser)
+))
+
+
+def print_help(action):
+    """Print the help message of the action."""
+    ACTION_PARSERS[action](argparse.ArgumentParser().add_subparsers()).print_help()
+
+
+def main(args=None):
+    """Run the program with the given args or from the cmd args."""
+    args = sys.argv[1:] if args is None else list(args)
+    requested = next((arg for arg in args if not arg.startswith('-')), None)
+
+    # Define base parser
+    base = argparse.ArgumentParser(prog=PROG_NAME,
+                                   description=version.__description__,
+                                   formatter_class=argparse.RawTextHelpFormatter,
+                                   usage='%(prog)s <action>', add_help=False)
+    base.set_defaults(func=lambda x: base.print_help())
+    base_childs = base.add_subparsers(title='actions',
+                                      help='{:6s}\t{:s}\n'.format(REVIEW_ACT, REVIEW_DESC) +
+                                           '{:6s}\t{:s}\n'.format(REPAIR_ACT, REPAIR_DESC) +
+                                           '{:6s}\t{:s}\n'.format(LOOKUP_ACT, LOOKUP_DESC) +
+                                           '{:6s}\t{:s}\n'.format(MARK_ACT, MARK_DESC) +
+                                           '{:6s}\t{:s}\n'.format(APPLY_ACT, APPLY_DESC) +
+                                           '{:6s}\t{:s}\n'.format(CACHE_ACT, CACHE_DESC) +
+                                           '{:6s}\t{:s}\n'.format(SNAPSHOT_ACT, 'Manage Snapshots') +
+                                           '{:6s}\t{:s}\n'.format(HELP_ACT, HELP_DESC) +
+                                           '{:6s}\t{:s}'.format(VERSION_ACT, VERSION_DESC))
+
+    # Define the parser of the requested action and placeholders for the others
+    for action, add_parser in ACTION_PARSERS.items():
+        if action == requested:
+            add_parser(base_childs)
+        else:
+            base_childs.add_parser(action, add_help=False)
 
     # Parse args
     definition = base.parse_args(args)
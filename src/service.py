@@ -0,0 +1,248 @@
+"""Classes and constants for sharing one cache between processes through a service on a Unix domain socket."""
+import os
+import json
+import socket
+import socketserver
+import threading
+import contextlib
+import datetime
+import exceptions
+import cache
+
+
+# Global variables to configure used by the class to allow for easy configuration
+SOCKET_PATH = '/Users/aisamji09/Projects/iitech3/data/cache.sock'  # Set by setup.py according to the OS in use.
+CONNECT_TIMEOUT = 0.5  # The number of seconds to wait for the service before using the database directly.
+SERVED_METHODS = (  # The methods of the Cache that clients may call through the service.
+    'get_webpage', 'set_webpage', 'lookup_webpage', 'get_webpages', 'lookup_webpages', 'refresh_webpages',
+    'find_webpages', 'get_email', 'set_email', 'lookup_email', 'get_emails', 'lookup_emails', 'refresh_emails',
+    'find_emails', 'get_image', 'lookup_image', 'get_images', 'lookup_images', 'wait_for_refreshes', 'clear_memos',
+    'collect_garbage', 'get_stats', 'get_run_stats', 'reset_stats', 'open_circuits'
+)
+
+
+# Helpers to translate between python objects and the JSON lines sent over the socket
+def _encode(value):
+    """Convert the objects that json cannot dump on its own."""
+    if isinstance(value, cache.InfoHolder):
+        fields = dict(vars(value))
+        fields['last_lookup'] = fields['last_lookup'].timestamp()
+        return {'__info__': fields}
+    if isinstance(value, BaseException):
+        return {'__error__': [type(value).__name__, [str(a) for a in value.args]]}
+    try:
+        return list(value)  # sets, dict views and other iterables
+    except TypeError:
+        raise TypeError('{!r:} cannot be sent to the cache service.'.format(value))
+
+
+def _make_error(name, args):
+    """Recreate an exception of this program from its name and args, or a ServiceException for any other."""
+    error_class = getattr(exceptions, name, None)
+    if not (isinstance(error_class, type) and issubclass(error_class, exceptions.IITech3Exception)):
+        return exceptions.ServiceException('{:s}: {:s}'.format(name, ', '.join(args)))
+    error = error_class.__new__(error_class)
+    Exception.__init__(error, *args)
+    return error
+
+
+def _decode(obj):
+    """Convert the objects encoded by _encode back into python objects."""
+    if '__info__' in obj:
+        fields = obj['__info__']
+        fields['last_lookup'] = datetime.datetime.fromtimestamp(fields['last_lookup'])
+        return cache.InfoHolder(**fields)
+    if '__error__' in obj:
+        return _make_error(*obj['__error__'])
+    return obj
+
+
+def _dumps(value):
+    """Convert a request or a response into a line of bytes."""
+    return json.dumps(value, default=_encode).encode('utf-8') + b'\n'
+
+
+def _loads(line):
+    """Convert a line of bytes into a request or a response."""
+    return json.loads(line.decode('utf-8'), object_hook=_decode)
+
+
+# Service side
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answers the requests of one client, one line each, until it disconnects."""
+
+    def handle(self):
+        """Answer every request line with a response line."""
+        for line in self.rfile:
+            self.wfile.write(self.server.answer(line))
+            self.wfile.flush()
+
+
+class CacheServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A server that lets the clients connected to its socket call the SERVED_METHODS of one cache.
+
+    Each request is a JSON object with the 'method' to call and its 'args' and 'kwargs'. Each response
+    is a JSON object with either the 'result' of the call or the 'error' it raised. The calls are not
+    batched, so the lookups of one client never hold back the writes of the others. Only the user that
+    runs the server may connect to its socket.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, db):
+        """Create a server for the cache db that listens on the socket at path."""
+        self.cache = db
+        super().__init__(str(path), _RequestHandler)
+
+    def server_bind(self):
+        """Create the socket and make it private to the user that runs the server."""
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+    def answer(self, line):
+        """Call the method of the cache described by the request line and get the response line."""
+        try:
+            request = _loads(line)
+            method = request['method']
+            if method not in SERVED_METHODS:
+                raise exceptions.ServiceException('{!r:} is not served.'.format(method))
+            response = {'result': getattr(self.cache, method)(*request.get('args', []), **request.get('kwargs', {}))}
+        except Exception as error:
+            response = {'error': error}
+        return _dumps(response)
+
+
+def serve(path=None, db=None):
+    """Serve the cache db (the local default cache if None) on the socket at path (SOCKET_PATH if None).
+
+    Block until interrupted, then remove the socket. Raise a ServiceException if a service is
+    already running on the socket.
+    """
+    path = SOCKET_PATH if path is None else str(path)
+    if is_running(path):
+        raise exceptions.ServiceException('The cache service is already running on {!r:}.'.format(path))
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)  # left behind by a service that did not stop cleanly
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    server = CacheServer(path, cache.get_local() if db is None else db)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+# Client side
+def is_running(path=None):
+    """Determine whether a service is listening on the socket at path (SOCKET_PATH if None)."""
+    client = connect(path)
+    if client is None:
+        return False
+    client.close()
+    return True
+
+
+def connect(path=None):
+    """Get a RemoteCache that uses the service on the socket at path (SOCKET_PATH if None).
+
+    Return None if no service is running there.
+    """
+    path = SOCKET_PATH if path is None else str(path)
+    if not os.path.exists(path):
+        return None
+    try:
+        return RemoteCache(path, stale_while_revalidate=cache.STALE_WHILE_REVALIDATE)
+    except OSError:
+        return None
+
+
+class RemoteCache:
+    """An object that provides the methods of a Cache by calling them on the cache service.
+
+    Only the stale_while_revalidate mode of the service itself applies to get_webpage and get_email.
+    Exports and imports go straight to the database, as the files they use are only known to the client.
+    """
+
+    def __init__(self, path, *, db_path=None, stale_while_revalidate=False):
+        """Connect to the service on the socket at path, for the database at db_path (DB_PATH if None).
+
+        Raise an OSError if the service cannot be reached within CONNECT_TIMEOUT seconds.
+        """
+        self.stale_while_revalidate = bool(stale_while_revalidate)
+        self._db_path = cache.DB_PATH if db_path is None else str(db_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.settimeout(CONNECT_TIMEOUT)
+            self._socket.connect(str(path))
+            self._socket.settimeout(None)
+        except OSError:
+            self._socket.close()
+            raise
+        self._stream = self._socket.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args, **kwargs):
+        """Call the method of the cache on the service and return its result or raise its error."""
+        request = _dumps({'method': method, 'args': args, 'kwargs': kwargs})
+        with self._lock:
+            self._stream.write(request)
+            self._stream.flush()
+            line = self._stream.readline()
+        if not line:
+            raise exceptions.ServiceException('The cache service closed the connection.')
+        response = _loads(line)
+        if 'error' in response:
+            raise response['error']
+        return response['result']
+
+    def close(self):
+        """Disconnect from the service."""
+        with self._lock:
+            self._stream.close()
+            self._socket.close()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Do nothing, as the service commits the writes of each call on its own."""
+        yield self
+
+    def dump_stats(self, path):
+        """Write the counters of the run of the service and the statistics kept in the database to a JSON file.
+
+        The lookups are made by the service, so the run is the one of the service, shared by every client
+        since it started.
+        """
+        with open(path, 'w', encoding='UTF-8') as stats_file:
+            json.dump({'run': self.get_run_stats(), 'database': self.get_stats()}, stats_file, indent=2)
+
+    def export_entries(self, stream):
+        """Call Cache.export_entries on a connection of this process to the database."""
+        db = cache.Cache(self._db_path)
+        try:
+            return db.export_entries(stream)
+        finally:
+            db.close()
+
+    def import_entries(self, lines, *, merge=False):
+        """Call Cache.import_entries on a connection of this process and make the service read the results."""
+        db = cache.Cache(self._db_path)
+        try:
+            result = db.import_entries(lines, merge=merge)
+        finally:
+            db.close()
+        self.clear_memos()
+        return result
+
+
+def _make_remote_method(name):
+    """Create a method of the RemoteCache that calls the method of the Cache with the same name."""
+    def call(self, *args, **kwargs):
+        return self._call(name, *args, **kwargs)
+    call.__name__ = name
+    call.__doc__ = 'Call Cache.{:s} on the cache service.'.format(name)
+    return call
+
+
+for _name in SERVED_METHODS:
+    setattr(RemoteCache, _name, _make_remote_method(_name))
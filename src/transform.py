@@ -0,0 +1,248 @@
+"""Classes and functions for compiling the transforms applied to a document into reusable plans."""
+import copy
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import exceptions
+
+
+# Global variables to configure used by the functions to allow for easy configuration
+PLAN_DIR = 'data/plans'  # Set by setup.py according to the OS in use.
+MAX_PLANS = 32  # The number of plans kept in PLAN_DIR, beyond which the least recently used are deleted.
+DESCRIPTORS = OrderedDict((  # The keys that identify each kind of content descriptor, in order of precedence.
+    ('hyperlink', ('link', 'file', 'email')),
+    ('image', ('image',)),
+    ('formatted', ('bold', 'italics', 'underline')),
+    ('navigation', ('jump', 'anchor')),
+    ('list', ('numbers', 'bullets'))
+))
+OPTIONS = {  # The keys that a kind of content descriptor accepts besides the one that identifies it.
+    'hyperlink': ('text',),
+    'image': ('caption',),
+    'navigation': ('text',)
+}
+CONTENT_KEYS = ('text', 'caption', 'bold', 'italics', 'underline')  # The keys whose values are content.
+LIST_KEYS = ('numbers', 'bullets')  # The keys whose values are lists of content.
+GROUP_KEYS = ('body', 'left', 'right', 'title')  # The keys accepted by the transform of an article.
+TOP_KEYS = ('image', 'caption')  # The keys required by the transform of the top image.
+
+
+def _locate(path):
+    """Describe where a value is within the transforms."""
+    return ' > '.join(str(p) for p in path) or 'the transforms'
+
+
+def _compile_descriptor(descriptor, path):
+    """Check the content descriptor and get its kind along with a copy in which all of the content is compiled."""
+    for kind, keys in DESCRIPTORS.items():
+        found = [k for k in keys if k in descriptor]
+        if len(found) != 0:
+            break
+    else:
+        raise exceptions.UnknownTransform(descriptor, sorted(k for keys in DESCRIPTORS.values() for k in keys))
+    allowed = found[:1] + list(OPTIONS.get(kind, ()))
+    if len(found) > 1 or not descriptor.keys() <= set(allowed):
+        raise exceptions.UnknownTransform(descriptor, allowed)
+
+    compiled = {}
+    for key, value in descriptor.items():
+        if key in LIST_KEYS:
+            if not isinstance(value, list):
+                raise exceptions.InvalidTransform(_locate(path + [key]), 'a list of items is expected')
+            compiled[key] = tuple(_compile_content(v, path + [key, i]) for i, v in enumerate(value))
+        elif key in CONTENT_KEYS:
+            compiled[key] = _compile_content(value, path + [key])
+        elif isinstance(value, (dict, list)):
+            raise exceptions.InvalidTransform(_locate(path + [key]), 'a single value is expected')
+        else:
+            compiled[key] = str(value)
+    return kind, compiled
+
+
+def _compile_content(content, path):
+    """Check the content, a content descriptor or a list of them, and get it as a tuple of compiled items.
+
+    Every item is either a string or a tuple of the kind of a content descriptor and its compiled copy.
+    """
+    if not isinstance(content, list):
+        content = [content]
+    items = []
+    for i, item in enumerate(content):
+        if isinstance(item, dict):
+            items.append(_compile_descriptor(item, path + [i]))
+        elif isinstance(item, list):
+            raise exceptions.InvalidTransform(_locate(path + [i]), 'a list cannot be nested in a list of content')
+        else:
+            items.append(str(item))
+    return tuple(items)
+
+
+def _find_images(content):
+    """Get the partial url of every image descriptor in the compiled content, however deeply it is nested."""
+    for item in content:
+        if not isinstance(item, tuple):
+            continue
+        kind, descriptor = item
+        if kind == 'image':
+            yield descriptor['image']
+        for key, value in descriptor.items():
+            if key in LIST_KEYS:
+                for list_item in value:
+                    yield from _find_images(list_item)
+            elif key in CONTENT_KEYS:
+                yield from _find_images(value)
+
+
+class Plan:
+    """A transform that is checked and compiled once so that it can be applied to any number of documents."""
+
+    FORMAT = 1  # The version of the compiled form, to be increased whenever it changes.
+
+    def __init__(self, transforms):
+        """Check the transforms, as loaded from a transform file, and compile them into a plan.
+
+        Raise an UnknownTransform or an InvalidTransform exception, before anything is applied, if they are
+        not valid. The plan is never changed by the documents it is applied to.
+        """
+        if not isinstance(transforms, dict):
+            raise exceptions.InvalidTransform(_locate([]), 'a mapping of article titles is expected')
+        self.format = self.FORMAT
+        self.source = {str(k): copy.deepcopy(v) for k, v in transforms.items()}  # To report what was not applied.
+        self.top = None
+        self.articles = OrderedDict()
+        for title, group in transforms.items():
+            if not isinstance(group, dict):
+                raise exceptions.InvalidTransform(_locate([title]), 'a mapping of specifiers is expected')
+            if title == 'top':
+                self.top = self._compile_top(group)
+            else:
+                self.articles[str(title)] = self._compile_group(title, group)
+
+        content = [] if self.top is None else [('image', self.top)]
+        for group in self.articles.values():
+            content.extend(item for paragraph in group.get('body', ()) for item in paragraph)
+            content.extend(item for paragraph in group.get('left', ()) for item in paragraph)
+            content.extend(item for paragraph in group.get('right', ()) for item in paragraph)
+            content.extend(group.get('title', ()))
+        self.images = tuple(_find_images(content))  # The partial url of every image, in order of appearance.
+
+    @staticmethod
+    def _compile_top(group):
+        """Check the transform of the top image and compile its caption."""
+        if group.keys() != set(TOP_KEYS):
+            raise exceptions.InvalidTransform(_locate(['top']), 'exactly {!s:} are expected'.format(list(TOP_KEYS)))
+        if isinstance(group['image'], (dict, list)):
+            raise exceptions.InvalidTransform(_locate(['top', 'image']), 'a single value is expected')
+        return {
+            'image': str(group['image']),
+            'caption': _compile_content(group['caption'], ['top', 'caption'])
+        }
+
+    @staticmethod
+    def _compile_group(title, group):
+        """Check the transform of an article and compile its paragraphs and title."""
+        unknown = group.keys() - set(GROUP_KEYS)
+        if len(unknown) != 0:
+            raise exceptions.InvalidTransform(_locate([title]), '{!s:} are not specifiers, please choose from '
+                                              '{!s:}'.format(sorted(unknown), list(GROUP_KEYS)))
+        if ('left' in group) != ('right' in group):
+            raise exceptions.InvalidTransform(_locate([title]), 'the left and right specifiers go together')
+        compiled = {}
+        for key, value in group.items():
+            if key == 'title':
+                compiled[key] = _compile_content(value, [title, key])
+            elif not isinstance(value, list):
+                raise exceptions.InvalidTransform(_locate([title, key]), 'a list of paragraphs is expected')
+            else:
+                compiled[key] = tuple(_compile_content(v, [title, key, i]) for i, v in enumerate(value))
+        return compiled
+
+
+def _get_plan_path(path):
+    """Get the file in which the compiled plan of the transform file is kept, along with its contents.
+
+    The name of the file is made from the hash of the contents only, so that a plan is never used for a
+    transform file that changed since it was compiled but is still used once the file is checked out again.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    name = '{:s}.json'.format(hashlib.sha256(data).hexdigest())
+    return os.path.join(PLAN_DIR, name), data
+
+
+def _freeze(value):
+    """Convert the lists read from a stored plan back into the tuples that they were compiled as."""
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _freeze(v) for k, v in value.items()}
+    return value
+
+
+def _read_plan(plan_path):
+    """Read the plan stored at plan_path, or None if there is none in the current format.
+
+    The plan is stored as JSON rather than as a python object, so reading it never runs any code.
+    """
+    try:
+        with open(plan_path, 'r', encoding='UTF-8') as file:
+            fields = json.load(file)
+        if fields['format'] != Plan.FORMAT:
+            return None
+        plan = Plan.__new__(Plan)
+        plan.format = fields['format']
+        plan.source = fields['source']
+        plan.top = _freeze(fields['top'])
+        plan.articles = OrderedDict((k, _freeze(v)) for k, v in fields['articles'])
+        plan.images = _freeze(fields['images'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    os.utime(plan_path)  # to mark it as recently used
+    return plan
+
+
+def _write_plan(plan_path, plan):
+    """Store the plan at plan_path and delete the least recently used plans beyond MAX_PLANS.
+
+    Nothing is stored if the plan cannot be, such as when the source of a transform holds values that JSON
+    does not support; the plan is still usable, it just has to be compiled again next time.
+    """
+    fields = {
+        'format': plan.format,
+        'source': plan.source,
+        'top': plan.top,
+        'articles': list(plan.articles.items()),
+        'images': plan.images
+    }
+    try:
+        code = json.dumps(fields)
+        os.makedirs(PLAN_DIR, exist_ok=True)
+        temp_path = '{:s}.{:d}.tmp'.format(plan_path, os.getpid())
+        with open(temp_path, 'w', encoding='UTF-8') as file:
+            file.write(code)
+        os.replace(temp_path, plan_path)
+
+        plans = [os.path.join(PLAN_DIR, n) for n in os.listdir(PLAN_DIR) if n.endswith('.json')]
+        plans.sort(key=lambda p: os.stat(p).st_mtime, reverse=True)
+        for old_path in plans[MAX_PLANS:]:
+            os.remove(old_path)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def load(path):
+    """Get the plan of the transform file at path, compiling it only if it is not in PLAN_DIR already.
+
+    The transform file is only parsed when it is compiled, after which the plan is stored in PLAN_DIR for the
+    next time. Raise an UnknownTransform or an InvalidTransform exception if the transform file is not valid.
+    """
+    plan_path, data = _get_plan_path(path)
+    plan = _read_plan(plan_path)
+    if plan is not None:
+        return plan
+
+    import yaml
+    plan = Plan(yaml.safe_load(data.decode('UTF-8')))
+    _write_plan(plan_path, plan)
+    return plan
@@ -0,0 +1,296 @@
+"""Classes and constants for sending requests over pooled keep-alive connections."""
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import exceptions
+
+
+# Global variables to configure used by the class to allow for easy configuration
+POOL_SIZE = 10  # The number of connections kept alive for a host that is not listed below.
+HOST_POOL_SIZES = {  # The number of connections kept alive for a host and all of its subdomains.
+    'ismailiinsight.org': 20,
+    'api.quickemailverification.com': 4
+}
+LIMIT = (10.0, 10, 4)  # The requests per second, burst size and requests in flight for a host not listed below.
+HOST_LIMITS = {  # The limits for a host and all of its subdomains, in the same format as LIMIT.
+    'api.quickemailverification.com': (2.0, 5, 2)
+}
+MAX_FAILURES = 3  # The number of connection failures in a row after which the requests to a host are skipped.
+RETRY_AFTER = 60  # The number of seconds after which a single request to a skipped host is let through again.
+
+# Private variables
+_transport = None
+requests = None  # The requests module, only imported by get_requests once a request is sent to keep startup fast.
+
+
+def get_default():
+    """Get a session pool created with the default values."""
+    global _transport
+    if _transport is None:
+        _transport = SessionPool(POOL_SIZE, HOST_POOL_SIZES, LIMIT, HOST_LIMITS, MAX_FAILURES, RETRY_AFTER)
+    return _transport
+
+
+def get_requests():
+    """Get the requests module, importing it the first time."""
+    global requests
+    if requests is None:
+        import requests as requests_module
+        requests = requests_module
+    return requests
+
+
+def host_of(url):
+    """Get the lowercase host name of the url."""
+    return (urlsplit(str(url)).hostname or '').lower()
+
+
+def get_total_size(response):
+    """Get the size in bytes of the whole resource that a response, maybe to a Range request, is for.
+
+    The size is read from the Content-Range header of a partial response and from the Content-Length
+    header of a full one. Return None if it is not known.
+    """
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    else:
+        total = response.headers.get('Content-Length', '')
+    return int(total) if total.isdigit() else None
+
+
+def order_by_host(urls):
+    """Order the urls so that the urls for the same host are next to each other.
+
+    The hosts keep the order in which they first appear, as do the urls of each host.
+    """
+    groups = OrderedDict()
+    for url in urls:
+        groups.setdefault(host_of(url), []).append(url)
+    return [url for group in groups.values() for url in group]
+
+
+def _find_domain_value(values, host, default):
+    """Get the value for the host, or for the closest domain it belongs to, or the default."""
+    labels = host.split('.')
+    for i in range(len(labels)):
+        try:
+            return values['.'.join(labels[i:])]
+        except KeyError:
+            pass
+    return default
+
+
+class TokenBucket:
+    """An object that allows events at a steady rate with bursts of a limited size."""
+
+    def __init__(self, rate, capacity):
+        """Create a full bucket that refills at rate tokens per second up to capacity tokens."""
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token from the bucket, waiting for one to be added if it is empty."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self._rate
+            time.sleep(delay)
+
+
+class HostLimiter:
+    """A context manager that keeps the requests to a host within a rate and a number in flight."""
+
+    def __init__(self, rate, capacity, concurrency):
+        """Create a limiter that allows rate requests per second, bursts of capacity and concurrency at once."""
+        self._bucket = TokenBucket(rate, capacity)
+        self._slots = threading.BoundedSemaphore(int(concurrency))
+
+    def __enter__(self):
+        """Wait for a free slot and then for a token."""
+        self._slots.acquire()
+        try:
+            self._bucket.acquire()
+        except BaseException:
+            self._slots.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Free the slot."""
+        self._slots.release()
+
+
+class CircuitBreaker:
+    """An object that counts the connection failures of a host and opens once there are too many.
+
+    An open breaker lets a single request through once it has been open for retry_after seconds. The
+    breaker closes again if that request reaches the host, and stays open for another retry_after seconds
+    if it does not.
+    """
+
+    def __init__(self, max_failures, retry_after=RETRY_AFTER):
+        """Create a closed breaker that opens after max_failures failures in a row."""
+        self._max_failures = int(max_failures)
+        self._retry_after = float(retry_after)
+        self.failures = 0
+        self.last_error = None
+        self._opened_at = None  # The time at which the breaker last opened
+        self._probing = False  # Whether the single request let through by an open breaker is in progress
+
+    @property
+    def is_open(self):
+        """Whether the requests to the host should be skipped."""
+        return self.failures >= self._max_failures
+
+    @property
+    def reason(self):
+        """Describe why the breaker is in its current state."""
+        return '{:d} connection failure{:s}{:s}'.format(
+            self.failures, '' if self.failures == 1 else 's',
+            '' if self.last_error is None else ', the last one being {:s}'.format(self.last_error))
+
+    def allow_request(self):
+        """Determine whether a request to the host may be sent now, letting the retry through when it is due."""
+        if not self.is_open:
+            return True
+        if self._probing or time.monotonic() - self._opened_at < self._retry_after:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        """Close the breaker after a request reached the host."""
+        self.failures = 0
+        self.last_error = None
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self, error):
+        """Count a connection failure, remembering the kind of error that caused it."""
+        cause = error.args[0] if len(error.args) > 0 else error
+        self.failures += 1
+        self.last_error = type(getattr(cause, 'reason', cause)).__name__
+        if self.is_open:
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class SessionPool:
+    """An object that sends requests through one keep-alive session, limiter and circuit breaker per host."""
+
+    def __init__(self, pool_size=POOL_SIZE, host_pool_sizes=None, limit=LIMIT, host_limits=None,
+                 max_failures=MAX_FAILURES, retry_after=RETRY_AFTER):
+        """Create an empty pool.
+
+        Each session keeps up to pool_size connections alive unless its host, or a domain it belongs to,
+        is given a different size in host_pool_sizes. Likewise, the requests to each host are kept within
+        limit, a tuple of the requests per second, the burst size and the requests in flight, unless the
+        host is given different limits in host_limits. Once a host has failed to connect max_failures
+        times in a row, its requests are skipped, except for one every retry_after seconds to find out
+        whether it is back. Sessions and limiters are only created when first needed.
+        """
+        self._pool_size = int(pool_size)
+        self._host_pool_sizes = {k.lower(): int(v) for k, v in (host_pool_sizes or {}).items()}
+        self._limit = tuple(limit)
+        self._host_limits = {k.lower(): tuple(v) for k, v in (host_limits or {}).items()}
+        self._sessions = {}
+        self._limiters = {}
+        self._max_failures = int(max_failures)
+        self._retry_after = float(retry_after)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _get_pool_size(self, host):
+        """Get the number of connections to keep alive for the host."""
+        return _find_domain_value(self._host_pool_sizes, host, self._pool_size)
+
+    def limiter(self, url):
+        """Get the limiter used for the host of the url, creating it if necessary."""
+        host = host_of(url)
+        with self._lock:
+            try:
+                return self._limiters[host]
+            except KeyError:
+                limiter = HostLimiter(*_find_domain_value(self._host_limits, host, self._limit))
+                self._limiters[host] = limiter
+                return limiter
+
+    def session(self, url):
+        """Get the session used for the host of the url, creating it if necessary."""
+        host = host_of(url)
+        with self._lock:
+            try:
+                return self._sessions[host]
+            except KeyError:
+                size = self._get_pool_size(host)
+                session = get_requests().Session()
+                adapter = get_requests().adapters.HTTPAdapter(pool_connections=1, pool_maxsize=size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                return session
+
+    def breaker(self, url):
+        """Get the circuit breaker used for the host of the url, creating it if necessary."""
+        host = host_of(url)
+        with self._lock:
+            try:
+                return self._breakers[host]
+            except KeyError:
+                breaker = CircuitBreaker(self._max_failures, self._retry_after)
+                self._breakers[host] = breaker
+                return breaker
+
+    def open_circuits(self):
+        """Get a dict that maps every host whose requests are being skipped to the reason why."""
+        with self._lock:
+            return {host: b.reason for host, b in self._breakers.items() if b.is_open}
+
+    def _send(self, method, url, **kwargs):
+        """Send a request for the url once the limits of its host allow it, unless the host keeps failing.
+
+        Raise a HostUnavailableException, without touching the network, if the circuit of the host is open
+        and not due for a retry. Any request that reaches the host, even if it then fails, closes the circuit.
+        """
+        breaker = self.breaker(url)
+        with self._lock:
+            allowed = breaker.allow_request()
+        if not allowed:
+            raise exceptions.HostUnavailableException(host_of(url), breaker.reason)
+        with self.limiter(url):
+            failure = None
+            try:
+                return getattr(self.session(url), method)(url, **kwargs)
+            except get_requests().exceptions.ConnectionError as error:
+                failure = error
+                raise
+            finally:
+                with self._lock:
+                    if failure is None:
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure(failure)
+
+    def get(self, url, **kwargs):
+        """Send a GET request for the url over a pooled connection."""
+        return self._send('get', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """Send a HEAD request for the url over a pooled connection."""
+        return self._send('head', url, **kwargs)
+
+    def close(self):
+        """Close every session along with the connections it kept alive."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -9,11 +9,11 @@ PARSE_DECLTYPES = 5
 db_data = {
     'webpages':
         {'https://www.apple.com':
-            ('https://www.apple.com', 200, datetime(2000, 1, 1, 12))
+            ('https://www.apple.com', 200, int(datetime(2000, 1, 1, 12).timestamp()))
          },
     'emails':
         {'aisamji09@gmail.com':
-            ('aisamji09@gmail.com', True, 'accepted_email', datetime(2000, 1, 1, 12))
+            ('aisamji09@gmail.com', True, 'accepted_email', int(datetime(2000, 1, 1, 12).timestamp()))
          }
 }
 results = [None]
@@ -26,12 +26,23 @@ def _fetchone():
     return a
 
 
+def _fetchall():
+    global results
+    a = [r for r in results if r is not None]
+    results = [None]
+    return a
+
+
 def _execute(sql_statement, args=None):
     global results
     global db_data
     results = [None]
-    match = re.match(r'SELECT \* FROM (.+) WHERE .+', sql_statement)
-    if match is not None:
+    many_match = re.match(r'SELECT .+ FROM (\w+) WHERE .+ IN \(.+\)', sql_statement)
+    match = re.match(r'SELECT .+ FROM (\w+) WHERE .+', sql_statement)
+    if many_match is not None:
+        table = many_match.group(1)
+        results = [db_data[table][a] for a in args if a in db_data[table]]
+    elif match is not None:
         table = match.group(1)
         try:
             results = [db_data[table][args[0]]]
@@ -40,18 +51,26 @@ def _execute(sql_statement, args=None):
     elif sql_statement == 'PRAGMA user_version':
         results = [(0,)]
     else:
-        match = re.match(r'INSERT OR REPLACE INTO (.+) VALUES .+', sql_statement)
+        match = re.match(r'INSERT OR REPLACE INTO (\w+) VALUES .+', sql_statement)
         if match is not None:
             table = match.group(1)
             db_data[table][args[0]] = args
     return cursor
 
 
+def _executemany(sql_statement, seq_of_args):
+    for args in seq_of_args:
+        _execute(sql_statement, args)
+    return cursor
+
+
 cache_db = mock.MagicMock(sqlite3.Connection)
 cache_db.executescript = mock.Mock(sqlite3.Connection.executescript)
 cache_db.execute = mock.Mock(side_effect=_execute)
+cache_db.executemany = mock.Mock(side_effect=_executemany)
 cursor = mock.MagicMock(sqlite3.Cursor)
 cursor.fetchone = mock.Mock(side_effect=_fetchone)
+cursor.fetchall = mock.Mock(side_effect=_fetchall)
 
 
 def connect(db_path, **kwargs):
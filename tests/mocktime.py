@@ -10,5 +10,10 @@ class datetime:
         """Get a datetime object representing July 4, 2017 11:06 AM."""
         return dt.datetime(2017, 7, 4, 11, 6)
 
+    @classmethod
+    def fromtimestamp(cls, timestamp):
+        """Get a datetime object representing the timestamp."""
+        return dt.datetime.fromtimestamp(timestamp)
+
 
 timedelta = dt.timedelta
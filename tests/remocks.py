@@ -16,6 +16,11 @@ class Response:
         """Interpret the data as a json object."""
         return json.loads(self.text)
 
+    def iter_content(self, chunk_size=1):
+        """Iterate over the data in chunks of chunk_size bytes."""
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
     def __init__(self, url, data_file=None, status_code=200):
         """Initialize the response object."""
         self.url = str(url)
@@ -26,6 +31,7 @@ class Response:
         else:
             self.content = b''
         self.text = str(self.content, 'UTF-8', errors='replace')
+        self.headers = {'Content-Length': str(len(self.content))}
         print(self.url, self.content, self.text, sep='\n')
 
     def __str__(self):
@@ -67,11 +73,17 @@ responses = {
         exceptions.ConnectionError(),
     'https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/National/07.14.2017/071417_National.jpg':
         Response('https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/National/07.14.2017/071417_National.jpg', # noqa
-                 '071417_National.jpg')
+                 '071417_National.jpg'),
+    'https://www.headless.org':
+        Response('https://www.headless.org')
     }
+head_responses = {
+    'https://www.headless.org':
+        Response('https://www.headless.org', status_code=405)
+}
 
 
-def _get(url):
+def _get(url, **kwargs):
     result = responses[url]
     if isinstance(result, Exception):
         raise result
@@ -79,4 +91,36 @@ def _get(url):
         return result
 
 
+def _head(url, **kwargs):
+    result = head_responses.get(url, responses[url])
+    if isinstance(result, Exception):
+        raise result
+    else:
+        return result
+
+
 get = mock.Mock(side_effect=_get)
+head = mock.Mock(side_effect=_head)
+
+
+class Session:
+    """A mock of the Session object that sends every request through the mocks above."""
+
+    def mount(self, prefix, adapter):
+        """Do nothing."""
+        pass
+
+    def get(self, url, **kwargs):
+        """Send the request through the get mock."""
+        return get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """Send the request through the head mock."""
+        return head(url, **kwargs)
+
+    def close(self):
+        """Do nothing."""
+        pass
+
+
+adapters = mock.Mock()
@@ -1,12 +1,17 @@
 """Tests to ensure correct operation of the cache."""
 import os
+import io
+import hashlib
 import unittest
 import datetime
+import sqlite3
+import threading
 import cache
 import exceptions
 import mklite3
 import mocktime
 import remocks
+import transport
 
 
 class BranchTests(unittest.TestCase):
@@ -43,23 +48,130 @@ class BranchTests(unittest.TestCase):
         self._cache.lookup_webpage.assert_called_with('https://www.apple.com')
         self._cache.lookup_email.assert_called_with('aisamji09@gmail.com')
 
-    @unittest.mock.patch('cache.requests', remocks)
+    @unittest.mock.patch('transport.requests', remocks)
     def test_cache_miss_lookup(self):
         """Confirm that the value is retrieved from online when it is not in the cache."""
         self._cache.get_webpage('https://www.google.com')
-        remocks.get.assert_called_with('https://www.google.com')
+        remocks.head.assert_called_with('https://www.google.com', allow_redirects=True)
 
         self._cache.get_email('richard@quickemailverification.com')
         remocks.get.assert_called_with(cache.Cache.EMAIL_API_ENDPOINT.format(
             'richard@quickemailverification.com'))
 
-    @unittest.mock.patch('cache.requests', remocks)
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_stale_while_revalidate(self):
+        """Confirm that old values are returned right away and refreshed in the background."""
+        self._cache.stale_while_revalidate = True
+        old_row = ('https://journeyforhealth.org', 404, int(datetime.datetime(2000, 1, 1, 12).timestamp()))
+        mklite3.db_data['webpages']['https://journeyforhealth.org'] = old_row
+        info = self._cache.get_webpage('https://journeyforhealth.org')
+        self.assertEqual((404, True), (info.status, info.stale),
+                         'The old value should be returned and marked as stale.')
+
+        self._cache.wait_for_refreshes()
+        info = self._cache.get_webpage('https://journeyforhealth.org')
+        self.assertEqual((200, False), (info.status, info.stale),
+                         'The value should be refreshed in the background.')
+
+    @unittest.mock.patch('transport.requests', remocks)
     def test_url_gone(self):
         """Confirm that a url that is gone returns 410."""
         info = self._cache.get_webpage('https://www.jubileeconcerts.ismaili')
         self.assertEqual(410, info.status,
                          'The status should be 410 if the webpage does not exist.')
 
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_head_rejected(self):
+        """Confirm that a host that rejects HEAD requests is probed with a streamed GET from then on."""
+        remocks.head.reset_mock()
+        self._cache.lookup_webpage('https://www.headless.org')
+        remocks.get.assert_called_with('https://www.headless.org', stream=True)
+        self.assertEqual(200, self._cache.get_webpage('https://www.headless.org', nolookup=True).status,
+                         'The status of the streamed GET should be stored.')
+
+        self._cache.lookup_webpage('https://www.headless.org')
+        self.assertEqual(1, remocks.head.call_count, 'The HEAD request should not be repeated for the host.')
+
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_bulk_lookup(self):
+        """Confirm that a bulk lookup stores the result of every key."""
+        self._cache.lookup_webpages(['https://www.akfusa.org', 'https://www.jubileeconcerts.ismaili',
+                                     'https://www.akfusa.org'], concurrency=2)
+        self._cache.lookup_emails(['lcc@usaji.org'], concurrency=2)
+
+        self.assertEqual(403, self._cache.get_webpage('https://www.akfusa.org', nolookup=True).status,
+                         'The status of every url should be stored.')
+        self.assertEqual(410, self._cache.get_webpage('https://www.jubileeconcerts.ismaili', nolookup=True).status,
+                         'A url that cannot be reached should be stored as gone.')
+        self.assertEqual('accepted_email', self._cache.get_email('lcc@usaji.org', nolookup=True).reason,
+                         'The result of every address should be stored.')
+
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_lenient_bulk_lookup(self):
+        """Confirm that a lenient bulk lookup returns the failures instead of raising the first one."""
+        errors = self._cache.lookup_emails(['lcc@usaji.org', 'nobody@nowhere.org'], strict=False)
+
+        self.assertEqual(['nobody@nowhere.org'], list(errors), 'Only the failed lookups should be returned.')
+        self.assertEqual('accepted_email', self._cache.get_email('lcc@usaji.org', nolookup=True).reason,
+                         'The successful lookups should still be stored.')
+
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_forced_lookup(self):
+        """Confirm that only the lookups that are not made by a get are counted as forced."""
+        self._cache.stats = cache.CacheStats()
+        self._cache.get_webpage('https://www.shitface.org')
+        self._cache.lookup_webpage('https://www.shitface.org')
+
+        stats = self._cache.stats.to_dict()
+        self.assertEqual({'miss': 1, 'forced': 1}, stats['reads']['webpages'],
+                         'Only the direct lookup should be forced.')
+        self.assertEqual(2, stats['statuses']['4xx']['count'], 'Every lookup should be timed by status class.')
+
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_bulk_get(self):
+        """Confirm that a bulk get sorts the keys into fresh, stale and missing ones."""
+        self._cache.lookup_webpages(['https://journeyforhealth.org'])
+        webpages = self._cache.get_webpages(['https://www.apple.com', 'https://journeyforhealth.org',
+                                             'https://www.techcrunch.com'])
+        emails = self._cache.get_emails(['aisamji09@gmail.com', 'aisamji09@gmail.com'])
+
+        self.assertEqual(['https://journeyforhealth.org'], list(webpages['fresh']),
+                         'Entries younger than MAX_AGE should be fresh.')
+        self.assertEqual(200, webpages['fresh']['https://journeyforhealth.org'].status,
+                         'The information of each entry should be returned.')
+        self.assertEqual(['https://www.apple.com'], list(webpages['stale']),
+                         'Entries older than MAX_AGE should be stale.')
+        self.assertEqual(['https://www.techcrunch.com'], webpages['missing'],
+                         'Entries that are not in the cache should be missing.')
+        self.assertEqual(['aisamji09@gmail.com'], list(emails['stale']),
+                         'Duplicate keys should only be returned once.')
+
+
+class MemoTests(unittest.TestCase):
+    """A test suite to confirm the operation of the in-memory layer of the cache."""
+
+    def test_eviction(self):
+        """Confirm that the least recently used entry is forgotten first."""
+        memo = cache.LRUCache(2, 60)
+        memo.put('a', 1)
+        memo.put('b', 2)
+        memo.get('a')
+        memo.put('c', 3)
+
+        self.assertIsNone(memo.get('b'), 'The least recently used entry should be forgotten.')
+        self.assertEqual(1, memo.get('a'), 'Recently used entries should be kept.')
+        self.assertEqual(3, memo.get('c'), 'New entries should be kept.')
+
+    def test_expiry(self):
+        """Confirm that expired entries are forgotten and counted as misses."""
+        memo = cache.LRUCache(2, 60)
+        with unittest.mock.patch('cache.time.monotonic', return_value=0):
+            memo.put('a', 1)
+            self.assertEqual(1, memo.get('a'), 'Unexpired entries should be kept.')
+        with unittest.mock.patch('cache.time.monotonic', return_value=60):
+            self.assertIsNone(memo.get('a'), 'Expired entries should be forgotten.')
+        self.assertEqual((1, 1), (memo.hits, memo.misses), 'Hits and misses should be counted.')
+
 
 class DatabaseTests(unittest.TestCase):
     """A test suite to confirm the communication of the caching database."""
@@ -71,22 +183,116 @@ class DatabaseTests(unittest.TestCase):
         self.addCleanup(os.rmdir, db_dir)
         self.addCleanup(os.remove, self.db_path)
         self._cache = cache.Cache(self.db_path)
+        self.addCleanup(self._cache.close)
 
     def test_schema(self):
         """Confirm the format of the caching database."""
         tables = self._cache._database.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
         tables = list(zip(*tables))[0]
-        self.assertTrue('webpages' in tables and 'emails' in tables and len(tables) == 2,
-                        'Too many tables: {!s:}'.format(tables))
+        self.assertEqual({'webpages', 'emails', 'stats', 'images'}, set(tables),
+                         'Too many tables: {!s:}'.format(tables))
 
         webpage_cols = self._cache._database.execute("PRAGMA table_info(webpages)").fetchall()
         webpage_cols = list(zip(*webpage_cols))[1]
         email_cols = self._cache._database.execute("PRAGMA table_info(emails)").fetchall()
         email_cols = list(zip(*email_cols))[1]
-        self.assertEqual(('url', 'status', 'last_lookup'), webpage_cols,
+        self.assertEqual(('url', 'status', 'last_lookup', 'host', 'last_access'), webpage_cols,
                          'Too many columns in webpages: {!s:}'.format(webpage_cols))
-        self.assertEqual(('address', 'is_valid', 'reason', 'last_lookup'), email_cols,
+        self.assertEqual(('address', 'is_valid', 'reason', 'last_lookup', 'domain', 'last_access'), email_cols,
                          'Too many columns in emails: {!s:}'.format(email_cols))
+        image_cols = self._cache._database.execute("PRAGMA table_info(images)").fetchall()
+        image_cols = list(zip(*image_cols))[1]
+        self.assertEqual(('url', 'width', 'height', 'size', 'hash', 'last_lookup', 'last_access'), image_cols,
+                         'Too many columns in images: {!s:}'.format(image_cols))
+
+        indexes = self._cache._database.execute("SELECT name FROM sqlite_master WHERE type='index' "
+                                                "AND sql IS NOT NULL").fetchall()
+        self.assertEqual({'webpages_last_lookup', 'webpages_host', 'webpages_last_access',
+                          'emails_last_lookup', 'emails_domain', 'emails_last_access',
+                          'images_last_lookup', 'images_last_access'},
+                         set(list(zip(*indexes))[0]), 'The lookup and access times and hosts should be indexed.')
+
+    def test_migration(self):
+        """Confirm that a version 1 database is upgraded without losing its entries."""
+        old_path = os.path.join(os.path.dirname(self.db_path), 'old.db')
+        self.addCleanup(os.remove, old_path)
+        old = sqlite3.connect(old_path)
+        old.executescript(cache.Cache.DB_MANAGEMENT_SCRIPTS[0])
+        old.execute("INSERT INTO webpages VALUES ('https://www.Apple.com/mac', 200, '20170704110600')")
+        old.execute("INSERT INTO emails VALUES ('ali.samji@Outlook.com', 1, 'accepted_email', '20170704110600')")
+        old.execute('PRAGMA user_version=1')
+        old.commit()
+        old.close()
+
+        migrated = cache.Cache(old_path)
+        self.addCleanup(migrated.close)
+        webpage = migrated.find_webpages(host='www.apple.com')
+        self.assertEqual(['https://www.Apple.com/mac'], [w.url for w in webpage],
+                         'The webpages should keep their entries and gain their host.')
+        self.assertEqual(datetime.datetime(2017, 7, 4, 11, 6), webpage[0].last_lookup,
+                         'The lookup times should be converted to seconds since the epoch.')
+        self.assertEqual(['ali.samji@Outlook.com'], [e.address for e in migrated.find_emails(domain='outlook.com')],
+                         'The emails should keep their entries and gain their domain.')
+
+    def test_failed_migration(self):
+        """Confirm that a migration that fails is rolled back alone and run again the next time."""
+        old_path = os.path.join(os.path.dirname(self.db_path), 'old.db')
+        self.addCleanup(os.remove, old_path)
+        old = sqlite3.connect(old_path)
+        old.executescript(cache.Cache.DB_MANAGEMENT_SCRIPTS[0])
+        old.execute("INSERT INTO webpages VALUES ('https://www.apple.com', 200, '20170704110600')")
+        old.execute('PRAGMA user_version=1')
+        old.commit()
+        old.close()
+
+        failing = cache.Cache.DB_MANAGEMENT_SCRIPTS + ['CREATE TABLE extra (value); SELECT no_such_function(1);']
+        with unittest.mock.patch.multiple(cache.Cache, DB_MANAGEMENT_SCRIPTS=failing, DB_VERSION=len(failing)):
+            with self.assertRaises(sqlite3.OperationalError, msg='The failing migration should raise its error.'):
+                cache.Cache(old_path)
+        old = sqlite3.connect(old_path)
+        self.addCleanup(old.close)
+        self.assertEqual(cache.Cache.DB_VERSION, old.execute('PRAGMA user_version').fetchone()[0],
+                         'The migrations before the failing one should be kept.')
+        self.assertEqual([], old.execute("SELECT name FROM sqlite_master WHERE name='extra'").fetchall(),
+                         'The failing migration should be rolled back.')
+
+        migrated = cache.Cache(old_path)
+        self.addCleanup(migrated.close)
+        self.assertEqual(datetime.datetime(2017, 7, 4, 11, 6),
+                         migrated.get_webpage('https://www.apple.com', nolookup=True).last_lookup,
+                         'The lookup times should be converted only once.')
+
+    def test_image_migration(self):
+        """Confirm that the images measured from their header lose the empty hash they were given."""
+        old_path = os.path.join(os.path.dirname(self.db_path), 'old.db')
+        self.addCleanup(os.remove, old_path)
+        with unittest.mock.patch.multiple(cache.Cache, DB_MANAGEMENT_SCRIPTS=cache.Cache.DB_MANAGEMENT_SCRIPTS[:5],
+                                          DB_VERSION=5):
+            old = cache.Cache(old_path)
+        old._database.execute("INSERT INTO images VALUES ('https://www.apple.com/mac.jpg', 400, 267, 1024, '', 0, 0)")
+        old.close()
+
+        migrated = cache.Cache(old_path)
+        self.addCleanup(migrated.close)
+        self.assertIsNone(migrated.get_image('https://www.apple.com/mac.jpg', nolookup=True).hash,
+                          'An empty hash should become None.')
+
+    def test_find(self):
+        """Confirm that entries are filtered by host and staleness with the indexes."""
+        self._cache.set_webpage('https://www.apple.com', 200)
+        self._cache.set_webpage('https://www.apple.com/mac', 200)
+        self._cache.set_webpage('https://www.google.com', 200)
+        self._cache._database.execute("UPDATE webpages SET last_lookup=0 WHERE url='https://www.apple.com'")
+
+        self.assertEqual(['https://www.apple.com/mac'],
+                         [w.url for w in self._cache.find_webpages(host='www.apple.com', stale=False)],
+                         'Only the fresh entries of the host should be found.')
+        self.assertEqual(['https://www.apple.com'], [w.url for w in self._cache.find_webpages(stale=True)],
+                         'Only the stale entries should be found.')
+        plan = self._cache._database.execute('EXPLAIN QUERY PLAN ' + cache.Cache.WEBPAGE_FIND_STATEMENT.format(
+            'last_lookup <= ?'), (0,)).fetchall()
+        self.assertTrue(any('webpages_last_lookup' in str(step) for step in plan),
+                        'The staleness should be filtered with an index: {!s:}'.format(plan))
 
     def test_data_round_trip(self):
         """Confirm the types of the data on round trip to/from the database."""
@@ -99,3 +305,272 @@ class DatabaseTests(unittest.TestCase):
                          'The lookup time should be a datetime object.')
         self.assertEqual(info.address, 'ali.samji@outlook.com', 'The address should be ali.samji@outlook.com')
         self.assertEqual(info.is_valid, False, 'The validity should be False.')
+
+    def test_batch(self):
+        """Confirm that the writes in a batch are visible inside of it but only committed when it ends."""
+        other = sqlite3.connect(self.db_path)
+        self.addCleanup(other.close)
+        count_statement = 'SELECT COUNT(*) FROM webpages'
+
+        with self._cache.batch():
+            self._cache.set_webpage('https://www.apple.com', 200)
+            with self._cache.batch():
+                self._cache.set_webpage('https://www.google.com', 200)
+            self.assertEqual(200, self._cache.get_webpage('https://www.google.com', nolookup=True).status,
+                             'The writes should be visible inside of the batch.')
+            self.assertEqual(0, other.execute(count_statement).fetchone()[0],
+                             'The writes should not be committed before the batch ends.')
+        self.assertEqual(2, other.execute(count_statement).fetchone()[0],
+                         'The writes should be committed when the batch ends.')
+
+    def test_batch_per_thread(self):
+        """Confirm that a batch only defers the commits of its own thread."""
+        other = sqlite3.connect(self.db_path)
+        self.addCleanup(other.close)
+        count_statement = "SELECT COUNT(*) FROM webpages WHERE url='https://www.google.com'"
+
+        with self._cache.batch():
+            writer = threading.Thread(target=self._cache.set_webpage, args=('https://www.google.com', 200))
+            writer.start()
+            writer.join()
+            self.assertEqual(1, other.execute(count_statement).fetchone()[0],
+                             'The writes of another thread should be committed right away.')
+
+    def test_batch_error(self):
+        """Confirm that the writes of a batch are still committed when its block raises."""
+        other = sqlite3.connect(self.db_path)
+        self.addCleanup(other.close)
+        with self.assertRaises(KeyError, msg='The error of the block should be raised.'):
+            with self._cache.batch():
+                self._cache.set_webpage('https://www.apple.com', 200)
+                raise KeyError('https://www.google.com')
+        self.assertEqual(1, other.execute('SELECT COUNT(*) FROM webpages').fetchone()[0],
+                         'The lookups that succeeded should be kept.')
+
+    def test_memo(self):
+        """Confirm that repeated reads are answered from memory until the entry is written again."""
+        self._cache.set_webpage('https://www.apple.com', 200)
+        self._cache.get_webpage('https://www.apple.com', nolookup=True)
+        self._cache.get_webpages(['https://www.apple.com'])
+        self.assertEqual(1, self._cache._webpage_memo.hits, 'The second read should be answered from memory.')
+
+        self._cache.set_webpage('https://www.apple.com', 404)
+        self.assertEqual(404, self._cache.get_webpage('https://www.apple.com', nolookup=True).status,
+                         'Writing an entry should replace it in memory.')
+
+    def test_access_tracking(self):
+        """Confirm that reads record their access time when the batch ends instead of right away."""
+        self._cache.set_webpage('https://www.apple.com', 200)
+        self._cache._database.execute('UPDATE webpages SET last_access=0')
+        access_statement = "SELECT last_access FROM webpages WHERE url='https://www.apple.com'"
+
+        with self._cache.batch():
+            self._cache.get_webpages(['https://www.apple.com'])
+            self.assertEqual(0, self._cache._database.execute(access_statement).fetchone()[0],
+                             'The access should not be written by the read.')
+        self.assertLess(0, self._cache._database.execute(access_statement).fetchone()[0],
+                        'The access should be written when the batch ends.')
+
+    def test_access_flushing(self):
+        """Confirm that buffered access times are written by the next commit or once too many are buffered."""
+        self._cache.set_webpage('https://www.apple.com', 200)
+        self._cache._database.execute('UPDATE webpages SET last_access=0')
+        access_statement = "SELECT last_access FROM webpages WHERE url='https://www.apple.com'"
+
+        self._cache.get_webpages(['https://www.apple.com'])
+        self._cache.set_webpage('https://www.google.com', 200)
+        self.assertLess(0, self._cache._database.execute(access_statement).fetchone()[0],
+                        'The access should be written along with the next commit.')
+
+        self._cache._database.execute('UPDATE webpages SET last_access=0')
+        with unittest.mock.patch.object(cache.Cache, 'MAX_ACCESSES', 2):
+            self._cache.get_webpages(['https://www.apple.com'])
+            self.assertEqual(1, sum(len(t) for t in self._cache._accesses.values()),
+                             'A single access should stay buffered.')
+            self._cache.get_webpages(['https://www.google.com'])
+        self.assertEqual({}, self._cache._accesses, 'A full buffer should be written right away.')
+        self.assertLess(0, self._cache._database.execute(access_statement).fetchone()[0],
+                        'The access should be written once the buffer is full.')
+
+    def test_collect_garbage(self):
+        """Confirm that old entries are expired, rarely used ones are evicted and the file is compacted."""
+        with self._cache.batch():
+            for i in range(200):
+                self._cache.set_webpage('https://www.apple.com/{:d}'.format(i), 200)
+            self._cache.set_email('ali.samji@outlook.com', True)
+        self._cache._database.execute("UPDATE webpages SET last_lookup=0 WHERE url LIKE '%/1__'")
+        self._cache._database.execute("UPDATE webpages SET last_access=last_access + 1 WHERE url LIKE '%/2_'")
+        self._cache._database.commit()
+
+        summary = self._cache.collect_garbage(older_than=cache.MAX_AGE, max_rows=10)
+        urls = self._cache._database.execute('SELECT url FROM webpages').fetchall()
+        self.assertEqual((100, 90), (summary['expired'], summary['evicted']),
+                         'Every old entry and every entry beyond the cap should be deleted.')
+        self.assertEqual({'https://www.apple.com/2{:d}'.format(i) for i in range(10)}, set(next(zip(*urls))),
+                         'The most recently used entries should be kept.')
+        self.assertEqual(1, len(self._cache.find_emails()), 'Tables under the cap should be kept whole.')
+        self.assertLess(0, summary['reclaimed'], 'The freed pages should be reclaimed.')
+
+    def test_stats(self):
+        """Confirm that reads are counted, kept across runs and reported with the ages of the entries."""
+        self._cache.set_webpage('https://www.apple.com', 200)
+        self._cache.set_webpage('https://www.google.com', 200)
+        self._cache._database.execute("UPDATE webpages SET last_lookup=0 WHERE url='https://www.google.com'")
+        self._cache._database.commit()
+        self._cache.get_webpage('https://www.apple.com')
+        self._cache.get_webpages(['https://www.apple.com', 'https://www.google.com', 'https://www.techcrunch.com'])
+        self._cache.stats.time_lookup('www.apple.com', '2xx', 0.3)
+
+        stats = self._cache.get_stats()
+        self.assertEqual({'fresh': 2, 'stale': 1, 'miss': 1}, stats['reads']['webpages'],
+                         'Every read should be counted by how it was answered.')
+        self.assertEqual({'count': 1, 'seconds': 0.3, 'buckets': {'<=0.5s': 1}}, stats['hosts']['www.apple.com'],
+                         'The latency of the lookups should be counted by host.')
+        self.assertEqual({'rows': 2, 'stale': 1}, {k: stats['tables']['webpages'][k] for k in ('rows', 'stale')},
+                         'The rows should be counted from the database.')
+        self.assertEqual(1, stats['tables']['webpages']['ages'][1], 'The rows should be counted by age.')
+
+        self._cache.get_webpage('https://www.apple.com')
+        self.assertEqual(3, self._cache.get_stats()['reads']['webpages']['fresh'],
+                         'The counters should only be added to the database once.')
+        self._cache.reset_stats()
+        self.assertEqual({}, self._cache.get_stats()['reads'], 'The counters should be forgotten on reset.')
+
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_image(self):
+        """Confirm that an image is only measured until its dimensions are cached and then once they expire."""
+        url = 'https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/National/07.14.2017/071417_National.jpg'
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/071417_National.jpg'), 'rb') as file:
+            content = file.read()
+        self._cache._transport = transport.SessionPool()
+        with unittest.mock.patch.object(self._cache._transport, 'get', wraps=self._cache._transport.get) as mock_get:
+            self._cache.get_image(url)
+            info = self._cache.get_image(url)
+            mock_get.assert_called_once_with(url, stream=True, headers={'Range': 'bytes=0-8191'})
+
+            self.assertEqual((400, 267), (info.width, info.height), 'The dimensions of the image should be cached.')
+            self.assertEqual((len(content), None), (info.size, info.hash),
+                             'The size of the image should be cached without downloading all of it.')
+
+            self._cache._database.execute('UPDATE images SET last_lookup=?', (cache._days_ago(cache.MAX_AGE + 1),))
+            self._cache.clear_memos()
+            self.assertFalse(self._cache.get_image(url).stale, 'Images should be kept longer than webpages.')
+            self._cache._database.execute('UPDATE images SET last_lookup=?',
+                                          (cache._days_ago(cache.IMAGE_MAX_AGE + 1),))
+            self._cache.clear_memos()
+            self.assertFalse(self._cache.get_image(url).stale, 'An expired image should be measured again.')
+            self.assertEqual(2, mock_get.call_count, 'Only the expired image should be downloaded again.')
+
+    @staticmethod
+    def _serve_image(content, sent, *, ranges=True, sized=True):
+        """Mock SessionPool.get to serve the content, honoring ranges if asked, counting the bytes sent."""
+        def get(url, **kwargs):
+            first, last = kwargs.get('headers', {}).get('Range', 'bytes=0-').partition('=')[2].split('-')
+            start = int(first) if ranges else 0
+            end = int(last) + 1 if ranges and last else len(content)
+            response = unittest.mock.Mock(status_code=206 if ranges else 200, headers={})
+            if ranges and sized:
+                response.headers['Content-Range'] = 'bytes {:d}-{:d}/{:d}'.format(start, end - 1, len(content))
+            elif sized:
+                response.headers['Content-Length'] = str(len(content))
+
+            def iter_content(chunk_size):
+                for i in range(start, end, chunk_size):
+                    sent.append(min(chunk_size, end - i))
+                    yield content[i:min(i + chunk_size, end)]
+            response.iter_content.side_effect = iter_content
+            return response
+        return unittest.mock.Mock(side_effect=get)
+
+    @unittest.mock.patch('imageheader.SNIFF_SIZE', 64)
+    def test_image_late_header(self):
+        """Confirm that the rest of an image is streamed until its header gives its dimensions."""
+        url = 'https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/National/07.14.2017/071417_National.jpg'
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/071417_National.jpg'), 'rb') as file:
+            content = file.read()
+        sent = []
+        with unittest.mock.patch.object(self._cache._transport, 'get', self._serve_image(content, sent)) as mock_get:
+            info = self._cache.get_image(url)
+        self.assertEqual([unittest.mock.call(url, stream=True, headers={'Range': 'bytes=0-63'}),
+                          unittest.mock.call(url, stream=True, headers={'Range': 'bytes=64-'})],
+                         mock_get.call_args_list, 'Only the rest of the image should be requested.')
+        self.assertEqual((400, 267, len(content), None), (info.width, info.height, info.size, info.hash),
+                         'The size should be read from the Content-Range header.')
+        self.assertLess(sum(sent), len(content), 'The image should not be downloaded whole.')
+
+    def test_image_unknown_size(self):
+        """Confirm that an image whose size is not given is not downloaded whole to learn it."""
+        url = 'https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/National/07.14.2017/071417_National.jpg'
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/071417_National.jpg'), 'rb') as file:
+            content = file.read()
+        sent = []
+        get = self._serve_image(content, sent, ranges=False, sized=False)
+        with unittest.mock.patch.object(self._cache._transport, 'get', get):
+            info = self._cache.get_image(url)
+        self.assertEqual((400, 267, None, None), (info.width, info.height, info.size, info.hash),
+                         'The unknown size and hash should be stored as None.')
+        self.assertLess(sum(sent), len(content), 'The image should not be downloaded whole.')
+
+    @unittest.mock.patch('transport.requests', remocks)
+    def test_image_fallback(self):
+        """Confirm that an image whose header is not understood is downloaded whole and measured by Pillow."""
+        url = 'https://ismailiinsight.org/eNewsletterPro/uploadedimages/000001/National/07.14.2017/071417_National.jpg'
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/071417_National.jpg'), 'rb') as file:
+            content = file.read()
+        self._cache._transport = transport.SessionPool()
+        with unittest.mock.patch('imageheader.get_dimensions', return_value=None):
+            info = self._cache.get_image(url)
+        self.assertEqual((400, 267), (info.width, info.height), 'Pillow should measure the image.')
+        self.assertEqual((len(content), hashlib.sha256(content).hexdigest()), (info.size, info.hash),
+                         'The size and hash of the downloaded image should be cached.')
+
+    def test_export_import(self):
+        """Confirm that entries survive a round trip and that a merge keeps the entry looked up last."""
+        self._cache.set_webpage('https://www.apple.com', 200)
+        self._cache.set_webpage('https://www.google.com', 200)
+        self._cache.set_email('ali.samji@outlook.com', True)
+        exported = io.StringIO()
+        self.assertEqual(3, self._cache.export_entries(exported), 'Every entry should be exported.')
+
+        other_path = os.path.join(os.path.dirname(self.db_path), 'other.db')
+        self.addCleanup(os.remove, other_path)
+        other = cache.Cache(other_path)
+        self.addCleanup(other.close)
+        other.set_webpage('https://www.apple.com', 404)
+        other.set_webpage('https://www.google.com', 404)
+        other._database.execute("UPDATE webpages SET last_lookup=1 WHERE url='https://www.google.com'")
+        other._database.commit()
+        summary = other.import_entries(io.StringIO(exported.getvalue()), merge=True)
+
+        self.assertEqual({'read': 3, 'stored': 2}, summary, 'Only the entries looked up last should be stored.')
+        self.assertEqual(404, other.get_webpage('https://www.apple.com', nolookup=True).status,
+                         'A newer entry should be kept by a merge.')
+        self.assertEqual(200, other.get_webpage('https://www.google.com', nolookup=True).status,
+                         'An older entry should be replaced by a merge.')
+        self.assertTrue(other.get_email('ali.samji@outlook.com', nolookup=True).is_valid,
+                        'The types of the entries should survive the round trip.')
+
+    def test_malformed_import(self):
+        """Confirm that nothing is imported when a line is malformed."""
+        lines = ['{"table": "webpages", "url": "https://www.apple.com", "status": 200, "last_lookup": 1}\n',
+                 '{"table": "webpages", "url": "https://www.google.com"}\n']
+        self.assertRaises(exceptions.MalformedEntryException, self._cache.import_entries, lines)
+        self.assertRaises(exceptions.CacheMissException, self._cache.get_webpage, 'https://www.apple.com',
+                          nolookup=True)
+
+    def test_journal_mode(self):
+        """Confirm that the database uses write-ahead logging."""
+        mode = self._cache._database.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', mode.lower(), 'The database should be in WAL mode.')
+
+    @unittest.mock.patch.object(cache.Cache, 'MAX_VARIABLES', 2)
+    def test_chunked_bulk_get(self):
+        """Confirm that a bulk get finds every key when they are split over several statements."""
+        urls = ['https://www.apple.com', 'https://www.google.com', 'https://www.akfusa.org']
+        for u in urls:
+            self._cache.set_webpage(u, 200)
+        webpages = self._cache.get_webpages(urls + ['https://www.techcrunch.com'])
+
+        self.assertEqual(urls, list(webpages['fresh']), 'Every key in the cache should be found.')
+        self.assertEqual(['https://www.techcrunch.com'], webpages['missing'],
+                         'Keys that are not in the cache should be missing.')
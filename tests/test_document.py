@@ -2,12 +2,16 @@
 import unittest
 from unittest import mock
 import os
+import copy
 import re
 import bs4
 import yaml
 import remocks
 import cache
 import document
+import exceptions
+import transform
+import transport
 
 
 class ReviewTests(unittest.TestCase):
@@ -15,16 +19,22 @@ class ReviewTests(unittest.TestCase):
 
     def setUp(self):
         """Prepare the environment."""
-        request_patcher = mock.patch('document.cache.requests', remocks)
-        cache_patcher = mock.patch('document.cache.get_default', return_value=cache.Cache(':memory:'))
+        request_patcher = mock.patch('transport.requests', remocks)
+        transport_patcher = mock.patch('transport.get_default', return_value=transport.SessionPool())
         self.addCleanup(request_patcher.stop)
-        self.addCleanup(cache_patcher.stop)
-
+        self.addCleanup(transport_patcher.stop)
         request_patcher.start()
+        transport_patcher.start()
+
+        cache_patcher = mock.patch('document.cache.get_default', return_value=cache.Cache(':memory:'))
+        self.addCleanup(cache_patcher.stop)
         self.mock_default = cache_patcher.start()
 
         markup = """
             <body>
+                <span>July 14, 2017</span>
+                <span>Central Region Events</span>
+
                 <!-- Untouchables -->
                 <a class="good" href="https://www.google.com" target="_blank">GOOD HYPERLINK</a>
                 <a class="anchor" name="northpole">COUNTED ANCHOR</a>
@@ -68,12 +78,13 @@ class ReviewTests(unittest.TestCase):
             </body>
         """
 
+        self.markup = markup
         self.apple = document.Document(markup)
         self.good_hyperlink = self.apple._data.find('a', class_='good')
         self.good_anchor = self.apple._data.find('a', class_="anchor")
         self.good_jump = self.apple._data.find('a', class_="found")
         self.good_email = self.apple._data.find('a', class_="valid")
-        self.apple.review()
+        self.summary = self.apple.review()
 
     def test_useless_hyperlinks(self):
         """Confirm that all useless hyperlinks are removed."""
@@ -151,6 +162,90 @@ class ReviewTests(unittest.TestCase):
         self.assertEqual('GOOD EMAIL', self.good_email.contents[0].string,
                          'Emails that are valid should not be marked.')
 
+    def test_serial_review(self):
+        """Confirm that a serial review produces the same document and summary as a concurrent one."""
+        banana = document.Document(self.markup)
+        summary = banana.review(jobs=1)
+
+        self.assertEqual(self.summary, summary, 'The summary should not depend on the number of jobs.')
+        self.assertEqual(str(self.apple), str(banana), 'The markings should not depend on the number of jobs.')
+
+    def test_single_pass(self):
+        """Confirm that a review searches the document for its 'a' tags only once."""
+        banana = document.Document(self.markup)
+        with mock.patch.object(banana._data, 'find_all', wraps=banana._data.find_all) as mock_find_all:
+            banana.review()
+        self.assertEqual(1, mock_find_all.call_count, 'The document should be searched once.')
+
+    def test_review_rules(self):
+        """Confirm that a new check joins the single pass of the review through the review rules."""
+        class FtpDocument(document.Document):
+            REVIEW_RULES = ((re.compile(r'^ftp://'), '_check_ftp_link'),) + document.Document.REVIEW_RULES
+
+            def _check_ftp_link(self, link, result, found):
+                result['links']['ftp'] += 1
+
+        banana = FtpDocument(self.markup.replace('https://www.akfusa.org', 'ftp://www.akfusa.org'))
+        summary = banana.review()
+        self.assertEqual(1, summary['links']['ftp'], 'The new check should be applied to the matching tags.')
+        self.assertEqual(0, summary['links']['unchecked'], 'The matching tags should not be checked again.')
+
+    def test_decoded_rules(self):
+        """Confirm that a doubly-tracked link is checked again by the rules that match its decoded href."""
+        banana = document.Document(self.markup.replace(
+            'url=https%3A%2F%2Fjourneyforhealth.org', 'url=mailto%3A%2520ali.samji%2520%40outlook.com'))
+        summary = banana.review()
+        self.assertEqual('mailto:ali.samji@outlook.com', banana._data.find('a', class_='double-tracked')['href'],
+                         'The decoded email should be cleaned.')
+        self.assertEqual(self.summary['links']['decoded'], summary['links']['decoded'],
+                         'The link should still be decoded.')
+        self.assertEqual(self.summary['emails']['cleaned'] + 1, summary['emails']['cleaned'],
+                         'The decoded email should be counted as an email.')
+
+
+class ReferenceTests(unittest.TestCase):
+    """A test suite for the references function."""
+
+    def setUp(self):
+        """Prepare the environment."""
+        self.markup = """
+            <body>
+                <span>July 14, 2017</span>
+                <span>Central Region Events</span>
+                <a href="https://www.google.com" target="_blank">GOOD HYPERLINK</a>
+                <a href="##TrackClick##https://www.google.com">REPEATED HYPERLINK</a>
+                <a href="https://www.akfusa.org"></a>
+                <a href="##TrackClick##">POINTLESS TRACKER</a>
+                <a href="http://www.ismailiinsight.org/enewsletterpro/v.aspx?url=https%3a%2f%2fwww.ismaili">DOUBLE</a>
+                <a href="#northpole">JUMP</a>
+                <a href="mailto:%20ali.samji%20@outlook.com">DIRTY EMAIL</a>
+                <a href="mailto:lcc@usaji.org"></a>
+                <img src="National/logo.png"/>
+                <img src="https://www.google.com/logo.png"/>
+                <img src="National/07.14.2017/A Logo.png"/>
+            </body>
+        """
+        self.apple = document.Document(self.markup)
+
+    def test_references(self):
+        """Confirm that every url, address and image a review would verify is referenced."""
+        references = self.apple.references()
+        self.assertEqual(['https://www.google.com', 'https://www.ismaili'], references['urls'],
+                         'The useful links should be decoded, stripped of trackers and listed once.')
+        self.assertEqual(['ali.samji@outlook.com'], references['addresses'],
+                         'The useful emails should be cleaned.')
+        self.assertEqual([document.Document.BASE_URL + 'National/logo.png', 'https://www.google.com/logo.png',
+                          document.Document.BASE_URL + 'National/07.14.2017/A%20Logo.png'],
+                         references['images'], 'The image sources should be absolute and quoted.')
+        self.assertEqual(document.Document._get_image_source('National/07.14.2017/A Logo.png'),
+                         references['images'][2], 'The image sources should be the ones that apply looks up.')
+
+    def test_unchanged(self):
+        """Confirm that the document is not changed while its references are collected."""
+        before = str(self.apple)
+        self.apple.references()
+        self.assertEqual(before, str(self.apple), 'The document should not be changed.')
+
 
 class RepairTests(unittest.TestCase):
     """Test suite for the repair function."""
@@ -162,6 +257,7 @@ class RepairTests(unittest.TestCase):
     def test_do_nothing(self):
         """Confirm whether the code is not modified unnecessarily."""
         markup = """
+            <!-- July 14, 2017 Central Region Events -->
             <html>
                 <head>
                 </head>
@@ -182,6 +278,7 @@ class RepairTests(unittest.TestCase):
     def test_remove_styles(self):
         """Confirm that the code is stripped of all style tags."""
         markup = """
+            <!-- July 14, 2017 Central Region Events -->
             <html>
                 <head>
                     <style>THIS IS VALID CSS</style>
@@ -199,6 +296,7 @@ class RepairTests(unittest.TestCase):
     def test_website_typo(self):
         """Confirm that the code corrects the typographical error in ismailinsight.org."""
         markup = """
+            <!-- July 14, 2017 Central Region Events -->
             <html>
                 <body>
                     <a href="https://www.ismailinsight.org">FIX THE TYPO</a>
@@ -212,9 +310,34 @@ class RepairTests(unittest.TestCase):
         self.assertEqual("https://www.ismailiinsight.org", apple._data.a['href'],
                          'The typographical error in ismailinsight.org should be fixed.')
 
+    def test_typo_count(self):
+        """Confirm that every typo in the strings and attribute values is counted and corrected in place."""
+        markup = """
+            <!-- July 14, 2017 Central Region Events -->
+            <html>
+                <body>
+                    <!-- see www.ismailinsight.org -->
+                    <a class="ISMAILINSIGHT.ORG other" href="https://www.ismailinsight.org/?r=ismailinsight.org">
+                        Visit IsmailInsight.org today.
+                    </a>
+                    <img alt="ismailinsight.org" src="https://ismailinsight.org/logo.png"/>
+                </body>
+            </html>
+        """
+        apple = document.Document(markup)
+        tree = apple._data
+        summary = apple.repair()
+
+        self.assertEqual(7, summary['typos'], 'Every typo should be counted.')
+        self.assertNotRegex(str(apple), '(?i)ismailinsight', 'Every typo should be corrected.')
+        self.assertEqual(['ismailiinsight.org', 'other'], apple._data.a['class'],
+                         'The typos in multi-valued attributes should be corrected.')
+        self.assertIs(tree, apple._data, 'The document should be corrected without being parsed again.')
+
     def test_gray_background(self):
         """Confirm that the code adds in the gray background if it has been removed."""
         markup = """
+            <!-- July 14, 2017 Central Region Events -->
             <html>
                 <body>
                     <span>MOVE ME</span>
@@ -244,7 +367,7 @@ class TransformTests(unittest.TestCase):
         with open(os.path.join(current_dir, 'files/test.html'), 'r', encoding='UTF-8') as file:
             self._document = document.Document(file.read())
         with open(os.path.join(current_dir, 'files/transform.yml'), 'r', encoding='UTF-8') as file:
-            with mock.patch('document.requests.get', remocks.get):
+            with mock.patch('transport.requests', remocks):
                 self._remaining = self._document.apply(yaml.load(file))
 
     def test_top_transform(self):
@@ -447,3 +570,237 @@ class TransformTests(unittest.TestCase):
         print(tfrd_content)
         self.assertIsNotNone(re.search(desired_content, str(tfrd_content)),
                              'The content should be transformed into a side-by-side table tag containing the content.')
+
+
+class ParserTests(unittest.TestCase):
+    """A test suite to confirm that every parser gives the same results as html5lib.
+
+    For the newsletter in files/test.html, only the line breaks around the html and head tags differ in the
+    output. Around a fragment, html5lib adds an html tag with an empty head, lxml adds an html tag only and
+    html.parser adds nothing. So the documents are compared by the elements, attributes and text of their head
+    and body, ignoring the whitespace.
+    """
+
+    def setUp(self):
+        """Prepare the environment."""
+        request_patcher = mock.patch('transport.requests', remocks)
+        transport_patcher = mock.patch('transport.get_default', return_value=transport.SessionPool())
+        cache_patcher = mock.patch('document.cache.get_default', return_value=cache.Cache(':memory:'))
+        for patcher in (request_patcher, transport_patcher, cache_patcher):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, 'files/test.html'), 'r', encoding='UTF-8') as file:
+            self.newsletter = file.read()
+        self.review_markup = """
+            <body>
+                <span>July 14, 2017</span>
+                <span>Central Region Events</span>
+                <a href="https://www.google.com" target="_blank">GOOD HYPERLINK</a>
+                <a name="northpole">ANCHOR</a>
+                <a href="#northpole">GOOD JUMP</a>
+                <a href="#waldo">BAD JUMP</a>
+                <a href="">BLANK LINK</a>
+                <a href="https://www.shitface.org">BROKEN HYPERLINK</a>
+                <a href="https://www.google.com" target="_self">MISTARGETTED HYPERLINK</a>
+                <a href="mailto:%20ali.samji%20@outlook.com">DIRTY EMAIL</a>
+                <a href="mailto:richard@quickemailverification.com">INVALID EMAIL</a>
+            </body>
+        """
+        self.transforms = {
+            'Content Descriptors Test': {
+                'body': ['This is a paragraph.', ['This is a paragraph ', 'in parts.']]
+            },
+            'Hyperlink Descriptors': {
+                'body': [['Read ', {'link': 'https://the.ismaili', 'text': 'the link'}, '.']],
+                'title': 'A new title'
+            }
+        }
+
+    @staticmethod
+    def _outline(doc):
+        """Get the elements, attributes and text of the head and body in order, ignoring the whitespace."""
+        outline = []
+        nodes = [n for part in (doc._data.head, doc._data.body) if part is not None for n in part.descendants]
+        for node in nodes:
+            if isinstance(node, bs4.Tag):
+                outline.append((node.name, sorted((k, str(v)) for k, v in node.attrs.items())))
+            elif node.strip() != '':
+                outline.append(' '.join(node.split()))
+        return outline
+
+    def _compare(self, operation, markup):
+        """Confirm that operation gives the same result and document with every installed parser as html5lib."""
+        expected = document.Document(markup, parser='html5lib')
+        expected_result = operation(expected)
+        for parser in document.Document.PARSERS[1:]:
+            with self.subTest(parser=parser):
+                try:
+                    actual = document.Document(markup, parser=parser)
+                except bs4.FeatureNotFound:
+                    self.skipTest('{:s} is not installed.'.format(parser))
+                self.assertEqual(expected_result, operation(actual),
+                                 'The {:s} parser should give the same result.'.format(parser))
+                self.assertEqual(self._outline(expected), self._outline(actual),
+                                 'The {:s} parser should give the same document.'.format(parser))
+
+    def test_review(self):
+        """Confirm that a review gives the same summary and markings with every parser."""
+        self._compare(lambda doc: doc.review(), self.review_markup)
+
+    def test_repair(self):
+        """Confirm that a repair gives the same summary and document with every parser."""
+        self._compare(lambda doc: doc.repair(), self.newsletter)
+
+    def test_apply(self):
+        """Confirm that applying a transform gives the same document with every parser."""
+        self._compare(lambda doc: doc.apply(copy.deepcopy(self.transforms)), self.newsletter)
+
+    def test_unknown_parser(self):
+        """Confirm that an unsupported parser is refused."""
+        with self.assertRaises(exceptions.UnknownParser, msg='Only the supported parsers should be used.'):
+            document.Document(self.review_markup, parser='xml')
+
+
+class ImagePrefetchTests(unittest.TestCase):
+    """A test suite to confirm that the images of a transform are measured before it is applied."""
+
+    def setUp(self):
+        """Prepare the environment."""
+        self.db = cache.Cache(':memory:')
+        request_patcher = mock.patch('transport.requests', remocks)
+        transport_patcher = mock.patch('transport.get_default', return_value=transport.SessionPool())
+        cache_patcher = mock.patch('document.cache.get_default', return_value=self.db)
+        for patcher in (request_patcher, transport_patcher, cache_patcher):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, 'files/test.html'), 'r', encoding='UTF-8') as file:
+            self.newsletter = file.read()
+        self.image = 'National/07.14.2017/071417_National.jpg'
+        self.source = document.Document.BASE_URL + self.image
+
+    def test_prefetch(self):
+        """Confirm that every image is measured in a single bulk lookup, however deeply it is nested."""
+        doc = document.Document(self.newsletter)
+        transforms = {
+            'Content Descriptors Test': {
+                'body': [{'image': self.image, 'caption': 'A caption.'},
+                         {'bullets': [['See ', {'image': self.image}]]}]
+            }
+        }
+        self.assertEqual((self.image, self.image), transform.Plan(transforms).images,
+                         'Every image descriptor should be found.')
+
+        with mock.patch.object(self.db, 'lookup_images', wraps=self.db.lookup_images) as lookup_images, \
+                mock.patch.object(self.db, 'get_image', wraps=self.db.get_image) as get_image:
+            doc.apply(transforms, jobs=2)
+
+        lookup_images.assert_called_once_with([self.source], concurrency=2)
+        self.assertFalse(get_image.called, 'The prefetched images should not be looked up one at a time.')
+        images = doc._data.find_all('img', src=self.source)
+        self.assertEqual([('400', '267')] * 2, [(str(i['width']), str(i['height'])) for i in images],
+                         'Every image should be added with the prefetched dimensions.')
+
+    def test_prefetch_failure(self):
+        """Confirm that the document is left untouched if one of the images cannot be measured."""
+        doc = document.Document(self.newsletter)
+        original = str(doc)
+        transforms = {
+            'Content Descriptors Test': {'body': ['A new paragraph.', {'image': self.image}]},
+            'Hyperlink Descriptors': {'body': [{'image': 'National/missing.jpg'}]}
+        }
+        with self.assertRaises(KeyError, msg='The image that cannot be measured should raise its error.'):
+            doc.apply(transforms)
+        self.assertEqual(original, str(doc), 'No transform should be applied before every image is measured.')
+        self.assertEqual([self.source], list(self.db.get_images([self.source])['fresh']),
+                         'The images that could be measured should still be cached.')
+
+    def test_invalid_transform(self):
+        """Confirm that an invalid transform is refused before any image is measured or any tag is changed."""
+        doc = document.Document(self.newsletter)
+        original = str(doc)
+        transforms = {
+            'Content Descriptors Test': {'body': [{'image': self.image}]},
+            'Hyperlink Descriptors': {'body': [{'link': 'https://the.ismaili', 'txt': 'A typo.'}]}
+        }
+        with mock.patch.object(self.db, 'lookup_images') as lookup_images:
+            with self.assertRaises(exceptions.UnknownTransform, msg='The unknown key should be refused.'):
+                doc.apply(transforms)
+        self.assertFalse(lookup_images.called, 'No image should be measured for an invalid transform.')
+        self.assertEqual(original, str(doc), 'No transform should be applied if one of them is invalid.')
+
+    def test_plan_reuse(self):
+        """Confirm that a plan is left unchanged by the documents it is applied to."""
+        plan = transform.Plan({
+            'Content Descriptors Test': {'body': ['A new paragraph.']},
+            'No Such Article': {'title': 'Never applied.'}
+        })
+        expected = copy.deepcopy(plan.source)
+        for doc in (document.Document(self.newsletter), document.Document(self.newsletter)):
+            self.assertEqual({'No Such Article': {'title': 'Never applied.'}}, doc.apply(plan),
+                             'Only the transforms that were not applied should be returned.')
+            self.assertIn('A new paragraph.', str(doc), 'The plan should be applied to every document.')
+        self.assertEqual(expected, plan.source, 'The plan should not be changed by applying it.')
+
+
+class FragmentTests(unittest.TestCase):
+    """A test suite to confirm that copying the fragments of a plan gives the same document as building it."""
+
+    def setUp(self):
+        """Prepare the environment."""
+        request_patcher = mock.patch('transport.requests', remocks)
+        transport_patcher = mock.patch('transport.get_default', return_value=transport.SessionPool())
+        cache_patcher = mock.patch('document.cache.get_default', return_value=cache.Cache(':memory:'))
+        for patcher in (request_patcher, transport_patcher, cache_patcher):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, 'files/test.html'), 'r', encoding='UTF-8') as file:
+            self.newsletter = file.read()
+        with open(os.path.join(current_dir, 'files/transform.yml'), 'r', encoding='UTF-8') as file:
+            transforms = yaml.safe_load(file)
+        del transforms['top']  # the newsletter has no front image to replace
+        self.plan = transform.Plan(transforms)
+
+    @staticmethod
+    def _build(doc, plan):
+        """Build the content of the plan in the document itself with _set_content, as apply did before fragments."""
+        doc._images = document.Document.prefetch_images(plan.images)
+        applied = set()
+        for art in doc._data.find_all(doc._is_article_title):
+            if art.parent.name == 'a':
+                art = art.parent
+            title = art.text.strip()
+            if title not in plan.articles or title in applied:
+                continue
+            applied.add(title)
+            group = plan.articles[title]
+            before_body = art.find_next_sibling(doc._is_before_body)
+            after_body = art.find_next_sibling(doc._is_before_return)
+            if 'left' in group:
+                doc._clear_body(before_body, after_body)
+                doc._add_left_right(before_body, group)
+            elif 'body' in group:
+                doc._clear_body(before_body, after_body)
+                doc._add_paragraphs(before_body, group, 'body')
+            if 'title' in group:
+                doc._set_content(art, group['title'])
+
+    def test_equivalence(self):
+        """Confirm that every kind of content is copied from the fragments exactly as it would be built."""
+        for parser in document.Document.PARSERS:
+            with self.subTest(parser=parser):
+                try:
+                    expected = document.Document(self.newsletter, parser=parser)
+                except bs4.FeatureNotFound:
+                    self.skipTest('{:s} is not installed.'.format(parser))
+                self._build(expected, self.plan)
+                actual = document.Document(self.newsletter, parser=parser)
+                fragments = document.Fragments(self.plan, document.Document.prefetch_images(self.plan.images),
+                                               parser=parser)
+                self.assertEqual({}, actual.apply(fragments), 'Every transform should be applied.')
+                self.assertEqual(str(expected), str(actual), 'The copies should be the same as the built content.')
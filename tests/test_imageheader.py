@@ -0,0 +1,44 @@
+"""Tests to ensure that the dimensions of images are read correctly from their headers."""
+import os
+import struct
+import unittest
+import imageheader
+
+
+class DimensionTests(unittest.TestCase):
+    """A test suite to confirm which headers give the dimensions of their image."""
+
+    def setUp(self):
+        """Read the JPEG image used by the tests."""
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/071417_National.jpg'), 'rb') as file:
+            self.jpeg = file.read()
+
+    def test_jpeg(self):
+        """Confirm that the dimensions of a JPEG image are read past its other segments."""
+        self.assertEqual((400, 267), imageheader.get_dimensions(self.jpeg[:imageheader.SNIFF_SIZE]),
+                         'The dimensions should be read from the start of frame segment.')
+
+    def test_png(self):
+        """Confirm that the dimensions of a PNG image are read from its IHDR chunk."""
+        header = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 640, 480)
+        self.assertEqual((640, 480), imageheader.get_dimensions(header), 'The dimensions should be big-endian.')
+
+    def test_gif(self):
+        """Confirm that the dimensions of a GIF image are read from its logical screen descriptor."""
+        header = b'GIF89a' + struct.pack('<HH', 320, 200)
+        self.assertEqual((320, 200), imageheader.get_dimensions(header), 'The dimensions should be little-endian.')
+
+    def test_supported(self):
+        """Confirm that only the formats whose headers are understood are supported."""
+        self.assertTrue(imageheader.is_supported(self.jpeg[:2]), 'JPEG images should be supported.')
+        self.assertTrue(imageheader.is_supported(b'GIF87a'), 'GIF images should be supported.')
+        self.assertFalse(imageheader.is_supported(b'RIFF\x00\x00\x00\x00WEBP'), 'WebP images should not be supported.')
+
+    def test_inconclusive(self):
+        """Confirm that headers of unknown formats or that end too early give no dimensions."""
+        self.assertIsNone(imageheader.get_dimensions(self.jpeg[:64]),
+                          'A JPEG header that ends before its start of frame should give no dimensions.')
+        self.assertIsNone(imageheader.get_dimensions(b'\x89PNG\r\n\x1a\n'),
+                          'A PNG header without its IHDR chunk should give no dimensions.')
+        self.assertIsNone(imageheader.get_dimensions(b'<html></html>'),
+                          'An unknown format should give no dimensions.')
@@ -1,11 +1,19 @@
 """Tests to confirm the operation of the CLI."""
 import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import json
 import unittest
 from unittest import mock
 import pasteboard
 import main
+import remocks
 import cache
 import document
+import exceptions
+import transport
 
 
 class LookupTests(unittest.TestCase):
@@ -93,14 +101,15 @@ class ManipulationTests(unittest.TestCase):
                     'cleaned': 0,
                     'invalid': 0,
                     'unchecked': 0
-                }
+                },
+            'hosts': {}
             }
         self._document.repair.return_value = {
             'typos': 0,
             'styles': 0,
             'background': 0
         }
-        document_patcher = mock.patch('main.document.Document.__new__', return_value=self._document)
+        document_patcher = mock.patch('document.Document', return_value=self._document)
         self.addCleanup(document_patcher.stop)
         self.mock_document = document_patcher.start()
 
@@ -110,7 +119,7 @@ class ManipulationTests(unittest.TestCase):
         pasteboard.set(code)
         main.main('review -p'.split())
 
-        self.mock_document.assert_called_with(document.Document, code)
+        self.mock_document.assert_called_with(code, parser=None)
         self.assertTrue(self._document.review.called, 'The document should be reviewed.')
         self.assertEqual(code, pasteboard.get(),
                          'The reviewed document should be put back on the pasteboard.')
@@ -121,12 +130,154 @@ class ManipulationTests(unittest.TestCase):
         pasteboard.set(code)
         main.main('repair -p'.split())
 
-        self.mock_document.assert_called_with(document.Document, code)
+        self.mock_document.assert_called_with(code, parser=None)
         self.assertTrue(self._document.repair.called, 'The document should be repaired.')
         self.assertEqual(code, pasteboard.get(),
                          'The repaired document should be put back on the pasteboard.')
 
 
+class CacheTests(unittest.TestCase):
+    """A test suite to confirm the operation of the cache command."""
+
+    def setUp(self):
+        """Prepare the environment."""
+        self._document = mock.MagicMock(document.Document)
+        self._document.references.return_value = {
+            'urls': ['https://www.google.com', 'https://www.akfusa.org'],
+            'addresses': ['ali.samji@outlook.com'],
+            'images': ['https://www.google.com/logo.png']
+        }
+        document_patcher = mock.patch('document.Document', return_value=self._document)
+        self.addCleanup(document_patcher.stop)
+        document_patcher.start()
+
+        self._cache = mock.MagicMock(cache.Cache)
+        self._cache.get_webpages.return_value = {
+            'fresh': {'https://www.google.com': None},
+            'stale': {'https://www.akfusa.org': None},
+            'missing': []
+        }
+        self._cache.get_emails.return_value = {'fresh': {}, 'stale': {}, 'missing': ['ali.samji@outlook.com']}
+        self._cache.get_images.return_value = {'fresh': {}, 'stale': {}, 'missing': ['https://www.google.com/logo.png']}
+        self._cache.lookup_webpages.return_value = {}
+        self._cache.lookup_images.return_value = {}
+        self._cache.lookup_emails.return_value = {'ali.samji@outlook.com': KeyError('safe_to_send')}
+        factory_patcher = mock.patch('main.cache.get_default', return_value=self._cache)
+        self.addCleanup(factory_patcher.stop)
+        factory_patcher.start()
+
+        self.html_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/test.html')
+
+    def test_warm(self):
+        """Confirm that only the references that are not fresh are looked up, and all of them at once."""
+        with mock.patch('builtins.print') as mock_print:
+            main.main(['cache', 'warm', '-j', '4', self.html_path, self.html_path])
+
+        self._cache.get_webpages.assert_called_with(['https://www.google.com', 'https://www.akfusa.org'] * 2)
+        self._cache.lookup_webpages.assert_called_once_with(['https://www.akfusa.org'], concurrency=4, strict=False)
+        self._cache.lookup_emails.assert_called_once_with(['ali.samji@outlook.com'], concurrency=4, strict=False)
+        self._cache.get_images.assert_called_with(['https://www.google.com/logo.png'] * 2)
+        self._cache.lookup_images.assert_called_once_with(['https://www.google.com/logo.png'],
+                                                          concurrency=4, strict=False)
+        report = mock_print.call_args[0]
+        self.assertEqual('Webpages: 1 fresh, 1 refreshed, 0 failed.', report[0],
+                         'The webpages should be counted by their state.')
+        self.assertEqual('Emails: 0 fresh, 0 refreshed, 1 failed.', report[1],
+                         'The failed lookups should be counted.')
+        self.assertEqual('Images: 0 fresh, 1 refreshed, 0 failed.', report[2],
+                         'The images should be measured apart from the webpages.')
+
+    def test_gc(self):
+        """Confirm that the garbage collection options are passed on to the cache."""
+        self._cache.collect_garbage.return_value = {'expired': 3, 'evicted': 2, 'reclaimed': 4096}
+        with mock.patch('builtins.print') as mock_print:
+            main.main('cache gc --older-than 90 --max-rows 1000'.split())
+
+        self._cache.collect_garbage.assert_called_with(older_than=90, max_rows=1000)
+        self.assertEqual('4096 bytes reclaimed.', mock_print.call_args[0][2], 'The reclaimed bytes should be reported.')
+
+    def test_stats(self):
+        """Confirm that the statistics are printed as JSON when asked."""
+        self._cache.get_stats.return_value = {'size': 4096, 'tables': {}, 'reads': {}, 'hosts': {}, 'statuses': {}}
+        with mock.patch('builtins.print') as mock_print:
+            main.main('cache stats --reset --json'.split())
+
+        self.assertTrue(self._cache.reset_stats.called, 'The counters should be reset first.')
+        self.assertEqual(4096, json.loads(mock_print.call_args[0][0])['size'], 'The statistics should be JSON.')
+
+    def test_no_change(self):
+        """Confirm that warming the cache does not write to the files."""
+        with mock.patch('main.set_code') as mock_set, mock.patch('builtins.print'):
+            main.main(['cache', 'warm', self.html_path])
+        mock_set.assert_not_called()
+
+
+class ApplyTests(unittest.TestCase):
+    """A test suite to confirm that a transform is applied to several templates at once."""
+
+    def setUp(self):
+        """Prepare three copies of a template and a transform for them."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db = cache.Cache(':memory:')
+        patchers = (mock.patch('transport.requests', remocks),
+                    mock.patch('transport.get_default', return_value=transport.SessionPool()),
+                    mock.patch('cache.get_default', return_value=self.db),
+                    mock.patch('transform.PLAN_DIR', os.path.join(self.directory, 'plans')))
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        self.paths = [os.path.join(self.directory, '{:s}.html'.format(r)) for r in ('central', 'western', 'florida')]
+        for path in self.paths:
+            shutil.copy(os.path.join(current_dir, 'files/test.html'), path)
+        self.transform_path = os.path.join(self.directory, 'transform.yml')
+        with open(self.transform_path, 'w', encoding='UTF-8') as file:
+            file.write('Content Descriptors Test:\n'
+                       '  body:\n'
+                       '    - A paragraph for every region.\n'
+                       '    - image: National/07.14.2017/071417_National.jpg\n'
+                       'No Such Article:\n'
+                       '  title: Never applied.\n')
+
+    def test_batch(self):
+        """Confirm that every template is transformed while the images are measured only once."""
+        with mock.patch.object(self.db, 'lookup_images', wraps=self.db.lookup_images) as lookup_images, \
+                mock.patch('builtins.print') as mock_print:
+            main.main(['apply', '--workers', '2', self.transform_path] + self.paths)
+
+        self.assertEqual(1, lookup_images.call_count, 'The images should be measured once for all of the templates.')
+        for path in self.paths:
+            code = main.get_code(path)
+            self.assertIn('A paragraph for every region.', code, 'Every template should be transformed.')
+            self.assertIn('071417_National.jpg" width="400"', code, 'Every template should get the image.')
+            mock_print.assert_any_call('{:s}: The following transforms could not be applied:'.format(path))
+
+    def test_failure(self):
+        """Confirm that a template that fails is reported and raised once the others are transformed."""
+        missing = os.path.join(self.directory, 'missing.html')
+        with mock.patch('builtins.print') as mock_print:
+            with self.assertRaises(FileNotFoundError, msg='The error of the template should be raised.'):
+                main.main(['apply', '--workers', '2', self.transform_path, missing] + self.paths)
+
+        printed = [c[0][0] for c in mock_print.call_args_list]
+        self.assertTrue(any(p.startswith('{:s}: The transform could not be applied.'.format(missing)) for p in printed),
+                        'The template that failed should be reported.')
+        for path in self.paths:
+            self.assertIn('A paragraph for every region.', main.get_code(path),
+                          'The other templates should be transformed.')
+
+    def test_invalid_transform(self):
+        """Confirm that an invalid transform is refused before any template is read."""
+        with open(self.transform_path, 'a', encoding='UTF-8') as file:
+            file.write('  bdy:\n    - A typo.\n')
+        with mock.patch('main.get_code') as mock_get:
+            with self.assertRaises(exceptions.InvalidTransform, msg='The invalid transform should be refused.'):
+                main.main(['apply', self.transform_path] + self.paths)
+        mock_get.assert_not_called()
+
+
 class BugTests(unittest.TestCase):
     """A test suite to confirm that no bugs resurface."""
 
@@ -134,3 +285,35 @@ class BugTests(unittest.TestCase):
         """Confirm that the reading from a file selects the correct encoding."""
         main.get_code(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files/test.html'))
         # This should not throw an error
+
+
+class StartupTests(unittest.TestCase):
+    """A test suite to confirm that the actions that do not need the heavy modules start quickly."""
+
+    HEAVY_MODULES = ('bs4', 'requests', 'yaml', 'PIL', 'document', 'pasteboard')
+    TIME_LIMIT = 2.0  # Generous to keep slow machines from failing, yet far below importing everything.
+
+    def _run(self, *args):
+        """Run the program with args in a fresh interpreter and get the heavy modules it imported and its time."""
+        script = ('import sys, time, json\n'
+                  'start = time.monotonic()\n'
+                  'import main\n'
+                  'main.main({!r:})\n'
+                  'print(json.dumps([time.monotonic() - start, sorted(m for m in {!r:} if m in sys.modules)]))'
+                  ).format(list(args), self.HEAVY_MODULES)
+        src = os.path.dirname(os.path.abspath(main.__file__))
+        output = subprocess.run([sys.executable, '-c', script], cwd=src, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def test_version(self):
+        """Confirm that printing the version imports none of the heavy modules."""
+        seconds, imported = self._run('version')
+        self.assertEqual([], imported, 'The version action should not import the heavy modules.')
+        self.assertLess(seconds, self.TIME_LIMIT, 'The version action should start quickly.')
+
+    def test_help(self):
+        """Confirm that printing the help of an action imports none of the heavy modules."""
+        seconds, imported = self._run('help', 'review')
+        self.assertEqual([], imported, 'The help action should not import the heavy modules.')
+        self.assertLess(seconds, self.TIME_LIMIT, 'The help action should start quickly.')
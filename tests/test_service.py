@@ -0,0 +1,99 @@
+"""Tests to ensure correct operation of the cache service."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import cache
+import exceptions
+import remocks
+import service
+import transport
+
+
+class ServiceTests(unittest.TestCase):
+    """A test suite to confirm that a remote cache behaves like the cache it uses."""
+
+    def setUp(self):
+        """Serve an in-memory cache on a socket in a temporary directory and connect to it."""
+        request_patcher = mock.patch('transport.requests', remocks)
+        transport_patcher = mock.patch('transport.get_default', return_value=transport.SessionPool())
+        self.addCleanup(request_patcher.stop)
+        self.addCleanup(transport_patcher.stop)
+        request_patcher.start()
+        transport_patcher.start()
+
+        socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, socket_dir)
+        self.socket_path = os.path.join(socket_dir, 'cache.sock')
+        self.server = service.CacheServer(self.socket_path, cache.Cache(':memory:'))
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+        self.remote = service.RemoteCache(self.socket_path)
+        self.addCleanup(self.remote.close)
+
+    def test_round_trip(self):
+        """Confirm that the entries come back from the service with their types."""
+        self.remote.set_email('ali.samji@outlook.com', False)
+        info = self.remote.get_email('ali.samji@outlook.com', nolookup=True)
+        self.assertEqual((False, 'user_refuted'), (info.is_valid, info.reason),
+                         'The entry should be read from the service.')
+        self.assertEqual(self.server.cache.get_email('ali.samji@outlook.com').last_lookup, info.last_lookup,
+                         'The lookup time should be a datetime object.')
+
+    def test_errors(self):
+        """Confirm that the errors of the cache are raised by the remote cache."""
+        self.assertRaises(exceptions.CacheMissException, self.remote.get_webpage, 'https://www.techcrunch.com',
+                          nolookup=True)
+        errors = self.remote.lookup_emails({'nobody@nowhere.org'}, strict=False)
+        self.assertIsInstance(errors['nobody@nowhere.org'], exceptions.ServiceException,
+                              'The failures of a lenient lookup should be returned as exceptions.')
+
+    def test_shared(self):
+        """Confirm that every client shares the same cache."""
+        self.remote.lookup_webpages(['https://www.akfusa.org'])
+        other = service.RemoteCache(self.socket_path)
+        self.addCleanup(other.close)
+        webpages = other.get_webpages(['https://www.akfusa.org'])
+        self.assertEqual(403, webpages['fresh']['https://www.akfusa.org'].status,
+                         'A lookup by one client should be read by the others.')
+
+    def test_open_circuits(self):
+        """Confirm that the hosts skipped by the service are reported to its clients."""
+        breaker = self.server.cache._transport.breaker('https://www.jubileeconcerts.ismaili')
+        for i in range(transport.MAX_FAILURES):
+            breaker.record_failure(ConnectionError('Connection refused'))
+        self.assertEqual({'www.jubileeconcerts.ismaili': breaker.reason}, self.remote.open_circuits(),
+                         'The hosts skipped by the service should be reported.')
+
+    def test_permissions(self):
+        """Confirm that only the user that runs the service may connect to it."""
+        self.assertEqual(0o600, os.stat(self.socket_path).st_mode & 0o777, 'The socket should be private.')
+
+    def test_dump_stats(self):
+        """Confirm that a remote cache dumps the counters of the service along with those of the database."""
+        self.remote.set_email('ali.samji@outlook.com', True)
+        self.remote.get_email('ali.samji@outlook.com')
+        stats_path = os.path.join(os.path.dirname(self.socket_path), 'stats.json')
+        self.remote.dump_stats(stats_path)
+        with open(stats_path, 'r', encoding='UTF-8') as stats_file:
+            stats = json.load(stats_file)
+        self.assertEqual({'fresh': 1}, stats['run']['reads']['emails'], 'The reads of the service should be dumped.')
+        self.assertIn('tables', stats['database'], 'The statistics of the database should be dumped.')
+
+    def test_default(self):
+        """Confirm that the default cache uses the service only when it is running."""
+        with mock.patch('service.SOCKET_PATH', self.socket_path), mock.patch('cache._cache', None), \
+                mock.patch('cache.STATS_PATH', 'stats.json'), mock.patch('cache.atexit') as mock_atexit:
+            default = cache.get_default()
+            self.addCleanup(default.close)
+            self.assertIsInstance(default, service.RemoteCache, 'The running service should be used.')
+        mock_atexit.register.assert_called_with(default.dump_stats, 'stats.json')
+        self.assertFalse(service.is_running(self.socket_path + '.missing'),
+                         'A missing socket should not be used.')
@@ -0,0 +1,128 @@
+"""Tests to ensure that transforms are checked, compiled and kept correctly."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import exceptions
+import transform
+
+
+class CompileTests(unittest.TestCase):
+    """A test suite to confirm which transforms are compiled into plans."""
+
+    def test_compile(self):
+        """Confirm that the content is compiled into its kinds and that every image is found."""
+        plan = transform.Plan({
+            'top': {'image': 'top.jpg', 'caption': 'A caption.'},
+            'An Article': {
+                'body': ['A paragraph.', ['Read ', {'link': 'https://the.ismaili', 'text': {'bold': 'this'}}]],
+                'title': {'anchor': 'here'}
+            },
+            'Another Article': {
+                'left': [{'numbers': [{'image': 'left.jpg', 'caption': 2017}]}],
+                'right': ['Beside it.']
+            }
+        })
+        self.assertEqual({'image': 'top.jpg', 'caption': ('A caption.',)}, plan.top,
+                         'The top image and its caption should be compiled.')
+        self.assertEqual((('A paragraph.',), ('Read ', ('hyperlink', {
+            'link': 'https://the.ismaili', 'text': (('formatted', {'bold': ('this',)}),)}))),
+            plan.articles['An Article']['body'], 'Every paragraph should be compiled into items of their kind.')
+        self.assertEqual((('navigation', {'anchor': 'here'}),), plan.articles['An Article']['title'],
+                         'The title should be compiled as content.')
+        self.assertEqual(('top.jpg', 'left.jpg'), plan.images,
+                         'Every image should be found, however deeply it is nested.')
+
+    def test_unknown_descriptor(self):
+        """Confirm that the descriptors with unknown or conflicting keys are refused."""
+        for descriptor in ({'lnk': 'https://the.ismaili'}, {'link': 'https://the.ismaili', 'txt': 'Typo'},
+                           {'bold': 'Both', 'italics': 'Both'}):
+            with self.subTest(descriptor=descriptor):
+                with self.assertRaises(exceptions.UnknownTransform, msg='The descriptor should be refused.'):
+                    transform.Plan({'An Article': {'body': [['Some text ', descriptor]]}})
+
+    def test_invalid_structure(self):
+        """Confirm that the transforms that are not shaped as expected are refused."""
+        for transforms in ({'An Article': {'left': ['Without its right.']}},
+                           {'An Article': {'bdy': ['A typo.']}},
+                           {'An Article': {'body': 'Not a list.'}},
+                           {'An Article': {'body': [['A list', ['in a list.']]]}},
+                           {'top': {'image': 'top.jpg'}},
+                           {'An Article': 'Not a mapping.'}):
+            with self.subTest(transforms=transforms):
+                with self.assertRaises(exceptions.InvalidTransform, msg='The transforms should be refused.'):
+                    transform.Plan(transforms)
+
+
+class PlanCacheTests(unittest.TestCase):
+    """A test suite to confirm that compiled plans are kept on disk and used again."""
+
+    def setUp(self):
+        """Prepare a transform file and an empty plan directory."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        plan_dir_patcher = mock.patch('transform.PLAN_DIR', os.path.join(self.directory, 'plans'))
+        plan_dir_patcher.start()
+        self.addCleanup(plan_dir_patcher.stop)
+        self.path = os.path.join(self.directory, 'transform.yml')
+        self._write('top:\n  image: top.jpg\n  caption: [A caption, {bold: here}]\n'
+                    'An Article:\n  body:\n    - A paragraph.\n')
+
+    def _write(self, code):
+        """Write the code to the transform file."""
+        with open(self.path, 'w', encoding='UTF-8') as file:
+            file.write(code)
+
+    def test_cached(self):
+        """Confirm that the transform file is only parsed the first time it is loaded."""
+        with mock.patch('yaml.safe_load', wraps=__import__('yaml').safe_load) as safe_load:
+            first = transform.load(self.path)
+            second = transform.load(self.path)
+        self.assertEqual(1, safe_load.call_count, 'The plan should be read from the disk the second time.')
+        self.assertEqual((first.source, first.top, first.articles, first.images),
+                         (second.source, second.top, second.articles, second.images),
+                         'The cached plan should be the same as the compiled one.')
+
+    def test_stored_as_json(self):
+        """Confirm that a plan is stored as JSON, which is never run when it is read."""
+        transform.load(self.path)
+        names = os.listdir(transform.PLAN_DIR)
+        self.assertEqual(1, len(names), 'A single plan should be stored.')
+        with open(os.path.join(transform.PLAN_DIR, names[0]), 'r', encoding='UTF-8') as file:
+            self.assertEqual(transform.Plan.FORMAT, json.load(file)['format'], 'The plan should be JSON.')
+
+    def test_checked_out(self):
+        """Confirm that a transform file whose contents did not change is not compiled again."""
+        transform.load(self.path)
+        os.utime(self.path, (0, 0))
+        with mock.patch('yaml.safe_load') as safe_load:
+            transform.load(self.path)
+        safe_load.assert_not_called()
+
+    @mock.patch('transform.MAX_PLANS', 2)
+    def test_bounded(self):
+        """Confirm that only the most recently used plans are kept."""
+        first_path = transform._get_plan_path(self.path)[0]
+        transform.load(self.path)
+        os.utime(first_path, (0, 0))
+        for i in range(2):
+            self._write('An Article:\n  body:\n    - Paragraph {:d}.\n'.format(i))
+            transform.load(self.path)
+        self.assertEqual(2, len(os.listdir(transform.PLAN_DIR)), 'Only MAX_PLANS plans should be kept.')
+        self.assertFalse(os.path.exists(first_path), 'The least recently used plan should be deleted.')
+
+    def test_changed(self):
+        """Confirm that a transform file is compiled again once it changes."""
+        transform.load(self.path)
+        self._write('An Article:\n  body:\n    - Another paragraph.\n')
+        self.assertEqual({'body': (('Another paragraph.',),)}, transform.load(self.path).articles['An Article'],
+                         'The changed transform file should be compiled again.')
+
+    def test_invalid(self):
+        """Confirm that an invalid transform file is refused and not cached."""
+        self._write('An Article:\n  body:\n    - lnk: https://the.ismaili\n')
+        with self.assertRaises(exceptions.UnknownTransform, msg='The invalid transform file should be refused.'):
+            transform.load(self.path)
+        self.assertFalse(os.path.exists(transform.PLAN_DIR), 'No plan should be kept for an invalid transform file.')
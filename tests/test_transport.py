@@ -0,0 +1,115 @@
+"""Tests to ensure correct operation of the session pool."""
+import unittest
+from unittest import mock
+import requests
+import transport
+import exceptions
+import remocks
+
+
+class SessionPoolTests(unittest.TestCase):
+    """A test suite to confirm that connections are pooled per host."""
+
+    def setUp(self):
+        """Mock out the requests library and create the session pool."""
+        requests_patcher = mock.patch('transport.requests', remocks)
+        self.addCleanup(requests_patcher.stop)
+        requests_patcher.start()
+
+        self._pool = transport.SessionPool(10, {'ismailiinsight.org': 20},
+                                           (10.0, 10, 4), {'api.quickemailverification.com': (2.0, 5, 2)}, 2)
+
+    def test_session_reuse(self):
+        """Confirm that one session is used for every request to the same host."""
+        self.assertIs(self._pool.session('https://www.google.com'),
+                      self._pool.session('https://www.google.com/search?q=ismaili'),
+                      'Requests to the same host should share a session.')
+        self.assertIsNot(self._pool.session('https://www.google.com'),
+                         self._pool.session('https://www.akfusa.org'),
+                         'Requests to different hosts should not share a session.')
+
+    def test_host_pool_sizes(self):
+        """Confirm that the pool size of a domain applies to its subdomains."""
+        self.assertEqual(20, self._pool._get_pool_size('www.ismailiinsight.org'),
+                         'A subdomain should use the pool size of its domain.')
+        self.assertEqual(10, self._pool._get_pool_size('www.google.com'),
+                         'An unlisted host should use the default pool size.')
+
+    def test_order_by_host(self):
+        """Confirm that urls are grouped by host in the order they first appear."""
+        urls = ['https://www.google.com/a', 'https://www.akfusa.org', 'https://WWW.GOOGLE.COM/b']
+        self.assertEqual(['https://www.google.com/a', 'https://WWW.GOOGLE.COM/b', 'https://www.akfusa.org'],
+                         transport.order_by_host(urls),
+                         'The urls for the same host should be next to each other.')
+
+    def test_total_size(self):
+        """Confirm that the size of the whole resource is read from the headers of full and partial responses."""
+        partial = mock.Mock(status_code=206, headers={'Content-Range': 'bytes 0-8191/106404', 'Content-Length': '8192'})
+        self.assertEqual(106404, transport.get_total_size(partial), 'The size should come from the Content-Range.')
+        full = mock.Mock(status_code=200, headers={'Content-Length': '106404'})
+        self.assertEqual(106404, transport.get_total_size(full), 'The size should come from the Content-Length.')
+        unknown = mock.Mock(status_code=206, headers={'Content-Range': 'bytes 0-8191/*'})
+        self.assertIsNone(transport.get_total_size(unknown), 'An unknown size should be None.')
+
+    def test_host_limiters(self):
+        """Confirm that the email verification API is limited separately from other hosts."""
+        api_limiter = self._pool.limiter('http://api.quickemailverification.com/v1/verify?email=lcc@usaji.org')
+        self.assertIs(api_limiter, self._pool.limiter('http://api.quickemailverification.com/v1/verify'),
+                      'Requests to the same host should share a limiter.')
+        self.assertIsNot(api_limiter, self._pool.limiter('https://www.google.com'),
+                         'Requests to different hosts should not share a limiter.')
+        self.assertEqual(2.0, api_limiter._bucket._rate, 'The API should use its own quota.')
+
+    def test_circuit_breaker(self):
+        """Confirm that a host is skipped without touching the network once it has failed too often."""
+        url = 'https://www.jubileeconcerts.ismaili'
+        for i in range(2):
+            self.assertRaises(requests.exceptions.ConnectionError, self._pool.head, url)
+        calls = remocks.head.call_count
+        self.assertRaises(exceptions.HostUnavailableException, self._pool.head, url)
+
+        self.assertEqual(calls, remocks.head.call_count, 'A host that keeps failing should not be contacted.')
+        self.assertEqual({'www.jubileeconcerts.ismaili'}, set(self._pool.open_circuits()),
+                         'The skipped host should be reported.')
+
+    @mock.patch('transport.time.monotonic', return_value=0.0)
+    def test_circuit_retry(self, mock_monotonic):
+        """Confirm that a skipped host is tried once after a while and no longer skipped once it answers."""
+        pool = transport.SessionPool(max_failures=2, retry_after=60)
+        url = 'https://www.jubileeconcerts.ismaili'
+        for i in range(2):
+            self.assertRaises(requests.exceptions.ConnectionError, pool.head, url)
+        mock_monotonic.return_value = 30.0
+        self.assertRaises(exceptions.HostUnavailableException, pool.head, url)
+
+        mock_monotonic.return_value = 60.0
+        self.assertRaises(requests.exceptions.ConnectionError, pool.head, url)
+        self.assertRaises(exceptions.HostUnavailableException, pool.head, url)
+        self.assertIn('www.jubileeconcerts.ismaili', pool.open_circuits(),
+                      'A failed retry should keep the circuit open.')
+
+        mock_monotonic.return_value = 120.0
+        with mock.patch.object(remocks, 'head', return_value=remocks.Response(url)):
+            pool.head(url)
+        self.assertEqual({}, pool.open_circuits(), 'A retry that reaches the host should close the circuit.')
+
+
+class TokenBucketTests(unittest.TestCase):
+    """A test suite to confirm the rate limiting of the token bucket."""
+
+    @mock.patch('transport.time')
+    def test_burst_then_wait(self, mock_time):
+        """Confirm that a burst is allowed right away and that later events wait for the bucket to refill."""
+        clock = [0.0]
+        mock_time.monotonic.side_effect = lambda: clock[0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+        mock_time.sleep.side_effect = sleep
+
+        bucket = transport.TokenBucket(2.0, 3)
+        for i in range(3):
+            bucket.acquire()
+        self.assertEqual(0.0, clock[0], 'A full bucket should allow a burst without waiting.')
+        bucket.acquire()
+        self.assertAlmostEqual(0.5, clock[0], msg='An empty bucket should wait for a token to be added.')